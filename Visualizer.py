@@ -2,6 +2,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 from datastream import UARTParser
+from gui_common import pointCloudColumn
 import time
 from serial.tools import list_ports
 
@@ -55,10 +56,10 @@ class LiveSensorVisualization:
         self.ax1.set_ylabel('Y')
         self.ax1.set_zlabel('Z')
         self.ax1.scatter(
-            point_cloud[:, 0],  # X coordinates
-            point_cloud[:, 1],  # Y coordinates
-            point_cloud[:, 2],  # Z coordinates
-            c=point_cloud[:, 6],  # Color based on the last column
+            pointCloudColumn(point_cloud, 0),  # X coordinates
+            pointCloudColumn(point_cloud, 1),  # Y coordinates
+            pointCloudColumn(point_cloud, 2),  # Z coordinates
+            c=pointCloudColumn(point_cloud, 6),  # Color based on the track index column
             cmap='viridis'
         )
         
@@ -0,0 +1,126 @@
+import time
+import threading
+
+from uart_framer import UARTFramer
+
+import logging
+log = logging.getLogger(__name__)
+
+# Threaded UART acquisition
+# An AcquisitionThread keeps draining a serial port into a FrameRing of raw frames, so a slow consumer (a JSON dump,
+# a plot redraw) no longer stops the port from being read and the OS buffer from overflowing. Frames are only parsed
+# when the consumer takes them out of the ring. UARTParser.startAcquisition() sets this up.
+
+# What the reader thread does when the ring is full
+RING_BLOCK = 'block' # Wait for the consumer. Nothing is dropped here, but the OS buffer can still overflow.
+RING_DROP_OLDEST = 'dropOldest' # Overwrite the oldest frame
+RING_LATEST = 'latest' # Overwrite the oldest frame, and the consumer is only ever given the newest one
+RING_POLICIES = (RING_BLOCK, RING_DROP_OLDEST, RING_LATEST)
+
+DEFAULT_RING_SIZE = 32 # Frames, about 1.8 seconds at 55 ms per frame
+
+# Bounded ring of raw frames between one reader thread and its consumers
+class FrameRing:
+    def __init__(self, capacity = DEFAULT_RING_SIZE, policy = RING_DROP_OLDEST):
+        if (policy not in RING_POLICIES):
+            raise ValueError('Unknown ring policy %s, expected one of %s' % (policy, ', '.join(RING_POLICIES)))
+        self.slots = [None] * capacity
+        self.capacity = capacity
+        self.policy = policy
+        self.head = 0 # Slot of the oldest frame
+        self.count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+        # Counters
+        self.numFramesIn = 0
+        self.numFramesOut = 0
+        self.numFramesDropped = 0
+
+    # Add a frame, applying the full ring policy. Returns False if the ring was closed instead.
+    def put(self, frameData):
+        with self.condition:
+            while (self.policy == RING_BLOCK and self.count == self.capacity and not self.closed):
+                self.condition.wait()
+            if (self.closed):
+                return False
+            if (self.count == self.capacity):
+                self.slots[self.head] = None
+                self.head = (self.head + 1) % self.capacity
+                self.count -= 1
+                self.numFramesDropped += 1
+            self.slots[(self.head + self.count) % self.capacity] = frameData
+            self.count += 1
+            self.numFramesIn += 1
+            self.condition.notify_all()
+            return True
+
+    # Take the next frame, waiting up to timeout seconds (forever if None)
+    # Returns None on timeout, or once the ring is closed and empty
+    def get(self, timeout = None):
+        with self.condition:
+            if (not self.condition.wait_for(lambda: self.count > 0 or self.closed, timeout) or self.count == 0):
+                return None
+            if (self.policy == RING_LATEST and self.count > 1):
+                for i in range(self.count - 1):
+                    self.slots[(self.head + i) % self.capacity] = None
+                self.numFramesDropped += self.count - 1
+                self.head = (self.head + self.count - 1) % self.capacity
+                self.count = 1
+            frameData = self.slots[self.head]
+            self.slots[self.head] = None
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+            self.numFramesOut += 1
+            self.condition.notify_all()
+            return frameData
+
+    # Wait up to timeout seconds for a frame without taking it. Returns True if there is one.
+    def wait(self, timeout = None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.count > 0 or self.closed, timeout)
+            return self.count > 0
+
+    # Wake everyone up. Frames still in the ring can be taken, after that get() returns None.
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        with self.condition:
+            return self.count
+
+    # Snapshot of the counters
+    def stats(self):
+        with self.condition:
+            return {'framesIn': self.numFramesIn, 'framesOut': self.numFramesOut,
+                    'framesDropped': self.numFramesDropped, 'framesQueued': self.count}
+
+# Reads whole frames from port into ring, as (frame, time.monotonic_ns() when received), until stop() is called
+# or the port fails
+class AcquisitionThread(threading.Thread):
+    def __init__(self, port, ring):
+        super().__init__(name='UARTAcquisition', daemon=True)
+        self.port = port
+        self.ring = ring
+        self.framer = UARTFramer(port)
+        self.stopping = threading.Event()
+
+    def run(self):
+        try:
+            while (not self.stopping.is_set()):
+                # Timeouts come back as None so the stop flag is checked at least once per port timeout
+                frameData = self.framer.readFrame(retryOnTimeout=False)
+                if (frameData is not None and not self.ring.put((frameData, time.monotonic_ns()))):
+                    break
+        except Exception as e:
+            log.error('Acquisition thread stopped: %s' % (e))
+        finally:
+            self.ring.close()
+
+    # Stop reading and wait for the thread to let go of the port
+    def stop(self, timeout = None):
+        self.stopping.set()
+        self.ring.close()
+        self.join(timeout)
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import atexit
+import datetime
+import threading
+from collections import deque
+
+from raw_capture import writeCaptureFile
+from recorder import toJSON
+from track_history import TrackHistory, TrackWindowExtrema
+
+import logging
+log = logging.getLogger(__name__)
+
+# Pre-event black box recorder
+# Keeps the raw frames of the last preSeconds in memory, in a ring bounded by byteBudget bytes rather than a frame
+# count as frame sizes vary with the number of points. When a fall is raised, the frames from preSeconds before it
+# until postSeconds after it are written to an event clip in directory:
+#   <prefix>_<date>_<time>.bin, a raw capture in the raw_capture format that replay.py plays like any other
+#   <prefix>_<date>_<time>.event.json, why the clip was taken and the state of the fall detector at every trigger
+# A fall raised while a clip is still being recorded extends that clip. Clips are written by a thread of their own, so
+# the frame loop only ever copies frames.
+
+DEFAULT_PRE_SECONDS = 10
+DEFAULT_POST_SECONDS = 5
+DEFAULT_BYTE_BUDGET = 8 * 1024 * 1024
+EVENT_SUFFIX = '.event.json'
+
+# json.dumps default for detector state, which holds deques, track_history.TrackHistory and numpy values
+def stateToJSON(value):
+    if (isinstance(value, deque)):
+        return list(value)
+    if (isinstance(value, (TrackHistory, TrackWindowExtrema))):
+        return value.toList()
+    return toJSON(value)
+
+# Copy of a fall detector's attributes as JSON types, taken now as the detector keeps changing them
+def detectorState(detector):
+    return json.loads(json.dumps(vars(detector), default=stateToJSON))
+
+class BlackBoxRecorder:
+    def __init__(self, directory = 'Events', preSeconds = DEFAULT_PRE_SECONDS, postSeconds = DEFAULT_POST_SECONDS,
+                 byteBudget = DEFAULT_BYTE_BUDGET, prefix = 'fall', retention = None):
+        self.directory = directory
+        self.preSeconds = preSeconds
+        self.postSeconds = postSeconds
+        self.byteBudget = byteBudget
+        self.prefix = prefix
+        self.retention = retention # Clips are pinned in this retention.RetentionManager if given
+
+        self.ring = deque() # (frame bytes, timestampNs), oldest first
+        self.ringBytes = 0
+        self.lastTimestampNs = None
+
+        # Clip being recorded
+        self.event = None
+        self.eventFrames = None
+        self.eventEndNs = None
+
+        self.writers = []
+        self.numClips = 0
+
+        atexit.register(self.close)
+
+    # Add a raw frame received at timestampNs (time.monotonic_ns()). The bytes are copied, frameData may be reused.
+    def add(self, frameData, timestampNs = None):
+        if (timestampNs is None):
+            timestampNs = time.monotonic_ns()
+        record = (bytes(frameData), timestampNs)
+        self.lastTimestampNs = timestampNs
+
+        self.ring.append(record)
+        self.ringBytes += len(record[0])
+        oldestNs = timestampNs - int(self.preSeconds * 1e9)
+        while (len(self.ring) > 1 and (self.ringBytes > self.byteBudget or self.ring[0][1] < oldestNs)):
+            self.ringBytes -= len(self.ring.popleft()[0])
+
+        if (self.event is not None):
+            self.eventFrames.append(record)
+            if (timestampNs >= self.eventEndNs):
+                self.finishEvent()
+
+    # Start a clip of the frames around now, or extend the one being recorded. state is attached to the clip.
+    def trigger(self, reason = '', state = None):
+        nowNs = self.lastTimestampNs if (self.lastTimestampNs is not None) else time.monotonic_ns()
+        trigger = {'reason': reason, 'timestamp': time.time(), 'timestampNs': nowNs, 'detector': state}
+        if (self.event is None):
+            startNs = nowNs - int(self.preSeconds * 1e9)
+            self.eventFrames = [record for record in self.ring if record[1] >= startNs]
+            if (len(self.ring) > 0 and self.ring[0][1] > startNs):
+                log.debug('Black box only holds %.1f of %.1f seconds before the event' %
+                          ((nowNs - self.ring[0][1]) / 1e9, self.preSeconds))
+            self.event = {'preSeconds': self.preSeconds, 'postSeconds': self.postSeconds, 'triggers': []}
+        self.event['triggers'].append(trigger)
+        self.eventEndNs = nowNs + int(self.postSeconds * 1e9)
+
+    # Trigger on the tracks fallDetection raised a fall for in its last step, returns their TIDs
+    # A fall is new when its display counter has just been set to numFramesToDisplayFall
+    def checkFalls(self, fallDetection):
+        tids = [tid for tid, count in enumerate(fallDetection.fallBufferDisplay)
+                if count == fallDetection.numFramesToDisplayFall]
+        if (len(tids) > 0):
+            self.trigger('Fall detected for tracks %s' % (tids), detectorState(fallDetection))
+        return tids
+
+    # Hand the clip being recorded to a thread to write
+    def finishEvent(self):
+        event, frames = self.event, self.eventFrames
+        self.event = None
+        self.eventFrames = None
+        name = '%s_%s' % (self.prefix, datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f'))
+        writer = threading.Thread(target=self.writeClip, args=(name, event, frames), name='BlackBoxWriter', daemon=True)
+        writer.start()
+        self.writers = [thread for thread in self.writers if thread.is_alive()] + [writer]
+
+    def writeClip(self, name, event, frames):
+        capturePath = os.path.join(self.directory, name + '.bin')
+        eventPath = os.path.join(self.directory, name + EVENT_SUFFIX)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            writeCaptureFile(capturePath, frames)
+            event['capture'] = name + '.bin'
+            event['numFrames'] = len(frames)
+            with open(eventPath, 'w') as fp:
+                json.dump(event, fp)
+        except (OSError, TypeError, ValueError) as e:
+            log.error('Failed to write event clip %s: %s' % (capturePath, e))
+            return
+        self.numClips += 1
+        log.info('Wrote event clip %s, %d frames' % (capturePath, len(frames)))
+        if (self.retention is not None):
+            for path in (capturePath, eventPath):
+                self.retention.pin(path, event['triggers'][0]['reason'])
+                self.retention.fileClosed(path)
+
+    # Write the clip being recorded as it is, and wait for every clip to be written
+    def close(self):
+        if (self.event is not None):
+            self.finishEvent()
+        for writer in self.writers:
+            writer.join()
+        self.writers = []
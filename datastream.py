@@ -5,33 +5,47 @@ import os
 import math
 import json
 import sys
+import asyncio
 
 # Logger
 import logging
 log = logging.getLogger(__name__)
 
 #Local Imports
-from parseFrame import parseStandardFrame
-
-UART_MAGIC_WORD = bytearray(b'\x02\x01\x04\x03\x06\x05\x08\x07')
+from parseFrame import parseStandardFrame, Frame, parserFunctions
+from uart_framer import UARTFramer, UART_MAGIC_WORD
+from replay import ReplaySource
+from recorder import SessionRecorder
+from raw_capture import RawCaptureWriter
+from acquisition import FrameRing, AcquisitionThread, DEFAULT_RING_SIZE, RING_DROP_OLDEST
 
 class UARTParser():
     def __init__(self,type):
         # Set this option to 1 to save UART output from the radar device
         self.saveBinary = 0
         self.replay = 0
-        self.binData = bytearray(0)
+        self.replaySource = None
         self.uartCounter = 0
         self.framesPerFile = 100
-        self.first_file = True
         self.filepath = datetime.datetime.now().strftime("%m_%d_%Y_%H_%M_%S")
         self.parserType = type
         self.dataCom = None
+        self.framer = None
+        self.acquisition = None # Reader thread, see startAcquisition
         self.isLowPowerDevice = False
         self.cfg = ""
         self.demo = ""
         self.device = "xWR6843"
-        self.frames = [] # TODO this needs to be reset if connection is reset
+        self.recorder = None # Replay recording, see recordFrame
+        self.rawCapture = None # Raw UART capture, see captureFrame
+        self.retention = None # retention.RetentionManager told about every recording file closed, see setRetention
+        self.blackBox = None # black_box.BlackBoxRecorder given every raw frame, see setBlackBox
+        self.frameTimestampNs = 0 # time.monotonic_ns() when the last frame was received
+        self.keepTrackCovariance = False
+        self.lazyFrames = False
+        self.subscribedTLVs = None # None means every TLV is parsed
+        self.framePool = None
+        self.compactOutput = False
         
         # Data storage
         self.now_time = datetime.datetime.now().strftime('%Y%m%d-%H%M')
@@ -43,8 +57,222 @@ class UARTParser():
         self.dataCom.reset_output_buffer()
         log.info('Connected')
 
+    # Separate connectComPort (not PortS) for xWRL6432 because it only uses one port
+    def connectComPort(self, cliCom, cliBaud=115200):
+        # Longer timeout time for xWRL6432 to support applications with low power / low update rate
+        self.cliCom = serial.Serial(cliCom, cliBaud, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, timeout=.6)
+        self.cliCom.reset_output_buffer()
+        log.info('Connected (one port) with baud rate ' + str(cliBaud))
+        self.isLowPowerDevice = True
+
     def setSaveBinary(self, saveBinary = 1):
         self.saveBinary = saveBinary
+        if (saveBinary == 0):
+            if (self.recorder is not None):
+                self.recorder.close()
+                self.recorder = None
+            if (self.rawCapture is not None):
+                self.rawCapture.close()
+                self.rawCapture = None
+
+    # Keep the recordings in binData/ within a disk quota, see retention.RetentionManager. Set before setSaveBinary.
+    def setRetention(self, retention):
+        self.retention = retention
+
+    # Give every raw frame read to a black_box.BlackBoxRecorder, which keeps the last few seconds for event clips
+    def setBlackBox(self, blackBox):
+        self.blackBox = blackBox
+
+    # Keep the recording files being written now, e.g. because they hold a fall, see retention.RetentionManager
+    def pinRecording(self, reason = ''):
+        if (self.recorder is not None):
+            self.recorder.pin(reason)
+        if (self.rawCapture is not None):
+            self.rawCapture.pin(reason)
+
+    # Append the exact bytes of a frame to the raw capture in binData/<filepath>, pHistBytes_N.bin files written by
+    # a raw_capture.RawCaptureWriter
+    def captureFrame(self, frameData):
+        if (self.rawCapture is None):
+            self.rawCapture = RawCaptureWriter(os.path.join('binData', self.filepath), retention=self.retention)
+        self.rawCapture.write(frameData, self.frameTimestampNs)
+
+    # Queue a frame for the replay recording in binData/<filepath>, written as replay_N.ndjson files of
+    # framesPerFile frames each by a recorder.SessionRecorder
+    def recordFrame(self, outputDict):
+        if (self.recorder is None):
+            header = {'cfg': self.cfg, 'demo': self.demo, 'device': self.device}
+            # Note that this will create the folder in the caller's path, not necessarily in the viz folder
+            self.recorder = SessionRecorder(os.path.join('binData', self.filepath), self.framesPerFile, header=header,
+                                            retention=self.retention)
+        frameJSON = {}
+        frameJSON['frameData'] = outputDict.toDict() if (hasattr(outputDict, 'toDict')) else dict(outputDict)
+        frameJSON['timestamp'] = time.time()
+        frameJSON['CurrTime'] = time.ctime(frameJSON['timestamp']) # Add human-readable timestamp
+        self.recorder.record(frameJSON)
+
+    # Read frames from a recording instead of the device, see replay.ReplaySource
+    # path is a raw capture, a replay_N.ndjson or .json file, or a directory of them. speed is 0 to replay as fast as possible
+    # or 1 for the recorded timing. Once the recording ends, readAndParseUart*() return None. Pass None to stop.
+    def setReplay(self, path, speed = 0, loop = False):
+        if (self.replaySource is not None):
+            self.replaySource.close()
+            self.replaySource = None
+        self.replay = 0
+        if (path is not None):
+            self.replaySource = ReplaySource(path, speed, loop)
+            self.replay = 1
+            log.info('Replaying %d recordings from %s' % (len(self.replaySource.paths), path))
+
+    # Next frame of the recording, parsed the same way as a frame from the device
+    def replayHist(self):
+        frame, isRaw = self.replaySource.next()
+        if (frame is None):
+            return None
+        if (not isRaw):
+            return frame
+        outputDict = None if self.framePool is None else self.framePool.acquire()
+        return self.parseFrame(frame, outputDict)
+
+    # Return a lazily decoded Frame instead of a dict, so TLV's the caller never reads are never decoded
+    def setLazyFrames(self, lazyFrames = True):
+        self.lazyFrames = lazyFrames
+
+    # Only parse the given TLV types (constants from tlv_defines), every other TLV is skipped by its length
+    # Pass None to go back to parsing every TLV. Safe to call while another thread is reading frames.
+    def setSubscribedTLVs(self, tlvTypes):
+        self.subscribedTLVs = None if tlvTypes is None else frozenset(tlvTypes)
+
+    # Add TLV types to the current subscription
+    def subscribeTLVs(self, *tlvTypes):
+        if (self.subscribedTLVs is not None):
+            self.subscribedTLVs = self.subscribedTLVs.union(tlvTypes)
+
+    # Remove TLV types from the current subscription. With no subscription, this starts one with everything else.
+    def unsubscribeTLVs(self, *tlvTypes):
+        if (self.subscribedTLVs is None):
+            self.subscribedTLVs = frozenset(parserFunctions).difference(tlvTypes)
+        else:
+            self.subscribedTLVs = self.subscribedTLVs.difference(tlvTypes)
+
+    # Output float32 track and height arrays and a packed record point cloud (see gui_common) to halve frame memory
+    def setCompactOutput(self, compactOutput = True):
+        self.compactOutput = compactOutput
+
+    # Keep each track's 4x4 error covariance in outputDict['trackCovariance'] for host-side gating and ellipsoids
+    def setKeepTrackCovariance(self, keepTrackCovariance = True):
+        self.keepTrackCovariance = keepTrackCovariance
+
+    # Read every frame into reusable buffers from a frame_pool.FramePool, or pass None to stop
+    # Each frame returned is then a PooledFrame that has to be given back with release() or a with block
+    # Lazy frames are not used while a pool is set
+    def setFramePool(self, framePool):
+        self.framePool = framePool
+
+    # Parse one complete frame according to this parser's output options
+    def parseFrame(self, frameData, outputDict = None):
+        subscribedTLVs = self.subscribedTLVs
+        if (self.lazyFrames and outputDict is None):
+            return Frame(frameData, self.keepTrackCovariance, subscribedTLVs, self.compactOutput)
+        return parseStandardFrame(frameData, self.keepTrackCovariance, subscribedTLVs, outputDict, self.compactOutput)
+
+    # Framer for port, made again if the port object changes (e.g. after reconnecting)
+    def getFramer(self, port):
+        if (self.framer is None or self.framer.port is not port):
+            self.framer = UARTFramer(port)
+        return self.framer
+
+    # Start a thread that keeps reading frames from the data port (the CLI port for SingleCOMPort) into a ring of
+    # ringSize raw frames, with the time each was received. readAndParseUart*() and parsedFrames() then take frames
+    # from the ring, parsing them on the caller's thread. policy is one of the RING_* constants in acquisition and says what happens when the ring is full.
+    def startAcquisition(self, ringSize = DEFAULT_RING_SIZE, policy = RING_DROP_OLDEST):
+        self.stopAcquisition()
+        port = self.cliCom if (self.parserType == "SingleCOMPort") else self.dataCom
+        self.acquisition = AcquisitionThread(port, FrameRing(ringSize, policy))
+        self.acquisition.start()
+        log.info('Started acquisition thread, ring of %d frames, %s policy' % (ringSize, policy))
+
+    # Stop the reader thread. Frames still in the ring are dropped and reads go straight to the port again.
+    def stopAcquisition(self):
+        acquisition = self.acquisition
+        if (acquisition is not None):
+            self.acquisition = None
+            acquisition.stop()
+            log.info('Stopped acquisition thread: %s' % (acquisition.ring.stats()))
+
+    # Frame counters of the running acquisition thread, None if there is none
+    def acquisitionStats(self):
+        acquisition = self.acquisition
+        return None if acquisition is None else acquisition.ring.stats()
+
+    # Iterate over parsed frames from the acquisition thread until stopAcquisition() is called
+    def parsedFrames(self):
+        if (self.parserType == "SingleCOMPort"):
+            readAndParse = self.readAndParseUartSingleCOMPort
+        else:
+            readAndParse = self.readAndParseUartDoubleCOMPort
+        while (self.acquisition is not None):
+            yield readAndParse()
+
+    # Asynchronous version of parsedFrames, for use as
+    #     async for outputDict in parser.frames():
+    # The port is read by the acquisition thread, which is started here if it isn't running yet and stopped again
+    # when the iteration ends. Waiting and parsing happen in the event loop's default executor, in calls that return
+    # within pollTime seconds, so the event loop is never blocked and a silent device never holds up shutdown.
+    async def frames(self, ringSize = DEFAULT_RING_SIZE, policy = RING_DROP_OLDEST, pollTime = 0.5):
+        loop = asyncio.get_running_loop()
+        if (self.parserType == "SingleCOMPort"):
+            readAndParse = self.readAndParseUartSingleCOMPort
+        else:
+            readAndParse = self.readAndParseUartDoubleCOMPort
+        ownsAcquisition = self.acquisition is None and not self.replay
+        if (ownsAcquisition):
+            self.startAcquisition(ringSize, policy)
+
+        try:
+            while (1):
+                acquisition = self.acquisition
+                if (acquisition is not None):
+                    if (not await loop.run_in_executor(None, acquisition.ring.wait, pollTime)):
+                        if (acquisition.ring.closed):
+                            log.error('Acquisition thread stopped, ending frames()')
+                            break
+                        continue
+                elif (not self.replay):
+                    break
+                outputDict = await loop.run_in_executor(None, readAndParse)
+                if (outputDict is None):
+                    break # End of a replay
+                yield outputDict
+        finally:
+            if (ownsAcquisition):
+                await loop.run_in_executor(None, self.stopAcquisition)
+
+    # Block until a whole frame has arrived on port, or has been taken from the acquisition ring if it is running
+    # Returns the frame and, when a frame pool is set, a pooled output dict. A frame read from the port here was read
+    # into that dict's raw buffer. One from the acquisition ring is left where the acquisition thread put it, a buffer
+    # of its own that nothing else writes to, so it isn't copied again.
+    def readFrame(self, port):
+        acquisition = self.acquisition
+        if (acquisition is not None):
+            item = acquisition.ring.get()
+            if (item is not None):
+                frameData, self.frameTimestampNs = item
+                return frameData, (None if self.framePool is None else self.framePool.acquire())
+            # The reader thread has stopped, so go back to reading the port here
+            log.warning('Acquisition thread is no longer running, reading the port directly')
+            acquisition.join()
+            self.acquisition = None
+
+        framer = self.getFramer(port)
+        if (self.framePool is not None):
+            frame = self.framePool.acquire()
+            frameData = framer.readFrameInto(frame)
+        else:
+            frame = None
+            frameData = framer.readFrame()
+        self.frameTimestampNs = time.monotonic_ns()
+        return frameData, frame
 
     # This function is always called - first read the UART, then call a function to parse the specific demo output
     # This will return 1 frame of data. This must be called for each frame of data that is expected. It will return a dict containing all output info
@@ -56,104 +284,27 @@ class UARTParser():
         if (self.replay):
             return self.replayHist()
 
-        data = {'cfg': self.cfg, 'demo': self.demo, 'device': self.device}
-    
-        # Find magic word, and therefore the start of the frame
-        index = 0
-        magicByte = self.dataCom.read(1)
-        frameData = bytearray(b'')
-        while (1):
-            # If the device doesn't transmit any data, the COMPort read function will eventually timeout
-            # Which means magicByte will hold no data, and the call to magicByte[0] will produce an error
-            # This check ensures we can give a meaningful error
-            if (len(magicByte) < 1):
-                log.error("ERROR: No data detected on COM Port, read timed out")
-                log.error("\tBe sure that the device is in the proper mode, and that the cfg you are sending is valid")
-                magicByte = self.dataCom.read(1)
-                
-            # Found matching byte
-            elif (magicByte[0] == UART_MAGIC_WORD[index]):
-                index += 1
-                frameData.append(magicByte[0])
-                if (index == 8): # Found the full magic word
-                    break
-                magicByte = self.dataCom.read(1)
-                
-            else:
-                # When you fail, you need to compare your byte against that byte (ie the 4th) AS WELL AS compare it to the first byte of sequence
-                # Therefore, we should only read a new byte if we are sure the current byte does not match the 1st byte of the magic word sequence
-                if (index == 0): 
-                    magicByte = self.dataCom.read(1)
-                index = 0 # Reset index
-                frameData = bytearray(b'') # Reset current frame data
-        
-        # Read in version from the header
-        versionBytes = self.dataCom.read(4)
-        
-        frameData += bytearray(versionBytes)
-
-        # Read in length from header
-        lengthBytes = self.dataCom.read(4)
-        frameData += bytearray(lengthBytes)
-        frameLength = int.from_bytes(lengthBytes, byteorder='little')
-        
-        # Subtract bytes that have already been read, IE magic word, version, and length
-        # This ensures that we only read the part of the frame in that we are lacking
-        frameLength -= 16 
-
-        # Read in rest of the frame
-        frameData += bytearray(self.dataCom.read(frameLength))
+        # Read the next whole frame, magic word included
+        frameData, outputDict = self.readFrame(self.dataCom)
+        if (self.blackBox is not None):
+            self.blackBox.add(frameData, self.frameTimestampNs)
 
         # frameData now contains an entire frame, send it to parser
         if (self.parserType == "DoubleCOMPort"):
-            outputDict = parseStandardFrame(frameData)
+            outputDict = self.parseFrame(frameData, outputDict)
         else:
             log.error('FAILURE: Bad parserType')
 
         # If save binary is enabled
         if(self.saveBinary == 1):
-            # Save data every framesPerFile frames
             self.uartCounter += 1
 
-            # uncomment below to save bin data in Matlab-friendly format
-            # self.binData += frameData
-            # if (self.uartCounter % self.framesPerFile == 0):
-            #     # First file requires the path to be set up
-            #     if(self.first_file is True): 
-            #         if(os.path.exists('binData/') == False):
-            #             # Note that this will create the folder in the caller's path, not necessarily in the Industrial Viz Folder                        
-            #             os.mkdir('binData/')
-            #         os.mkdir('binData/'+self.filepath)
-            #         self.first_file = False
-            #     toSave = bytes(self.binData)
-            #     fileName = 'binData/' + self.filepath + '/pHistBytes_' + str(math.floor(self.uartCounter/self.framesPerFile)) + '.bin'
-            #     bfile = open(fileName, 'wb')
-            #     bfile.write(toSave)
-            #     bfile.close()
-            #     # Reset binData and missed frames
-            #     self.binData = []
- 
+            # Exact frame bytes, so the session can be parsed again later
+            self.captureFrame(frameData)
+
             # Saving data here for replay
-            # frameJSON = {}
-            # frameJSON['frameData'] = outputDict
-            # frameJSON['timestamp'] = time.time()
-            # # frameJSON['CurrTime'] = time.ctime(frameJSON['timestamp']) # Add human-readable timestamp
-
-            # self.frames.append(frameJSON)
-            # data['data'] = self.frames
-
-            # if (self.uartCounter % self.framesPerFile == 0):
-            #     if(self.first_file is True): 
-            #         if(os.path.exists('binData/') == False):
-            #             # Note that this will create the folder in the caller's path, not necessarily in the viz folder            
-            #             os.mkdir('binData/')
-            #         os.mkdir('binData/'+self.filepath)
-            #         self.first_file = False
-            #     with open('./binData/'+self.filepath+'/replay_' + str(math.floor(self.uartCounter/self.framesPerFile)) + '.json', 'w') as fp:
-            #         json_object = json.dumps(data, indent=4)
-            #         fp.write(json_object)
-            #         # self.frames = [] uncomment to put data into one file at a time in 100 frame chunks
-        
+            self.recordFrame(outputDict)
+
         return outputDict
 
     # This function is identical to the readAndParseUartDoubleCOMPort function, but it's modified to work for SingleCOMPort devices in the xWRLx432 family
@@ -167,106 +318,27 @@ class UARTParser():
         if (self.replay):
             return self.replayHist()
 
-        data = {'cfg': self.cfg, 'demo': self.demo, 'device': self.device}
-    
-        # Find magic word, and therefore the start of the frame
-        index = 0
-        magicByte = self.cliCom.read(1)
-        frameData = bytearray(b'')
-        while (1):
-            # If the device doesn't transmit any data, the COMPort read function will eventually timeout
-            # Which means magicByte will hold no data, and the call to magicByte[0] will produce an error
-            # This check ensures we can give a meaningful error
-            if (len(magicByte) < 1):
-                log.error("ERROR: No data detected on COM Port, read timed out")
-                log.error("\tBe sure that the device is in the proper mode, and that the cfg you are sending is valid")
-                magicByte = self.cliCom.read(1)
-
-            # Found matching byte
-            elif (magicByte[0] == UART_MAGIC_WORD[index]):
-                index += 1
-                frameData.append(magicByte[0])
-                if (index == 8): # Found the full magic word
-                    break
-                magicByte = self.cliCom.read(1)
-                
-            else:
-                # When you fail, you need to compare your byte against that byte (ie the 4th) AS WELL AS compare it to the first byte of sequence
-                # Therefore, we should only read a new byte if we are sure the current byte does not match the 1st byte of the magic word sequence
-                if (index == 0):
-                    magicByte = self.cliCom.read(1)
-                index = 0 # Reset index
-                frameData = bytearray(b'') # Reset current frame data
-        
-        # Read in version from the header
-        versionBytes = self.cliCom.read(4)
-        
-        frameData += bytearray(versionBytes)
-
-        # Read in length from header
-        lengthBytes = self.cliCom.read(4)
-        frameData += bytearray(lengthBytes)
-        frameLength = int.from_bytes(lengthBytes, byteorder='little')
-        
-        # Subtract bytes that have already been read, IE magic word, version, and length
-        # This ensures that we only read the part of the frame in that we are lacking
-        frameLength -= 16 
-
-        # Read in rest of the frame
-        frameData += bytearray(self.cliCom.read(frameLength))
+        # Read the next whole frame, magic word included
+        frameData, outputDict = self.readFrame(self.cliCom)
+        if (self.blackBox is not None):
+            self.blackBox.add(frameData, self.frameTimestampNs)
 
         # frameData now contains an entire frame, send it to parser
         if (self.parserType == "SingleCOMPort"):
-            outputDict = parseStandardFrame(frameData)
+            outputDict = self.parseFrame(frameData, outputDict)
         else:
             log.error('FAILURE: Bad parserType')
 
         # If save binary is enabled
         if(self.saveBinary == 1):
-            self.binData += frameData
-            # Save data every framesPerFile frames
             self.uartCounter += 1
 
-            # uncomment below to save bin data in Matlab-friendly format
-            # self.binData += frameData
-            # if (self.uartCounter % self.framesPerFile == 0):
-            #     # First file requires the path to be set up
-            #     if(self.first_file is True): 
-            #         if(os.path.exists('binData/') == False):
-            #             # Note that this will create the folder in the caller's path, not necessarily in the Industrial Viz Folder                        
-            #             os.mkdir('binData/')
-            #         os.mkdir('binData/'+self.filepath)
-            #         self.first_file = False
-            #     toSave = bytes(self.binData)
-                
-            #     fileName = 'binData/'+self.filepath+'/pHistBytes_'+str(math.floor(self.uartCounter/self.framesPerFile))+'.bin'
-            #     bfile = open(fileName, 'wb')
-            #     bfile.write(toSave)
-            #     bfile.close()
-            #     # Reset binData and missed frames
-            #     self.binData = []
+            # Exact frame bytes, so the session can be parsed again later
+            self.captureFrame(frameData)
 
             # Saving data here for replay
-            frameJSON = {}
-            frameJSON['frameData'] = outputDict
-            frameJSON['timestamp'] = time.time()
-            frameJSON['CurrTime'] = time.ctime(frameJSON['timestamp']) # Add human-readable timestamp
-
-            self.frames.append(frameJSON)
-            data['data'] = self.frames
-
-            if (self.uartCounter % self.framesPerFile == 0):
-                if(self.first_file is True): 
-                    if(os.path.exists('binData/') == False):
-                        # Note that this will create the folder in the caller's path, not necessarily in the viz folder            
-                        os.mkdir('binData/')
-                    os.mkdir('binData/'+self.filepath)
-                    self.first_file = False
-                with open('./binData/'+self.filepath+'/replay_' + str(math.floor(self.uartCounter/self.framesPerFile)) + '.json', 'w') as fp:
-                    json_object = json.dumps(data, indent=4)
-                    fp.write(json_object)
-                    self.frames = [] #uncomment to put data into one file at a time in 100 frame chunks
-        
+            self.recordFrame(outputDict)
+
         return outputDict
 
     def sendCfg(self, cfg):
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import inspect
+import argparse
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from replay import ReplaySource, findRecordings
+from parseFrame import parseStandardFrame, trackTLVs, heightTLVs
+from sensor_config import SensorConfig, loadSensorConfig
+
+import logging
+log = logging.getLogger(__name__)
+
+# Offline evaluation of fall detectors on recorded sessions
+# Every session (a directory of recordings or a single recording, see replay.py) is replayed through each detector as
+# fast as it can be parsed, one session per worker process. Detectors are given as a module name with a FallDetection
+# class (fall_detection, new_fall_detection) or as module:Class, and are built for the session's cfg (the one stored
+# in the recording, else --cfg, else sensor_config defaults). TrackingData sessions only hold heights, so their
+# tracks are taken to be the TIDs of the heights.
+# A label file is JSON, mapping session paths (or their last path component) to the frame numbers at which a fall
+# happens. A labelled fall with an alert within toleranceSeconds is one true positive, further alerts for it are
+# duplicates (see scoreAlerts) and every labelled fall without one is missed. Sessions without labels only count alerts.
+#   python evaluate.py TrackingData binData --detector fall_detection --detector new_fall_detection --labels labels.json
+
+DEFAULT_DETECTORS = ('fall_detection', 'new_fall_detection')
+DEFAULT_TOLERANCE = 2.0 # Seconds between a labelled fall and its alert
+
+def loadDetector(spec):
+    moduleName, _, className = spec.partition(':')
+    return getattr(importlib.import_module(moduleName), className or 'FallDetection')
+
+# Sessions under root: root itself if it holds recordings, otherwise every directory below it that does
+def findSessions(root):
+    if (os.path.isfile(root) or len(findRecordings(root)) > 0):
+        return [root]
+    sessions = []
+    for directory, dirNames, fileNames in os.walk(root):
+        dirNames.sort()
+        if (directory != root and len(findRecordings(directory)) > 0):
+            sessions.append(directory)
+    return sessions
+
+# Sensor config of a session: the one stored in the recording, else cfgPath, else sensor_config defaults
+def sessionConfig(source, cfgPath = None):
+    recordedCfg = getattr(source.reader(0), 'cfg', None)
+    if (recordedCfg):
+        return SensorConfig(recordedCfg)
+    elif (cfgPath is not None):
+        return loadSensorConfig(cfgPath)
+    return SensorConfig()
+
+# Frames of a session as (frameIndex, frameNum, frameTime in s from the first frame, heights, tracks)
+def sessionFrames(source, config):
+    frameIndex = 0
+    firstRecordedTime = None
+    while (1):
+        frame, isRaw = source.next()
+        if (frame is None):
+            break
+        if (isRaw):
+            frame = parseStandardFrame(frame, subscribedTLVs=trackTLVs | heightTLVs)
+        heights = np.asarray(frame.get('heightData', np.empty((0, 3))))
+        tracks = frame.get('trackData', heights)
+        frameNum = int(frame.get('frameNum', frameIndex))
+        # Seconds since the session's first frame, as recorded where the recording has timestamps, so dropped
+        # frames and jitter reach time based detectors as they happened
+        if (source.lastRecordedTime is None):
+            frameTime = frameIndex * config.framePeriod / 1000.0
+        else:
+            if (firstRecordedTime is None):
+                firstRecordedTime = source.lastRecordedTime
+            frameTime = source.lastRecordedTime - firstRecordedTime
+        yield frameIndex, frameNum, frameTime, heights, tracks
+        frameIndex += 1
+
+# Replay one session through every detector. Runs in a worker process, so only returns plain values.
+def evaluateSession(path, detectorSpecs, cfgPath = None):
+    result = {'session': path, 'frames': 0, 'seconds': 0.0, 'detectors': {}}
+    try:
+        source = ReplaySource(path)
+        config = sessionConfig(source, cfgPath)
+        result['framePeriod'] = config.framePeriod
+
+        detectors = []
+        for spec in detectorSpecs:
+            detector = loadDetector(spec)(config.maxNumTracks, config.framePeriod)
+            takesTime = 'currentTime' in inspect.signature(detector.step).parameters
+            detectors.append((spec, detector, takesTime, []))
+            result['detectors'][spec] = {'alerts': [], 'stepSeconds': 0.0}
+
+        start = time.perf_counter()
+        for frameIndex, frameNum, frameTime, heights, tracks in sessionFrames(source, config):
+            for spec, detector, takesTime, alerts in detectors:
+                stepStart = time.perf_counter()
+                if (takesTime):
+                    results = detector.step(heights, tracks, frameTime)
+                else:
+                    results = detector.step(heights, tracks)
+                result['detectors'][spec]['stepSeconds'] += time.perf_counter() - stepStart
+                # A fall is new when its display counter has just been set
+                for tid in np.flatnonzero(np.asarray(results) == detector.numFramesToDisplayFall):
+                    result['detectors'][spec]['alerts'].append({'frame': frameIndex, 'frameNum': frameNum,
+                                                                'time': frameTime, 'tid': int(tid)})
+            result['frames'] = frameIndex + 1
+        result['seconds'] = time.perf_counter() - start
+        source.close()
+    except Exception as e:
+        log.error('Failed to evaluate %s: %s' % (path, e))
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    return result
+
+# Labelled fall frame numbers of a session, None if it has no labels
+def sessionLabels(labels, path):
+    if (labels is None):
+        return None
+    for key in (path, os.path.normpath(path), os.path.basename(os.path.normpath(path))):
+        if (key in labels):
+            return labels[key]
+    return None
+
+# Score alerts (frame numbers) against labelled falls, returns (truePositives, duplicates, falsePositives, missed)
+# Each labelled fall is matched to at most one alert within toleranceFrames of it, the earliest one not matched to an
+# earlier fall, and counts as one true positive however many alerts it raised. The other alerts within tolerance of a
+# fall are duplicates, the alerts not near any fall false positives and the falls without an alert missed.
+def scoreAlerts(alertFrames, labelFrames, toleranceFrames):
+    alertFrames = np.sort(np.asarray(alertFrames, dtype=np.int64))
+    labelFrames = np.sort(np.asarray(labelFrames, dtype=np.int64))
+    if (len(alertFrames) == 0 or len(labelFrames) == 0):
+        return 0, 0, len(alertFrames), len(labelFrames)
+    # Alerts with a labelled fall within tolerance
+    first = np.searchsorted(labelFrames, alertFrames - toleranceFrames, side='left')
+    last = np.searchsorted(labelFrames, alertFrames + toleranceFrames, side='right')
+    numNear = int((last > first).sum())
+    truePositives = 0
+    nextAlert = 0
+    for label in labelFrames:
+        nextAlert = max(nextAlert, int(np.searchsorted(alertFrames, label - toleranceFrames, side='left')))
+        if (nextAlert < len(alertFrames) and alertFrames[nextAlert] <= label + toleranceFrames):
+            truePositives += 1
+            nextAlert += 1
+    return truePositives, numNear - truePositives, len(alertFrames) - numNear, len(labelFrames) - truePositives
+
+def evaluate(paths, detectorSpecs = DEFAULT_DETECTORS, labels = None, cfgPath = None, workers = None,
+             toleranceSeconds = DEFAULT_TOLERANCE):
+    sessions = [session for path in paths for session in findSessions(path)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(evaluateSession, sessions, [detectorSpecs] * len(sessions), [cfgPath] * len(sessions)))
+    elapsed = time.perf_counter() - start
+
+    totals = {spec: {'alerts': 0, 'labelledAlerts': 0, 'falls': 0, 'truePositives': 0, 'duplicates': 0,
+                     'falsePositives': 0, 'missed': 0, 'stepSeconds': 0.0} for spec in detectorSpecs}
+    for result in results:
+        sessionFalls = sessionLabels(labels, result['session'])
+        result['labelled'] = sessionFalls is not None
+        toleranceFrames = int(round(toleranceSeconds * 1000.0 / result.get('framePeriod', 55.0)))
+        for spec, detectorResult in result['detectors'].items():
+            total = totals[spec]
+            total['alerts'] += len(detectorResult['alerts'])
+            total['stepSeconds'] += detectorResult['stepSeconds']
+            if (sessionFalls is not None):
+                score = scoreAlerts([alert['frameNum'] for alert in detectorResult['alerts']], sessionFalls, toleranceFrames)
+                detectorResult['truePositives'], detectorResult['duplicates'] = score[0], score[1]
+                detectorResult['falsePositives'], detectorResult['missed'] = score[2], score[3]
+                total['labelledAlerts'] += len(detectorResult['alerts'])
+                total['falls'] += len(sessionFalls)
+                total['truePositives'] += score[0]
+                total['duplicates'] += score[1]
+                total['falsePositives'] += score[2]
+                total['missed'] += score[3]
+
+    numFrames = sum(result['frames'] for result in results)
+    for spec, total in totals.items():
+        # Duplicates count against precision, so raising the same fall on every frame does not look precise
+        labelled = total['labelledAlerts']
+        total['precision'] = total['truePositives'] / labelled if (labelled > 0) else None
+        total['recall'] = (total['falls'] - total['missed']) / total['falls'] if (total['falls'] > 0) else None
+        total['stepFps'] = numFrames / total['stepSeconds'] if (total['stepSeconds'] > 0) else None
+    return {'sessions': results, 'detectors': totals, 'frames': numFrames, 'seconds': elapsed,
+            'fps': numFrames / elapsed if (elapsed > 0) else None}
+
+def formatValue(value, valueFormat = '%.3f'):
+    return '-' if value is None else valueFormat % (value)
+
+def printReport(report):
+    print('%-40s %-24s %8s %7s %5s %5s %5s %7s %10s' % ('session', 'detector', 'frames', 'alerts', 'TP', 'dup', 'FP', 'missed',
+                                                         'fps'))
+    for result in report['sessions']:
+        if ('error' in result):
+            print('%-40s %s' % (result['session'], result['error']))
+            continue
+        fps = result['frames'] / result['seconds'] if (result['seconds'] > 0) else None
+        for spec, detectorResult in result['detectors'].items():
+            print('%-40s %-24s %8d %7d %5s %5s %5s %7s %10s' % (result['session'], spec, result['frames'],
+                  len(detectorResult['alerts']), detectorResult.get('truePositives', '-'),
+                  detectorResult.get('duplicates', '-'), detectorResult.get('falsePositives', '-'), detectorResult.get('missed', '-'), formatValue(fps, '%.0f')))
+    print()
+    print('%-24s %7s %10s %9s %7s %12s' % ('detector', 'alerts', 'duplicates', 'precision', 'recall', 'step fps'))
+    for spec, total in report['detectors'].items():
+        print('%-24s %7d %10d %9s %7s %12s' % (spec, total['alerts'], total['duplicates'], formatValue(total['precision']),
+              formatValue(total['recall']), formatValue(total['stepFps'], '%.0f')))
+    print('%d frames in %.1f s, %s frames/s overall' % (report['frames'], report['seconds'], formatValue(report['fps'], '%.0f')))
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description='Replay recorded sessions through fall detectors')
+    argParser.add_argument('paths', nargs='+', help='sessions, or directories of sessions (e.g. TrackingData)')
+    argParser.add_argument('--detector', action='append', help='module or module:Class, default %s' % (', '.join(DEFAULT_DETECTORS)))
+    argParser.add_argument('--labels', help='JSON file of labelled fall frame numbers per session')
+    argParser.add_argument('--cfg', help='.cfg for sessions that do not store theirs')
+    argParser.add_argument('--workers', type=int, help='worker processes, default one per CPU')
+    argParser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='seconds between a labelled fall and its alert')
+    argParser.add_argument('--json', help='also write the full report, every alert included, to this file')
+    args = argParser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    labels = None
+    if (args.labels is not None):
+        with open(args.labels, 'r') as fp:
+            labels = json.load(fp)
+    report = evaluate(args.paths, args.detector or DEFAULT_DETECTORS, labels, args.cfg, args.workers, args.tolerance)
+    printReport(report)
+    if (args.json is not None):
+        with open(args.json, 'w') as fp:
+            json.dump(report, fp, indent=1)
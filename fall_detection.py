@@ -1,51 +1,66 @@
-from collections import deque
-import copy 
+import numpy as np
+from track_history import TrackHistory, TrackWindowExtrema, matchHeights, matchRounds
+
+REFERENCE_MODES = ('oldest', 'peak')
 
 class FallDetection:
 
     # Initialize the class with the default parameters (tested empirically)
-    def __init__(self, maxNumTracks = 30, frameTime = 55, fallingThresholdProportion = 0.6, secondsInFallBuffer = 1.5):
+    # frameTime is the frame period in ms and maxNumTracks the most tracks, see sensor_config.SensorConfig
+    # referenceMode is what the current height is compared with: 'oldest' for the oldest height in the buffer, or
+    # 'peak' for the highest height in the same window, so a person crouching at the start of it does not hide a fall
+    def __init__(self, maxNumTracks = 30, frameTime = 55, fallingThresholdProportion = 0.6, secondsInFallBuffer = 1.5,
+                 referenceMode = 'oldest'):
+        if (referenceMode not in REFERENCE_MODES):
+            raise ValueError('Unknown referenceMode %s, modes are %s' % (referenceMode, ', '.join(REFERENCE_MODES)))
         self.fallingThresholdProportion = fallingThresholdProportion
         self.secondsInFallBuffer = secondsInFallBuffer
-        self.heightHistoryLen = int(round(self.secondsInFallBuffer * frameTime))
-        self.heightBuffer = [deque([-5] *  self.heightHistoryLen, maxlen =  self.heightHistoryLen) for i in range(maxNumTracks)]
-        self.tracksIDsInPreviousFrame = []
-        self.fallBufferDisplay = [0 for i in range(maxNumTracks)] # Fall results that will be displayed to screen
+        self.frameTime = frameTime
+        # Frames in secondsInFallBuffer
+        self.heightHistoryLen = max(int(round(self.secondsInFallBuffer * 1000.0 / frameTime)), 2)
+        # Heights of every track, -5 where there is no history
+        self.heightBuffer = TrackHistory(maxNumTracks, self.heightHistoryLen, -5)
+        self.referenceMode = referenceMode
+        self.peakHeight = TrackWindowExtrema(maxNumTracks, self.heightHistoryLen, 'max', -5) # Highest height in the buffer
+        self.tracksInPreviousFrame = np.zeros(maxNumTracks, dtype=bool)
+        self.fallBufferDisplay = np.zeros(maxNumTracks, dtype=np.int64) # Fall results that will be displayed to screen
         self.numFramesToDisplayFall = 100 # How many frames do you want to display a fall on the screen for
 
+    # Height the current heights of tids are compared with, see referenceMode
+    def referenceHeight(self, tids):
+        if (self.referenceMode == 'peak'):
+            return self.peakHeight.get(tids)
+        return self.heightBuffer.oldest(tids)
+
     # Sensitivity as given by the FallDetectionSliderClass instance
     def setFallSensitivity(self, fallingThresholdProportion):
         self.fallingThresholdProportion = fallingThresholdProportion
 
-    # Update the fall detection results for every track in the frame
+    # Update the fall detection results for every track in the frame, all tracks at once
     def step(self, heights, tracks):
         # Decrement results for fall detection display
-        for idx, result in enumerate(self.fallBufferDisplay):
-            self.fallBufferDisplay[idx] = max(self.fallBufferDisplay[idx] - 1, 0)
+        np.maximum(self.fallBufferDisplay - 1, 0, out=self.fallBufferDisplay)
 
-        trackIDsInCurrFrame = []
-        # Populate heights for current tracks
-        for height in heights:
-            # Find track with correct TID
-            for track in tracks:
-                # Found correct track
-                if (int(track[0]) == int(height[0])):
-                    tid = int(height[0])
-                    self.heightBuffer[tid].appendleft(height[1])
-                    trackIDsInCurrFrame.append(tid)
-                    
-                    # Check if fallen
-                    if(self.heightBuffer[tid][0] < self.fallingThresholdProportion * self.heightBuffer[tid][-1]):
-                        self.fallBufferDisplay[tid] = self.numFramesToDisplayFall
+        # Heights for current tracks, normally a single round of one height per track
+        tids, trackHeights = matchHeights(heights, tracks)
+        for roundTids, roundHeights in matchRounds(tids, trackHeights):
+            self.heightBuffer.push(roundTids, roundHeights)
+            if (self.referenceMode == 'peak'):
+                self.peakHeight.push(roundTids, roundHeights)
 
+            # Check if fallen, in the precision of the heights given
+            reference = self.referenceHeight(roundTids).astype(roundHeights.dtype)
+            fallen = roundHeights < self.fallingThresholdProportion * reference
+            self.fallBufferDisplay[roundTids[fallen]] = self.numFramesToDisplayFall
 
         # Reset the buffer for tracks that were detected in the previous frame but not the current frame
-        tracksToReset = set(self.tracksIDsInPreviousFrame) - set(trackIDsInCurrFrame) 
-        for track in tracksToReset:
-            for frame in range(self.heightHistoryLen):
-                self.heightBuffer[track].appendleft(-5) # Fill the buffer with -5's to remove any history for the track
-        self.tracksIDsInPreviousFrame = copy.deepcopy(trackIDsInCurrFrame)
-        
+        tracksInCurrFrame = np.zeros_like(self.tracksInPreviousFrame)
+        tracksInCurrFrame[tids] = True
+        tracksToReset = np.flatnonzero(self.tracksInPreviousFrame & ~tracksInCurrFrame)
+        self.heightBuffer.reset(tracksToReset)
+        self.peakHeight.reset(tracksToReset)
+        self.tracksInPreviousFrame = tracksInCurrFrame
+
         return self.fallBufferDisplay
         
     # def sendFallAlert(self):
@@ -0,0 +1,94 @@
+import threading
+from collections import deque
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+# Reusable per-frame buffers for the UART ingest loop
+# A FramePool hands out PooledFrame objects. Each one is the output dict for a single frame, and it also owns the
+# raw byte buffer the frame is read into and the backing arrays its pointCloud, trackData and heightData are views of.
+# Buffers are sized from the largest frame seen so far, so once the scene has been at its busiest nothing is allocated.
+# A frame must be given back with frame.release(), or by using it as a context manager, before its buffers are reused.
+
+DEFAULT_RAW_SIZE = 4096 # Bytes, grown on demand
+
+class PooledFrame(dict):
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.raw = bytearray(pool.maxRawSize)
+        self.arrays = {}
+        self.released = False
+
+    # Called by the TLV parsers in place of np.empty/np.full
+    # Returns a view of the first shape[0] rows of a backing array that is kept between frames
+    def allocateArray(self, key, shape, fill=None, dtype=np.float64):
+        backing = self.arrays.get(key)
+        if (backing is None or len(backing) < shape[0] or backing.shape[1:] != shape[1:] or backing.dtype != dtype):
+            capacity = self.pool.reserveRows(key, shape[0])
+            backing = np.empty((capacity,) + tuple(shape[1:]), dtype)
+            self.arrays[key] = backing
+        array = backing[:shape[0]]
+        if (fill is not None):
+            array.fill(fill)
+        return array
+
+    # Raw frame buffer of at least size bytes, keeping the bytes already read if it has to grow
+    def rawBuffer(self, size):
+        if (len(self.raw) < size):
+            raw = bytearray(self.pool.reserveRawSize(size))
+            raw[:len(self.raw)] = self.raw
+            self.raw = raw
+        return self.raw
+
+    # Plain dict with its own copies of every array, still valid after the frame is released
+    def toDict(self):
+        return {key: (value.copy() if isinstance(value, np.ndarray) else value) for key, value in self.items()}
+
+    def release(self):
+        if (not self.released):
+            self.released = True
+            self.pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.release()
+        return False
+
+class FramePool:
+    def __init__(self, numFrames = 4, rawSize = DEFAULT_RAW_SIZE):
+        self.lock = threading.Lock() # Frames may be released from a different thread than the reader
+        self.maxRawSize = rawSize
+        self.maxRows = {}
+        self.numFrames = numFrames
+        self.freeFrames = deque(PooledFrame(self) for i in range(numFrames))
+
+    # Take a cleared frame from the pool. If every frame is still held by a consumer, the pool grows by one.
+    def acquire(self):
+        with self.lock:
+            frame = self.freeFrames.popleft() if self.freeFrames else None
+        if (frame is None):
+            frame = PooledFrame(self)
+            self.numFrames += 1
+            log.debug('Frame pool exhausted, growing to %d frames' % (self.numFrames))
+        frame.clear()
+        frame.released = False
+        return frame
+
+    def release(self, frame):
+        with self.lock:
+            self.freeFrames.append(frame)
+
+    # Record a row count for an output array and return the capacity to allocate, the largest seen so far
+    def reserveRows(self, key, rows):
+        with self.lock:
+            self.maxRows[key] = max(self.maxRows.get(key, 0), rows)
+            return self.maxRows[key]
+
+    def reserveRawSize(self, size):
+        with self.lock:
+            self.maxRawSize = max(self.maxRawSize, size)
+            return self.maxRawSize
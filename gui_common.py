@@ -13,6 +13,29 @@ MIN_CLASSIFICATION_VELOCITY = 0.3
 TAG_HISTORY_LEN = 5
 MAX_NUM_UNKNOWN_TAGS_FOR_HUMAN_DETECTION = 1
 
+# Point cloud layouts
+# The default point cloud is an (N,7) float64 array with columns X, Y, Z, Doppler, SNR, Noise, Track index
+# The compact layout holds the same columns as one packed record per point, with float32 values,
+# SNR and Noise as uint16 in 0.1 dB steps (as the device sends them) and the track index as uint8
+POINT_CLOUD_FIELDS = ('x', 'y', 'z', 'doppler', 'snr', 'noise', 'trackIndex')
+COMPACT_POINT_CLOUD_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('doppler', '<f4'), ('snr', '<u2'), ('noise', '<u2'), ('trackIndex', 'u1')])
+COMPACT_FLOAT_DTYPE = np.float32
+
+def isCompactPointCloud(pointCloud):
+    return pointCloud.dtype.names is not None
+
+# View of one column (0-6, same order as the default layout) of a point cloud in either layout
+def pointCloudColumn(pointCloud, column):
+    if (isCompactPointCloud(pointCloud)):
+        return pointCloud[POINT_CLOUD_FIELDS[column]]
+    return pointCloud[:, column]
+
+# (N,3) X, Y, Z array of a point cloud in either layout
+def pointCloudXYZ(pointCloud):
+    if (isCompactPointCloud(pointCloud)):
+        return np.column_stack((pointCloud['x'], pointCloud['y'], pointCloud['z']))
+    return pointCloud[:, 0:3]
+
 def fixStringCase(st):
     return ''.join(''.join([w[0].upper(), w[1:].lower()]) for w in st.split())
 
@@ -1,4 +1,5 @@
 from datastream import UARTParser
+from parseFrame import trackTLVs, heightTLVs
 import json
 import datetime
 import threading
@@ -11,22 +12,33 @@ from contextlib import suppress
 import sys
 import platform
 from fall_detection import FallDetection 
+from sensor_config import SensorConfig
+from pipeline import FramePipeline, StageTimer
+from recorder import SessionRecorder
+from track_history import joinTracks
+from retention import RetentionManager
+from black_box import BlackBoxRecorder
 # from new_fall_detection import FallDetection
 
 class core:
     def __init__(self):
         self.parser = UARTParser(type="DoubleCOMPort")
+        # Only heights and tracks are read per frame, so skip every other TLV
+        self.parser.setSubscribedTLVs(trackTLVs | heightTLVs)
+        self.parser.setLazyFrames()
         self.tracking_data = []
         self.save_lock = threading.Lock()
-        self.frames = []
+        self.recorder = None
+        self.retention = None # Set to a RetentionManager before startRecording to keep recordings within a quota
         self.framesPerFile = 100
         self.filepath = datetime.datetime.now().strftime("%m_%d_%Y_%H_%M_%S")
         self.cfg = ""
         self.demo = "3D People Tracking"
         self.device = "xWR6843"
         self.uartCounter = 0
-        self.first_file = True
-        self.fallDetection = FallDetection()
+        # Sensor setup from the cfg (see parseCfg), which sizes the fall detector
+        self.sensorConfig = SensorConfig()
+        self.fallDetection = FallDetection(self.sensorConfig.maxNumTracks, self.sensorConfig.framePeriod)
 
         # self.demoClassDict = {
         #     DEMO_OOB_x843: OOBx843(),
@@ -88,8 +100,6 @@ class core:
                 elif args[0] == "frameCfg":
                     if len(args) < 4:
                         print("frameCfg had fewer arguments than expected")
-                    # else:
-                    #     self.frameTime = float(args[5]) / 2
                 # elif args[0] == "sensorPosition":
                     # sensorPosition for x843 family has 3 args
                     # if DEVICE_DEMO_DICT[self.device]["isxWRx843"] and len(args) < 4:
@@ -166,6 +176,17 @@ class core:
         # with suppress(AttributeError):
         #     self.demoClassDict[self.demo].setRangeValues()
 
+        # Frame period and number of tracks for the fall detector
+        self.sensorConfig = SensorConfig(self.cfg)
+        self.fallDetection = FallDetection(self.sensorConfig.maxNumTracks, self.sensorConfig.framePeriod)
+
+    # Stream the tracking data records to TrackingData/<filepath> as replay_N.ndjson files of framesPerFile records
+    def startRecording(self):
+        header = {'cfg': self.cfg, 'demo': self.demo, 'device': self.device}
+        # Note that this will create the folder in the caller's path, not necessarily in the viz folder
+        self.recorder = SessionRecorder(os.path.join('TrackingData', self.filepath), self.framesPerFile, header=header,
+                                        retention=self.retention)
+
     def sendCfg(self):
         try:
             self.parser.sendCfg(self.cfg)
@@ -181,6 +202,21 @@ if __name__=="__main__":
     SAVE_FILEPATH = "./Data_files"  # Change this to your desired path
     CLI_SIL_SERIAL_PORT_NAME = 'Enhanced COM Port'
     DATA_SIL_SERIAL_PORT_NAME = 'Standard COM Port'
+    # Read and parse in their own processes (see pipeline.py) instead of in this loop
+    USE_PIPELINE = False
+    # Replay a recording (raw capture, replay_N.json or a directory of them) instead of reading the device
+    REPLAY_PATH = None
+    REPLAY_SPEED = 0 # 0 for as fast as possible, 1 for the recorded timing
+    # Sent to the device if it is not configured yet, and read for the frame period and number of tracks either way
+    CFG_FILE = "Final_config_6m.cfg"
+    # Disk space for the recordings in TrackingData/ and binData/, the oldest are deleted first. Files with falls are kept.
+    RECORDING_QUOTA = 4 * 1024 ** 3 # Bytes, None for no quota
+    RECORDING_MIN_FREE = 256 * 1024 ** 2 # Bytes left free on the disk, None to not check
+    RECORDING_COMPRESSION = None # 'gzip' or 'lzma' to compress closed files in the background
+    # Raw frames from EVENT_PRE_SECONDS before a fall to EVENT_POST_SECONDS after it are saved to Events/
+    EVENT_PRE_SECONDS = 10
+    EVENT_POST_SECONDS = 5
+    EVENT_BUFFER_BYTES = 8 * 1024 ** 2 # Memory for the frames before a fall
 
     serialPorts = list(list_ports.comports())
 
@@ -208,22 +244,46 @@ if __name__=="__main__":
     # dataCom = '/dev/ttyUSB1'
 
     c = core()
-    c.parser.connectComPorts(cliCom, dataCom)
-    LastByte = c.parser.dataCom.read(1)
-    if (len(LastByte) < 1):
-        print("Device is not configured, configuring device with default config")
-        c.parseCfg("Final_config_6m.cfg")
-        c.sendCfg()
+    c.parseCfg(CFG_FILE)
+    if (REPLAY_PATH is not None):
+        c.parser.setReplay(REPLAY_PATH, REPLAY_SPEED)
+        USE_PIPELINE = False
+    else:
+        c.parser.connectComPorts(cliCom, dataCom)
+        LastByte = c.parser.dataCom.read(1)
+        if (len(LastByte) < 1):
+            print("Device is not configured, configuring device with default config")
+            c.sendCfg()
+        else:
+            print("Device is already configured")
+
+    c.retention = RetentionManager(('TrackingData', 'binData', 'Events'), RECORDING_QUOTA, RECORDING_MIN_FREE, RECORDING_COMPRESSION)
+    c.parser.setRetention(c.retention)
+    # The black box is fed the raw frames read by readAndParseUartDoubleCOMPort, which the pipeline (reading in its
+    # own processes) and replays do not go through, so it only records the single loop reading the device
+    blackBox = None
+    if (not USE_PIPELINE and REPLAY_PATH is None):
+        blackBox = BlackBoxRecorder('Events', EVENT_PRE_SECONDS, EVENT_POST_SECONDS, EVENT_BUFFER_BYTES, retention=c.retention)
+        c.parser.setBlackBox(blackBox)
+    c.startRecording()
+
+    # Frame rate and CPU use of this loop, to compare the single loop with the pipeline
+    frameTimer = StageTimer()
+    if (USE_PIPELINE):
+        # The reader process opens the data port itself
+        c.parser.dataCom.close()
+        framePipeline = FramePipeline(dataCom, subscribedTLVs=c.parser.subscribedTLVs)
+        framePipeline.start()
+        frameSource = framePipeline.consumer().frames()
     else:
-        print("Device is already configured")
+        frameSource = iter(c.parser.readAndParseUartDoubleCOMPort, None)
 
-    while True:
-        trial_output = c.parser.readAndParseUartDoubleCOMPort()
+    for trial_output in frameSource:
+        frameTimer.tick()
         # print("Read and parse UART")
         # print(trial_output)
 
-    
-        data = {'cfg': c.cfg, 'demo': c.demo, 'device': c.device}
+
         c.uartCounter += 1
         frameJSON = {}
         if ('frameNum' not in trial_output.keys()):
@@ -243,45 +303,46 @@ if __name__=="__main__":
         frameJSON['CurrTime'] = time.ctime(frameJSON['timestamp']) # Add human-readable timestamp
 
         
-        if ('numDetectedPoints' not in trial_output.keys()):
-            print("ERROR: No points detected in frame")
-            frameJSON['PointsDetected'] = 0
+        # Point count from the frame header, so the point cloud TLV's are never decoded. JSON replays have it stored.
+        if (hasattr(trial_output, 'numDetectedObj')):
+            frameJSON['PointsDetected'] = trial_output.numDetectedObj
         else:
-            frameJSON['PointsDetected'] = trial_output['numDetectedPoints']
+            frameJSON['PointsDetected'] = trial_output.get('numDetectedPoints', 0)
+
+        # Step the fall detector exactly once per frame. Frames without heights step it with none, so it resets the
+        # tracks that are gone and counts down the fall display like any other frame.
+        heights = trial_output['heightData'] if ('heightData' in trial_output) else np.empty((0, 3))
+        tracks = trial_output['trackData'] if ('trackData' in trial_output) else np.empty((0, 16))
+        fallDetectionDisplayResults = c.fallDetection.step(heights, tracks)
 
+        fallDetected = False
         if ('heightData' in trial_output):
-                    if (len(trial_output['heightData']) != len(trial_output['trackData'])):
+                    if (len(heights) != len(tracks)):
                         print("WARNING: number of heights does not match number of tracks")
 
-                    # For each height heights for current tracks
-                    for height in trial_output['heightData']:
-                        # Find track with correct TID
-                        for track in trial_output['trackData']:
-                            # Found correct track
-                            if (int(track[0]) == int(height[0])):
-                                tid = int(height[0])
-                                height_str = 'tid : ' + str(height[0]) + ', height : ' + str(round(height[1], 2)) + ' m'
-                                # If this track was computed to have fallen, display it on the screen
-                                
-                                fallDetectionDisplayResults = c.fallDetection.step(trial_output['heightData'], trial_output['trackData'])
-                                if (fallDetectionDisplayResults[tid] > 0): 
-                                    height_str = height_str + " FALL DETECTED"
-                                    print("Alert: Fall Detected for Patient")
+                    # Heights for current tracks, matched to their track by TID
+                    heightIndex, trackIndex = joinTracks(heights, tracks)
+                    for height in heights[heightIndex]:
+                        tid = int(height[0])
+                        height_str = 'tid : ' + str(height[0]) + ', height : ' + str(round(height[1], 2)) + ' m'
+                        # If this track was computed to have fallen, display it on the screen
+                        if (fallDetectionDisplayResults[tid] > 0):
+                            height_str = height_str + " FALL DETECTED"
+                            print("Alert: Fall Detected for Patient")
+                            fallDetected = True
         # frameJSON['fallDetected'] = height_str                                
-        c.frames.append(frameJSON)
-        data['data'] = c.frames
-        # print(data)
+        c.recorder.record(frameJSON)
+        if (blackBox is not None):
+            blackBox.checkFalls(c.fallDetection)
+        if (fallDetected):
+            # Never delete the recording of a fall
+            c.recorder.pin('Fall detected in frame %d' % (frameJSON.get('frameNumber', 0)))
+            c.parser.pinRecording('Fall detected')
         if (c.uartCounter % c.framesPerFile == 0):
-            if(c.first_file is True): 
-                if(os.path.exists('TrackingData/') == False):
-                    # Note that this will create the folder in the caller's path, not necessarily in the viz folder            
-                    os.mkdir('TrackingData/')
-                os.mkdir('TrackingData/'+c.filepath)
-                c.first_file = False
-            with open('./TrackingData/'+c.filepath+'/replay_' + str(math.floor(c.uartCounter/c.framesPerFile)) + '.json', 'w') as fp:
-                json_object = json.dumps(data, indent=4)
-                fp.write(json_object)
-                c.frames = [] #uncomment to put data into one file at a time in 100 frame chunks
+            stageStats = {'main': frameTimer.stats()}
+            if (USE_PIPELINE):
+                stageStats.update(framePipeline.stats())
+            print("Stage stats: ", stageStats)
 
         # print(c.fallDetection.heightBuffer)
     
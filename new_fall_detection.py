@@ -1,97 +1,108 @@
-from collections import deque
-import copy 
 import time
 import numpy as np
+from track_history import TrackHistory, TrackWindowExtrema, matchHeights, matchRounds
+
+REFERENCE_MODES = ('oldest', 'peak')
 
 class FallDetection:
 
     # Initialize the class with the default parameters (tested empirically)
-    def __init__(self, maxNumTracks = 30, frameTime = 55, fallingThresholdProportion = 0.6, secondsInFallBuffer = 1.5):
+    # frameTime is the frame period in ms and maxNumTracks the most tracks, see sensor_config.SensorConfig
+    # referenceMode is what the current height is compared with: 'oldest' for the oldest height in the buffer, or
+    # 'peak' for the highest height in the same window, so a person crouching at the start of it does not hide a fall
+    def __init__(self, maxNumTracks = 30, frameTime = 55, fallingThresholdProportion = 0.6, secondsInFallBuffer = 1.5,
+                 referenceMode = 'oldest'):
+        if (referenceMode not in REFERENCE_MODES):
+            raise ValueError('Unknown referenceMode %s, modes are %s' % (referenceMode, ', '.join(REFERENCE_MODES)))
         self.fallingThresholdProportion = fallingThresholdProportion
         self.secondsInFallBuffer = secondsInFallBuffer
-        self.heightHistoryLen = int(round(self.secondsInFallBuffer * frameTime))
-        self.heightBuffer = [deque([-5] *  self.heightHistoryLen, maxlen =  self.heightHistoryLen) for i in range(maxNumTracks)]
-        self.speedBuffer = [deque([0] * self.heightHistoryLen, maxlen = self.heightHistoryLen) for i in range(maxNumTracks)]
-        self.tracksIDsInPreviousFrame = []
-        self.fallBufferDisplay = [0 for i in range(maxNumTracks)] # Fall results that will be displayed to screen
+        self.frameTime = frameTime
+        # Frames in secondsInFallBuffer
+        self.heightHistoryLen = max(int(round(self.secondsInFallBuffer * 1000.0 / frameTime)), 2)
+        # Heights and vertical speeds of every track, -5 and 0 where there is no history
+        self.heightBuffer = TrackHistory(maxNumTracks, self.heightHistoryLen, -5)
+        self.speedBuffer = TrackHistory(maxNumTracks, self.heightHistoryLen, 0)
+        self.referenceMode = referenceMode
+        self.peakHeight = TrackWindowExtrema(maxNumTracks, self.heightHistoryLen, 'max', -5) # Highest height in the buffer
+        self.tracksInPreviousFrame = np.zeros(maxNumTracks, dtype=bool)
+        self.fallBufferDisplay = np.zeros(maxNumTracks, dtype=np.int64) # Fall results that will be displayed to screen
         self.numFramesToDisplayFall = 100 # How many frames do you want to display a fall on the screen for
-        self.lastFallTime = [0 for i in range(maxNumTracks)] # Track the last time a fall was detected for each track
+        self.lastFallTime = np.full(maxNumTracks, -np.inf) # Track the last time a fall was detected for each track, -inf for never
         self.fallCooldownPeriod = 10.0  # Seconds to wait before detecting another fall for the same track
-        self.consistentFallFrames = [0 for i in range(maxNumTracks)] # Count of consecutive frames where fall criteria are met
+        self.consistentFallFrames = np.zeros(maxNumTracks, dtype=np.int64) # Count of consecutive frames where fall criteria are met
         self.requiredConsistentFrames = 3 # Number of consistent frames required to confirm a fall
         self.minHeightThreshold = 0.3  # Minimum height in meters to consider for fall detection
         self.maxFallSpeed = -0.6  # Maximum negative speed (m/s) to consider for fall detection
 
+    # Height the current heights of tids are compared with, see referenceMode
+    def referenceHeight(self, tids):
+        if (self.referenceMode == 'peak'):
+            return self.peakHeight.get(tids)
+        return self.heightBuffer.oldest(tids)
+
     # Sensitivity as given by the FallDetectionSliderClass instance
     def setFallSensitivity(self, fallingThresholdProportion):
         self.fallingThresholdProportion = fallingThresholdProportion
 
-    # Calculate vertical speed based on height changes
-    def calculateSpeed(self, tid, frameTime):
-        if len(self.heightBuffer[tid]) < 2 or self.heightBuffer[tid][0] == -5 or self.heightBuffer[tid][1] == -5:
-            return 0
-        
+    # Vertical speed of tids from their last two heights, just pushed as heights, 0 without history
+    def calculateSpeed(self, tids, heights, frameTime):
+        previous = self.heightBuffer.get(tids, 1).astype(heights.dtype)
         # Calculate speed in meters per second
-        heightDifference = self.heightBuffer[tid][0] - self.heightBuffer[tid][1]
         timeInterval = 1.0 / (1000.0 / frameTime)  # Convert frameTime from ms to seconds
-        return heightDifference / timeInterval
+        speed = (heights - previous) / timeInterval
+        speed[(heights == -5) | (previous == -5)] = 0
+        return speed
 
-    # Update the fall detection results for every track in the frame
-    def step(self, heights, tracks):
+    # Update the fall detection results for every track in the frame, all tracks at once
+    # currentTime (s) is the time of the frame for the cooldown, now if None. Replays pass the recorded time.
+    def step(self, heights, tracks, currentTime = None):
         # Decrement results for fall detection display
-        for idx, result in enumerate(self.fallBufferDisplay):
-            self.fallBufferDisplay[idx] = max(self.fallBufferDisplay[idx] - 1, 0)
+        np.maximum(self.fallBufferDisplay - 1, 0, out=self.fallBufferDisplay)
 
-        trackIDsInCurrFrame = []
-        currentTime = time.time()
-        frameTime = 55  # Default frame time in milliseconds (adjust if needed)
-        
-        # Populate heights for current tracks
-        for height in heights:
-            # Find track with correct TID
-            for track in tracks:
-                # Found correct track
-                if (int(track[0]) == int(height[0])):
-                    tid = int(height[0])
-                    self.heightBuffer[tid].appendleft(height[1])
-                    trackIDsInCurrFrame.append(tid)
-                    
-                    # Calculate vertical speed
-                    speed = self.calculateSpeed(tid, frameTime)
-                    self.speedBuffer[tid].appendleft(speed)
-                    
-                    # Skip detection if we're in the cooldown period
-                    if currentTime - self.lastFallTime[tid] < self.fallCooldownPeriod:
-                        continue
-                        
-                    # Multiple criteria for fall detection
-                    height_criterion = self.heightBuffer[tid][0] < self.fallingThresholdProportion * self.heightBuffer[tid][-1]
-                    min_height_criterion = self.heightBuffer[tid][-1] > self.minHeightThreshold  # Person must be at least this tall initially
-                    speed_criterion = speed < self.maxFallSpeed  # Significant downward movement
-                    
-                    # Check if all criteria are met
-                    if(height_criterion and min_height_criterion and speed_criterion):
-                        self.consistentFallFrames[tid] += 1
-                        
-                        # Only trigger a fall if we have enough consistent frames
-                        if self.consistentFallFrames[tid] >= self.requiredConsistentFrames:
-                            self.fallBufferDisplay[tid] = self.numFramesToDisplayFall
-                            self.lastFallTime[tid] = currentTime
-                            self.consistentFallFrames[tid] = 0
-                    else:
-                        # Reset consistent frame counter if criteria not met
-                        self.consistentFallFrames[tid] = 0
+        if (currentTime is None):
+            currentTime = time.time()
+
+        # Heights for current tracks, normally a single round of one height per track
+        tids, trackHeights = matchHeights(heights, tracks)
+        for roundTids, roundHeights in matchRounds(tids, trackHeights):
+            self.heightBuffer.push(roundTids, roundHeights)
+            if (self.referenceMode == 'peak'):
+                self.peakHeight.push(roundTids, roundHeights)
+
+            # Calculate vertical speed
+            speed = self.calculateSpeed(roundTids, roundHeights, self.frameTime)
+            self.speedBuffer.push(roundTids, speed)
+
+            # Skip detection for tracks in the cooldown period
+            detecting = currentTime - self.lastFallTime[roundTids] >= self.fallCooldownPeriod
+            roundTids, roundHeights, speed = roundTids[detecting], roundHeights[detecting], speed[detecting]
+
+            # Multiple criteria for fall detection, in the precision of the heights given
+            reference = self.referenceHeight(roundTids).astype(roundHeights.dtype)
+            heightCriterion = roundHeights < self.fallingThresholdProportion * reference
+            minHeightCriterion = reference > self.minHeightThreshold  # Person must be at least this tall initially
+            speedCriterion = speed < self.maxFallSpeed  # Significant downward movement
+
+            # Count consistent frames while all criteria are met, reset the count when not
+            allCriteria = heightCriterion & minHeightCriterion & speedCriterion
+            self.consistentFallFrames[roundTids] = np.where(allCriteria, self.consistentFallFrames[roundTids] + 1, 0)
+
+            # Only trigger a fall if we have enough consistent frames
+            fallen = roundTids[self.consistentFallFrames[roundTids] >= self.requiredConsistentFrames]
+            self.fallBufferDisplay[fallen] = self.numFramesToDisplayFall
+            self.lastFallTime[fallen] = currentTime
+            self.consistentFallFrames[fallen] = 0
 
         # Reset the buffer for tracks that were detected in the previous frame but not the current frame
-        tracksToReset = set(self.tracksIDsInPreviousFrame) - set(trackIDsInCurrFrame) 
-        for track in tracksToReset:
-            for frame in range(self.heightHistoryLen):
-                self.heightBuffer[track].appendleft(-5) # Fill the buffer with -5's to remove any history for the track
-                self.speedBuffer[track].appendleft(0) # Reset speed buffer too
-            self.consistentFallFrames[track] = 0  # Reset consistent frame counter
-            
-        self.tracksIDsInPreviousFrame = copy.deepcopy(trackIDsInCurrFrame)
-        
+        tracksInCurrFrame = np.zeros_like(self.tracksInPreviousFrame)
+        tracksInCurrFrame[tids] = True
+        tracksToReset = np.flatnonzero(self.tracksInPreviousFrame & ~tracksInCurrFrame)
+        self.heightBuffer.reset(tracksToReset) # Remove any history for the track
+        self.speedBuffer.reset(tracksToReset) # Reset speed buffer too
+        self.peakHeight.reset(tracksToReset)
+        self.consistentFallFrames[tracksToReset] = 0  # Reset consistent frame counter
+        self.tracksInPreviousFrame = tracksInCurrFrame
+
         return self.fallBufferDisplay
         
     # def sendFallAlert(self):
@@ -1,11 +1,14 @@
 import logging
 import struct
+from functools import partial, lru_cache
+from collections.abc import Mapping
 import numpy as np
 import math
 
 #Local Imports
 from tlv_defines import *
 from parseTLVs import *
+from gui_common import COMPACT_POINT_CLOUD_DTYPE, COMPACT_FLOAT_DTYPE
 
 log = logging.getLogger(__name__)
 
@@ -44,6 +47,23 @@ parserFunctions = {
     MMWDEMO_OUTPUT_EXT_MSG_MODE_SWITCH_INFO:                parseModeSwitchTLV
 }
 
+# Parser table for one combination of output options, built once and then reused
+# keepTrackCovariance makes the tracker TLV's also keep each target's error covariance matrix
+# compact makes the tracker and height TLV's output float32 instead of float64
+@lru_cache(maxsize=None)
+def getParserFunctions(keepTrackCovariance=False, compact=False):
+    if (not keepTrackCovariance and not compact):
+        return parserFunctions
+    floatDtype = COMPACT_FLOAT_DTYPE if compact else np.float64
+    parsers = dict(parserFunctions)
+    parsers.update({
+        MMWDEMO_OUTPUT_MSG_TRACKERPROC_3D_TARGET_LIST:      partial(parseTrackTLV, keepCovariance=keepTrackCovariance, dtype=floatDtype),
+        MMWDEMO_OUTPUT_EXT_MSG_TARGET_LIST:                 partial(parseTrackTLV, keepCovariance=keepTrackCovariance, dtype=floatDtype),
+        MMWDEMO_OUTPUT_EXT_MSG_TARGET_LIST_2D_BSD:          partial(parseTrackTLV2D, keepCovariance=keepTrackCovariance, dtype=floatDtype),
+        MMWDEMO_OUTPUT_MSG_TRACKERPROC_TARGET_HEIGHT:       partial(parseTrackHeightTLV, dtype=floatDtype)
+    })
+    return parsers
+
 unusedTLVs = [
     MMWDEMO_OUTPUT_MSG_NOISE_PROFILE,
     MMWDEMO_OUTPUT_MSG_AZIMUT_STATIC_HEAT_MAP,
@@ -59,62 +79,142 @@ unusedTLVs = [
     MMWDEMO_OUTPUT_EXT_MSG_QUICK_EVAL_INFO
 ]
 
-def parseStandardFrame(frameData):
-    # Constants for parsing frame header
-    headerStruct = 'Q8I'
-    frameHeaderLen = struct.calcsize(headerStruct)
-    tlvHeaderLength = 8
+# Precompiled frame and TLV header layouts
+frameHeaderStruct = struct.Struct('Q8I')
+tlvHeaderStruct = struct.Struct('2I')
+
+# TLV types that contribute to each lazily decoded output key. pointCloud is filled in by several TLV's,
+# so they are always decoded together. Keys not listed here are found by decoding the rest of the frame.
+pointCloudTLVs = frozenset([
+    MMWDEMO_OUTPUT_MSG_DETECTED_POINTS,
+    MMWDEMO_OUTPUT_MSG_DETECTED_POINTS_SIDE_INFO,
+    MMWDEMO_OUTPUT_MSG_SPHERICAL_POINTS,
+    MMWDEMO_OUTPUT_MSG_COMPRESSED_POINTS,
+    MMWDEMO_OUTPUT_EXT_MSG_DETECTED_POINTS,
+    MMWDEMO_OUTPUT_MSG_TRACKERPROC_TARGET_INDEX,
+    MMWDEMO_OUTPUT_EXT_MSG_TARGET_INDEX
+])
+trackTLVs = frozenset([
+    MMWDEMO_OUTPUT_MSG_TRACKERPROC_3D_TARGET_LIST,
+    MMWDEMO_OUTPUT_EXT_MSG_TARGET_LIST,
+    MMWDEMO_OUTPUT_EXT_MSG_TARGET_LIST_2D_BSD
+])
+heightTLVs = frozenset([MMWDEMO_OUTPUT_MSG_TRACKERPROC_TARGET_HEIGHT])
 
+lazyOutputGroups = {
+    'pointCloud':           pointCloudTLVs,
+    'numDetectedPoints':    pointCloudTLVs,
+    'trackIndexes':         pointCloudTLVs,
+    'trackData':            trackTLVs,
+    'numDetectedTracks':    trackTLVs,
+    'trackCovariance':      trackTLVs,
+    'heightData':           heightTLVs,
+    'numDetectedHeights':   heightTLVs
+}
+
+# Set keepTrackCovariance to also output 'trackCovariance', an (N,4,4) float32 array (N,3,3 for 2D tracks)
+# Set subscribedTLVs to a set of TLV types to skip every other TLV by its length without parsing it
+# Pass outputDict to parse into an existing dict, such as a PooledFrame from frame_pool.py
+# Set compact for float32 output with a packed record point cloud (COMPACT_POINT_CLOUD_DTYPE in gui_common)
+def parseStandardFrame(frameData, keepTrackCovariance=False, subscribedTLVs=None, outputDict=None, compact=False):
     # Define the function's output structure and initialize error field to no error
-    outputDict = {}
+    if (outputDict is None):
+        outputDict = {}
     outputDict['error'] = 0
 
-    # A sum to track the frame packet length for verification for transmission integrity 
-    totalLenCheck = 0   
+    # Walk the frame through a single view and an offset so no TLV is copied on its way to a parser
+    frameView = memoryview(frameData)
 
     # Read in frame Header
-    try:
-        magic, version, totalPacketLen, platform, frameNum, timeCPUCycles, numDetectedObj, numTLVs, subFrameNum = struct.unpack(headerStruct, frameData[:frameHeaderLen])
-    except:
-        log.error('Error: Could not read frame header')
+    header = readFrameHeader(frameView)
+    if (header is None):
         outputDict['error'] = 1
-
-    # Move frameData ptr to start of 1st TLV   
-    frameData = frameData[frameHeaderLen:]
-    totalLenCheck += frameHeaderLen
+        return outputDict
+    frameNum, numDetectedObj, numTLVs, totalPacketLen = header
 
     # Save frame number to output
     outputDict['frameNum'] = frameNum
 
+    # Find all TLV's
+    tlvs, totalLenCheck = indexTLVs(frameView, numTLVs)
+    if (tlvs is None):
+        outputDict.clear()
+        return outputDict
+    tlvs = filterTLVs(tlvs, subscribedTLVs)
+
     # Initialize the point cloud struct since it is modified by multiple TLV's
-    # Each point has the following: X, Y, Z, Doppler, SNR, Noise, Track index
-    outputDict['pointCloud'] = np.zeros((numDetectedObj, 7), np.float64)
-    # Initialize the track indexes to a value which indicates no track
-    outputDict['pointCloud'][:, 6] = 255
-    # Find and parse all TLV's
+    if (wantsPointCloud(subscribedTLVs)):
+        outputDict['pointCloud'] = newPointCloud(numDetectedObj, outputDict, compact)
+
+    # Parse all TLV's
+    parsers = getParserFunctions(keepTrackCovariance, compact)
+    for tlv in tlvs:
+        decodeTLV(parsers, frameView, tlv, outputDict)
+
+    outputDict['error'] = checkPacketLength(totalLenCheck, totalPacketLen)
+    return outputDict
+
+# Read in frame Header. Returns frameNum, numDetectedObj, numTLVs and totalPacketLen, or None if the header is unreadable
+def readFrameHeader(frameView):
+    try:
+        magic, version, totalPacketLen, platform, frameNum, timeCPUCycles, numDetectedObj, numTLVs, subFrameNum = frameHeaderStruct.unpack_from(frameView, 0)
+    except:
+        log.error('Error: Could not read frame header')
+        return None
+    return frameNum, numDetectedObj, numTLVs, totalPacketLen
+
+# Walk the TLV headers once without decoding anything
+# Returns a (tlvType, offset, tlvLength) entry per TLV, or None if a TLV header is unreadable, and the offset the walk ended at
+def indexTLVs(frameView, numTLVs):
+    tlvHeaderLength = tlvHeaderStruct.size
+    offset = frameHeaderStruct.size
+    tlvs = []
     for i in range(numTLVs):
         try:
-            tlvType, tlvLength = tlvHeaderDecode(frameData[:tlvHeaderLength])
-            frameData = frameData[tlvHeaderLength:]
-            totalLenCheck += tlvHeaderLength
+            tlvType, tlvLength = tlvHeaderStruct.unpack_from(frameView, offset)
         except:
             log.warning('TLV Header Parsing Failure: Ignored frame due to parsing error')
-            outputDict['error'] = 2
-            return {}
+            return None, offset
+        offset += tlvHeaderLength
+        tlvs.append((tlvType, offset, tlvLength))
 
-        # print(tlvType)
+        # Move to next TLV
+        offset += tlvLength
+    return tlvs, offset
 
-        if (tlvType in parserFunctions):
-            parserFunctions[tlvType](frameData[:tlvLength], tlvLength, outputDict)
-        elif (tlvType in unusedTLVs):
-            log.debug("No function to parse TLV type: %d" % (tlvType))
-        else:
-            log.info("Invalid TLV type: %d" % (tlvType))
+# Keep only the TLV's in subscribedTLVs, or all of them if there is no subscription
+def filterTLVs(tlvs, subscribedTLVs):
+    if (subscribedTLVs is None):
+        return tlvs
+    return [tlv for tlv in tlvs if tlv[0] in subscribedTLVs]
 
-        # Move to next TLV
-        frameData = frameData[tlvLength:]
-        totalLenCheck += tlvLength
-    
+# The point cloud is only allocated when some TLV that fills it in is subscribed to
+def wantsPointCloud(subscribedTLVs):
+    return subscribedTLVs is None or not pointCloudTLVs.isdisjoint(subscribedTLVs)
+
+# Each point has the following: X, Y, Z, Doppler, SNR, Noise, Track index
+def newPointCloud(numDetectedObj, outputDict=None, compact=False):
+    if (compact):
+        pointCloud = newOutputArray(outputDict, 'pointCloud', (numDetectedObj,), 0, COMPACT_POINT_CLOUD_DTYPE)
+        pointCloud['trackIndex'] = 255
+        return pointCloud
+    pointCloud = newOutputArray(outputDict, 'pointCloud', (numDetectedObj, 7), 0.0)
+    # Initialize the track indexes to a value which indicates no track
+    pointCloud[:, 6] = 255
+    return pointCloud
+
+# Hand one indexed TLV to its parser as a zero-copy view
+def decodeTLV(parsers, frameView, tlv, outputDict):
+    tlvType, offset, tlvLength = tlv
+    if (tlvType in parsers):
+        parsers[tlvType](frameView[offset:offset + tlvLength], tlvLength, outputDict)
+    elif (tlvType in unusedTLVs):
+        log.debug("No function to parse TLV type: %d" % (tlvType))
+    else:
+        log.info("Invalid TLV type: %d" % (tlvType))
+
+# Returns the frame error code for the packet length check, 3 on mismatch and 0 otherwise
+def checkPacketLength(totalLenCheck, totalPacketLen):
     # Pad totalLenCheck to the next largest multiple of 32
     # since the device does this to the totalPacketLen for transmission uniformity
     totalLenCheck = 32 * math.ceil(totalLenCheck / 32)
@@ -122,11 +222,81 @@ def parseStandardFrame(frameData):
     # Verify the total packet length to detect transmission error that will cause subsequent frames to dropped
     if (totalLenCheck != totalPacketLen):
         log.warning('Frame packet length read is not equal to totalPacketLen in frame header. Subsequent frames may be dropped.')
-        outputDict['error'] = 3
+        return 3
+    return 0
 
-    return outputDict
+# Lazily decoded alternative to parseStandardFrame's output dict
+# The TLV's are indexed once up front, then each one is only decoded the first time one of its output keys is read,
+# either as a key (frame['heightData']) or as an attribute (frame.heightData). Decoded values are cached.
+# The frame keeps a view on frameData, so the buffer must not be reused while the frame is still being read.
+class Frame(Mapping):
+    def __init__(self, frameData, keepTrackCovariance=False, subscribedTLVs=None, compact=False):
+        self._frameView = memoryview(frameData)
+        self._parsers = getParserFunctions(keepTrackCovariance, compact)
+        self._compact = compact
+        self._outputDict = {'error': 0}
+        self._pendingTLVs = []
+        self.numDetectedObj = 0
+
+        header = readFrameHeader(self._frameView)
+        if (header is None):
+            self._outputDict['error'] = 1
+            return
+        frameNum, numDetectedObj, numTLVs, totalPacketLen = header
+        self._outputDict['frameNum'] = frameNum
+
+        tlvs, totalLenCheck = indexTLVs(self._frameView, numTLVs)
+        if (tlvs is None):
+            self._outputDict = {}
+            return
+
+        # pointCloud is always an output key when subscribed, even when it is never filled in
+        self.numDetectedObj = numDetectedObj
+        if (wantsPointCloud(subscribedTLVs)):
+            self._outputDict['pointCloud'] = None
+        self._pendingTLVs = filterTLVs(tlvs, subscribedTLVs)
+        self._outputDict['error'] = checkPacketLength(totalLenCheck, totalPacketLen)
+
+    # Decode the TLV's behind one output key, or every remaining TLV if the key is not in lazyOutputGroups
+    def _decode(self, key):
+        group = lazyOutputGroups.get(key)
+        if ((group is None or group is pointCloudTLVs) and 'pointCloud' in self._outputDict and self._outputDict['pointCloud'] is None):
+            self._outputDict['pointCloud'] = newPointCloud(self.numDetectedObj, compact=self._compact)
+
+        remainingTLVs = []
+        for tlv in self._pendingTLVs:
+            if (group is None or tlv[0] in group):
+                decodeTLV(self._parsers, self._frameView, tlv, self._outputDict)
+            else:
+                remainingTLVs.append(tlv)
+        self._pendingTLVs = remainingTLVs
+
+    # Decode everything left and return the plain output dict, as parseStandardFrame would have
+    def toDict(self):
+        self._decode(None)
+        return self._outputDict
+
+    def __getitem__(self, key):
+        value = self._outputDict.get(key)
+        if (value is None):
+            self._decode(key)
+        return self._outputDict[key]
+
+    def __iter__(self):
+        return iter(self.toDict())
+
+    def __len__(self):
+        return len(self.toDict())
+
+    def __getattr__(self, name):
+        if (name.startswith('_')):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
 
 # Decode TLV Header
 def tlvHeaderDecode(data):
-    tlvType, tlvLength = struct.unpack('2I', data)
-    return tlvType, tlvLength
\ No newline at end of file
+    tlvType, tlvLength = tlvHeaderStruct.unpack(data)
+    return tlvType, tlvLength
@@ -4,31 +4,85 @@ import numpy as np
 import math
 
 # Local File Imports
-from gui_common import NUM_CLASSES_IN_CLASSIFIER, sphericalToCartesianPointCloud
+from gui_common import NUM_CLASSES_IN_CLASSIFIER, POINT_CLOUD_FIELDS, isCompactPointCloud, sphericalToCartesianPointCloud
 
 log = logging.getLogger(__name__)
 
+# ================================================== Record Layouts For Vectorized TLV Parsing ==================================================
+# Each dtype mirrors the packed little-endian struct the device sends, so a whole TLV can be read with one np.frombuffer call
+
+# X, Y, Z, and Doppler
+POINT_CLOUD_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('doppler', '<f4')])
+# Range, Azimuth, Elevation, and Doppler
+SPHERICAL_POINT_CLOUD_DTYPE = np.dtype([('range', '<f4'), ('azimuth', '<f4'), ('elevation', '<f4'), ('doppler', '<f4')])
+# Elevation, Azimuth, Doppler, Range, SNR
+COMPRESSED_POINT_CLOUD_DTYPE = np.dtype([('elevation', 'i1'), ('azimuth', 'i1'), ('doppler', '<i2'), ('range', '<u2'), ('snr', '<u2')])
+# x y z doppler snr noise
+POINT_CLOUD_EXT_DTYPE = np.dtype([('x', '<i2'), ('y', '<i2'), ('z', '<i2'), ('doppler', '<i2'), ('snr', 'u1'), ('noise', 'u1')])
+# SNR and Noise
+SIDE_INFO_DTYPE = np.dtype([('snr', '<u2'), ('noise', '<u2')])
+# tid, posX/Y/Z, velX/Y/Z, accX/Y/Z, ec[4x4], g, confidenceLevel
+TRACK_DTYPE = np.dtype([('tid', '<u4'), ('pos', '<f4', 3), ('vel', '<f4', 3), ('acc', '<f4', 3), ('ec', '<f4', (4, 4)), ('g', '<f4'), ('confidenceLevel', '<f4')])
+# tid, posX/Y, velX/Y, accX/Y, ec[3x3], g, confidenceLevel
+TRACK_2D_DTYPE = np.dtype([('tid', '<u4'), ('pos', '<f4', 2), ('vel', '<f4', 2), ('acc', '<f4', 2), ('ec', '<f4', (3, 3)), ('g', '<f4'), ('confidenceLevel', '<f4')])
+# tid, maxZ, minZ
+TRACK_HEIGHT_DTYPE = np.dtype([('tid', '<u4'), ('maxZ', '<f4'), ('minZ', '<f4')])
+
+# Output array for a TLV. When outputDict is a PooledFrame (frame_pool.py) the array is a view of a buffer reused
+# between frames, otherwise it is freshly allocated. fill=None leaves the contents uninitialized like np.empty.
+def newOutputArray(outputDict, key, shape, fill=None, dtype=np.float64):
+    allocateArray = getattr(outputDict, 'allocateArray', None)
+    if (allocateArray is not None):
+        return allocateArray(key, shape, fill, dtype)
+    if (fill is None):
+        return np.empty(shape, dtype)
+    return np.full(shape, fill, dtype)
+
+# Write values into the first numPoints rows of one point cloud column, in either point cloud layout (see gui_common)
+def setPointColumn(pointCloud, column, numPoints, values):
+    if (not isCompactPointCloud(pointCloud)):
+        pointCloud[:numPoints,column] = values
+        return
+    field = pointCloud[POINT_CLOUD_FIELDS[column]]
+    if (column == 4 or column == 5):
+        # The compact layout keeps SNR and Noise in 0.1 dB steps
+        values = np.clip(np.rint(np.asarray(values, np.float64) * 10), 0, 65535)
+    field[:numPoints] = values
+
+# Write range, azimuth and elevation into the first numPoints rows of a point cloud as X, Y, Z
+def setSphericalPoints(pointCloud, numPoints, rng, azimuth, elevation):
+    if (not isCompactPointCloud(pointCloud)):
+        pointCloud[:numPoints,0] = rng
+        pointCloud[:numPoints,1] = azimuth
+        pointCloud[:numPoints,2] = elevation
+        pointCloud[:,0:3] = sphericalToCartesianPointCloud(pointCloud[:, 0:3])
+        return
+    # Convert before narrowing to float32 so the compact layout does not lose precision in the trig
+    cartesian = sphericalToCartesianPointCloud(np.column_stack((rng, azimuth, elevation)).astype(np.float64))
+    for column in range(3):
+        setPointColumn(pointCloud, column, numPoints, cartesian[:,column])
+
+# Number of whole records of recordSize bytes in a TLV, clipped to the bytes actually received
+def countRecords(tlvData, tlvLength, recordSize, errorMsg, headerSize=0):
+    numRecords = int((tlvLength - headerSize) / recordSize)
+    numAvailable = max(len(tlvData) - headerSize, 0) // recordSize
+    if (numAvailable < numRecords):
+        log.error(errorMsg)
+        numRecords = numAvailable
+    return max(numRecords, 0)
+
 # ================================================== Parsing Functions For Individual TLV's ==================================================
 
 # Point Cloud TLV from SDK
 def parsePointCloudTLV(tlvData, tlvLength, outputDict):
     pointCloud = outputDict['pointCloud']
-    pointStruct = '4f'  # X, Y, Z, and Doppler
-    pointStructSize = struct.calcsize(pointStruct)
-    numPoints = int(tlvLength/pointStructSize)
+    numPoints = countRecords(tlvData, tlvLength, POINT_CLOUD_DTYPE.itemsize, 'Point Cloud TLV Parser Failed')
+    points = np.frombuffer(tlvData, POINT_CLOUD_DTYPE, count=numPoints)
 
-    for i in range(numPoints):
-        try:
-            x, y, z, doppler = struct.unpack(pointStruct, tlvData[:pointStructSize])
-        except:
-            numPoints = i
-            log.error('Point Cloud TLV Parser Failed')
-            break
-        tlvData = tlvData[pointStructSize:]
-        pointCloud[i,0] = x 
-        pointCloud[i,1] = y
-        pointCloud[i,2] = z
-        pointCloud[i,3] = doppler
+    setPointColumn(pointCloud, 0, numPoints, points['x'])
+    setPointColumn(pointCloud, 1, numPoints, points['y'])
+    setPointColumn(pointCloud, 2, numPoints, points['z'])
+    setPointColumn(pointCloud, 3, numPoints, points['doppler'])
     outputDict['numDetectedPoints'], outputDict['pointCloud'] = numPoints, pointCloud
 
 def parseADCSamples(tlvData, tlvLength, outputDict):
@@ -50,37 +104,27 @@ def parseADCSamples(tlvData, tlvLength, outputDict):
 def parsePointCloudExtTLV(tlvData, tlvLength, outputDict):
     pointCloud = outputDict['pointCloud']
     pUnitStruct = '4f2h' # Units for the 5 results to decompress them
-    pointStruct = '4h2B' # x y z doppler snr noise
     pUnitSize = struct.calcsize(pUnitStruct)
-    pointSize = struct.calcsize(pointStruct)
 
     # Parse the decompression factors
     try:
         pUnit = struct.unpack(pUnitStruct, tlvData[:pUnitSize])
     except:
-            log.error('Point Cloud TLV Parser Failed')
-            outputDict['numDetectedPoints'], outputDict['pointCloud'] = 0, pointCloud
-    # Update data pointer
-    tlvData = tlvData[pUnitSize:]
-
-    # Parse each point
-    numPoints = int((tlvLength-pUnitSize)/pointSize)
-    for i in range(numPoints):
-        try:
-            x, y, z, doppler, snr, noise = struct.unpack(pointStruct, tlvData[:pointSize])
-        except:
-            numPoints = i
-            log.error('Point Cloud TLV Parser Failed')
-            break
-        
-        tlvData = tlvData[pointSize:]
-        # Decompress values
-        pointCloud[i,0] = x * pUnit[0]          # x
-        pointCloud[i,1] = y * pUnit[0]          # y
-        pointCloud[i,2] = z * pUnit[0]          # z
-        pointCloud[i,3] = doppler * pUnit[1]    # Doppler
-        pointCloud[i,4] = snr * pUnit[2]        # SNR
-        pointCloud[i,5] = noise * pUnit[3]      # Noise
+        log.error('Point Cloud TLV Parser Failed')
+        outputDict['numDetectedPoints'], outputDict['pointCloud'] = 0, pointCloud
+        return
+
+    # Parse every point at once, x y z doppler snr noise
+    numPoints = countRecords(tlvData, tlvLength, POINT_CLOUD_EXT_DTYPE.itemsize, 'Point Cloud TLV Parser Failed', pUnitSize)
+    points = np.frombuffer(tlvData, POINT_CLOUD_EXT_DTYPE, count=numPoints, offset=pUnitSize)
+
+    # Decompress values
+    setPointColumn(pointCloud, 0, numPoints, points['x'].astype(np.float64) * pUnit[0])            # x
+    setPointColumn(pointCloud, 1, numPoints, points['y'].astype(np.float64) * pUnit[0])            # y
+    setPointColumn(pointCloud, 2, numPoints, points['z'].astype(np.float64) * pUnit[0])            # z
+    setPointColumn(pointCloud, 3, numPoints, points['doppler'].astype(np.float64) * pUnit[1])      # Doppler
+    setPointColumn(pointCloud, 4, numPoints, points['snr'].astype(np.float64) * pUnit[2])          # SNR
+    setPointColumn(pointCloud, 5, numPoints, points['noise'].astype(np.float64) * pUnit[3])        # Noise
     outputDict['numDetectedPoints'], outputDict['pointCloud'] = numPoints, pointCloud
 
 # Enhanced Presence Detection TLV from SDK
@@ -105,21 +149,12 @@ def parseEnhancedPresenceInfoTLV(tlvData, tlvLength, outputDict):
 # Side info TLV from SDK
 def parseSideInfoTLV(tlvData, tlvLength, outputDict):
     pointCloud = outputDict['pointCloud']
-    pointStruct = '2H'  # Two unsigned shorts: SNR and Noise
-    pointStructSize = struct.calcsize(pointStruct)
-    numPoints = int(tlvLength/pointStructSize)
+    numPoints = countRecords(tlvData, tlvLength, SIDE_INFO_DTYPE.itemsize, 'Side Info TLV Parser Failed')
+    sideInfo = np.frombuffer(tlvData, SIDE_INFO_DTYPE, count=numPoints)
 
-    for i in range(numPoints):
-        try:
-            snr, noise = struct.unpack(pointStruct, tlvData[:pointStructSize])
-        except:
-            numPoints = i
-            log.error('Side Info TLV Parser Failed')
-            break
-        tlvData = tlvData[pointStructSize:]
-        # SNR and Noise are sent as uint16_t which are measured in 0.1 dB Steps
-        pointCloud[i,4] = snr * 0.1
-        pointCloud[i,5] = noise * 0.1
+    # SNR and Noise are sent as uint16_t which are measured in 0.1 dB Steps
+    setPointColumn(pointCloud, 4, numPoints, sideInfo['snr'].astype(np.float64) * 0.1)
+    setPointColumn(pointCloud, 5, numPoints, sideInfo['noise'].astype(np.float64) * 0.1)
     outputDict['pointCloud'] = pointCloud
 
 # Range Profile Parser
@@ -161,73 +196,43 @@ def parseOccStateMachTLV(tlvData, tlvLength, outputDict):
 # Spherical Point Cloud TLV Parser
 def parseSphericalPointCloudTLV(tlvData, tlvLength, outputDict):
     pointCloud = outputDict['pointCloud']
-    pointStruct = '4f'  # Range, Azimuth, Elevation, and Doppler
-    pointStructSize = struct.calcsize(pointStruct)
-    numPoints = int(tlvLength/pointStructSize)
+    numPoints = countRecords(tlvData, tlvLength, SPHERICAL_POINT_CLOUD_DTYPE.itemsize, 'Point Cloud TLV Parser Failed')
+    points = np.frombuffer(tlvData, SPHERICAL_POINT_CLOUD_DTYPE, count=numPoints)
+
+    setPointColumn(pointCloud, 3, numPoints, points['doppler'])
 
-    for i in range(numPoints):
-        try:
-            rng, azimuth, elevation, doppler = struct.unpack(pointStruct, tlvData[:pointStructSize])
-        except:
-            numPoints = i
-            log.error('Point Cloud TLV Parser Failed')
-            break
-        tlvData = tlvData[pointStructSize:]
-        pointCloud[i,0] = rng
-        pointCloud[i,1] = azimuth
-        pointCloud[i,2] = elevation
-        pointCloud[i,3] = doppler
-    
     # Convert from spherical to cartesian
-    pointCloud[:,0:3] = sphericalToCartesianPointCloud(pointCloud[:, 0:3])
+    setSphericalPoints(pointCloud, numPoints, points['range'], points['azimuth'], points['elevation'])
     outputDict['numDetectedPoints'], outputDict['pointCloud'] =  numPoints, pointCloud
 
 # Point Cloud TLV from Capon Chain
 def parseCompressedSphericalPointCloudTLV(tlvData, tlvLength, outputDict):
     pointCloud = outputDict['pointCloud']
     pUnitStruct = '5f' # Units for the 5 results to decompress them
-    pointStruct = '2bh2H' # Elevation, Azimuth, Doppler, Range, SNR
     pUnitSize = struct.calcsize(pUnitStruct)
-    pointSize = struct.calcsize(pointStruct)
 
     # Parse the decompression factors
     try:
         pUnit = struct.unpack(pUnitStruct, tlvData[:pUnitSize])
     except:
-            log.error('Point Cloud TLV Parser Failed')
-            outputDict['numDetectedPoints'], outputDict['pointCloud'] = 0, pointCloud
-    # Update data pointer
-    tlvData = tlvData[pUnitSize:]
-
-    # Parse each point
-    numPoints = int((tlvLength-pUnitSize)/pointSize)
-    for i in range(numPoints):
-        try:
-            elevation, azimuth, doppler, rng, snr = struct.unpack(pointStruct, tlvData[:pointSize])
-        except:
-            numPoints = i
-            log.error('Point Cloud TLV Parser Failed')
-            break
-        
-        tlvData = tlvData[pointSize:]
-        if (azimuth >= 128):
-            log.error('Az greater than 127')
-            azimuth -= 256
-        if (elevation >= 128):
-            log.error('Elev greater than 127')
-            elevation -= 256
-        if (doppler >= 32768):
-            log.error('Doppler greater than 32768')
-            doppler -= 65536
-        # Decompress values
-        pointCloud[i,0] = rng * pUnit[3]          # Range
-        pointCloud[i,1] = azimuth * pUnit[1]      # Azimuth
-        pointCloud[i,2] = elevation * pUnit[0]    # Elevation
-        pointCloud[i,3] = doppler * pUnit[2]      # Doppler
-        pointCloud[i,4] = snr * pUnit[4]          # SNR
+        log.error('Point Cloud TLV Parser Failed')
+        outputDict['numDetectedPoints'], outputDict['pointCloud'] = 0, pointCloud
+        return
+
+    # Parse every point at once, Elevation, Azimuth, Doppler, Range, SNR
+    # Elevation and azimuth are int8 and Doppler is int16 on the wire, so the dtype already applies the sign
+    numPoints = countRecords(tlvData, tlvLength, COMPRESSED_POINT_CLOUD_DTYPE.itemsize, 'Point Cloud TLV Parser Failed', pUnitSize)
+    points = np.frombuffer(tlvData, COMPRESSED_POINT_CLOUD_DTYPE, count=numPoints, offset=pUnitSize)
+
+    # Decompress values
+    setPointColumn(pointCloud, 3, numPoints, points['doppler'].astype(np.float64) * pUnit[2])      # Doppler
+    setPointColumn(pointCloud, 4, numPoints, points['snr'].astype(np.float64) * pUnit[4])          # SNR
 
     # Convert from spherical to cartesian
-    pointCloud[:,0:3] = sphericalToCartesianPointCloud(pointCloud[:, 0:3])
+    rng = points['range'].astype(np.float64) * pUnit[3]
+    azimuth = points['azimuth'].astype(np.float64) * pUnit[1]
+    elevation = points['elevation'].astype(np.float64) * pUnit[0]
+    setSphericalPoints(pointCloud, numPoints, rng, azimuth, elevation)
     outputDict['numDetectedPoints'] = numPoints
     outputDict['pointCloud'] = pointCloud
 
@@ -247,33 +252,23 @@ def parseCompressedSphericalPointCloudTLV(tlvData, tlvLength, outputDict):
 #float        ec[16];  /*! @brief   Target Error covariance matrix, [4x4 float], in row major order, range, azimuth, elev, doppler */
 #float        g;
 #float        confidenceLevel;    /*! @brief   Tracker confidence metric*/
-def parseTrackTLV(tlvData, tlvLength, outputDict):
-    targetStruct = 'I27f'
-    targetSize = struct.calcsize(targetStruct)
-    numDetectedTargets = int(tlvLength/targetSize)
-    targets = np.empty((numDetectedTargets,16))
-    for i in range(numDetectedTargets):
-        try:
-            targetData = struct.unpack(targetStruct,tlvData[:targetSize])
-        except:
-            log.error('Target TLV parsing failed')
-            outputDict['numDetectedTracks'], outputDict['trackData'] = 0, targets
-
-        targets[i,0] = targetData[0] # Target ID
-        targets[i,1] = targetData[1] # X Position
-        targets[i,2] = targetData[2] # Y Position
-        targets[i,3] = targetData[3] # Z Position
-        targets[i,4] = targetData[4] # X Velocity
-        targets[i,5] = targetData[5] # Y Velocity
-        targets[i,6] = targetData[6] # Z Velocity
-        targets[i,7] = targetData[7] # X Acceleration
-        targets[i,8] = targetData[8] # Y Acceleration
-        targets[i,9] = targetData[9] # Z Acceleration
-        targets[i,10] = targetData[26] # G
-        targets[i,11] = targetData[27] # Confidence Level
-        
-        # Throw away EC
-        tlvData = tlvData[targetSize:]
+def parseTrackTLV(tlvData, tlvLength, outputDict, keepCovariance=False, dtype=np.float64):
+    numDetectedTargets = countRecords(tlvData, tlvLength, TRACK_DTYPE.itemsize, 'Target TLV parsing failed')
+    targetData = np.frombuffer(tlvData, TRACK_DTYPE, count=numDetectedTargets)
+    targets = newOutputArray(outputDict, 'trackData', (numDetectedTargets,16), 0.0, dtype)
+
+    targets[:,0] = targetData['tid']              # Target ID
+    targets[:,1:4] = targetData['pos']            # X, Y, Z Position
+    targets[:,4:7] = targetData['vel']            # X, Y, Z Velocity
+    targets[:,7:10] = targetData['acc']           # X, Y, Z Acceleration
+    targets[:,10] = targetData['g']               # G
+    targets[:,11] = targetData['confidenceLevel'] # Confidence Level
+
+    # EC is only kept on request, copied out so it does not hold on to the frame buffer
+    if (keepCovariance):
+        trackCovariance = newOutputArray(outputDict, 'trackCovariance', targetData['ec'].shape, dtype=np.float32)
+        trackCovariance[:] = targetData['ec']
+        outputDict['trackCovariance'] = trackCovariance
     outputDict['numDetectedTracks'], outputDict['trackData'] = numDetectedTargets, targets
 
 # Decode 2D People Counting Target List TLV
@@ -288,49 +283,34 @@ def parseTrackTLV(tlvData, tlvLength, outputDict):
 #float        ec[9];  /*! @brief   Target Error covariance matrix, [3x3 float], in row major order, range, azimuth, elev, doppler */
 #float        g;
 #float        confidenceLevel;    /*! @brief   Tracker confidence metric*/
-def parseTrackTLV2D(tlvData, tlvLength, outputDict):
-    targetStruct = 'I17f'
-    targetSize = struct.calcsize(targetStruct)
-    numDetectedTargets = int(tlvLength/targetSize)
-    targets = np.empty((numDetectedTargets,16))
-    for i in range(numDetectedTargets):
-        try:
-            targetData = struct.unpack(targetStruct,tlvData[:targetSize])
-        except:
-            log.error('Target TLV parsing failed')
-            outputDict['numDetectedTracks'], outputDict['trackData'] = 0, targets
-
-        targets[i,0] = targetData[0] # Target ID
-        targets[i,1] = targetData[1] # X Position
-        targets[i,2] = targetData[2] # Y Position
-        targets[i,3] = targetData[3] # X Velocity
-        targets[i,4] = targetData[4] # Y Velocity
-        targets[i,5] = targetData[5] # X Acceleration
-        targets[i,6] = targetData[6] # Y Acceleration
-        targets[i,7] = targetData[16] # G
-        targets[i,8] = targetData[17] # Confidence Level
-        
-        # Throw away EC
-        tlvData = tlvData[targetSize:]
+def parseTrackTLV2D(tlvData, tlvLength, outputDict, keepCovariance=False, dtype=np.float64):
+    numDetectedTargets = countRecords(tlvData, tlvLength, TRACK_2D_DTYPE.itemsize, 'Target TLV parsing failed')
+    targetData = np.frombuffer(tlvData, TRACK_2D_DTYPE, count=numDetectedTargets)
+    targets = newOutputArray(outputDict, 'trackData', (numDetectedTargets,16), 0.0, dtype)
+
+    targets[:,0] = targetData['tid']              # Target ID
+    targets[:,1:3] = targetData['pos']            # X, Y Position
+    targets[:,3:5] = targetData['vel']            # X, Y Velocity
+    targets[:,5:7] = targetData['acc']            # X, Y Acceleration
+    targets[:,7] = targetData['g']                # G
+    targets[:,8] = targetData['confidenceLevel']  # Confidence Level
+
+    # EC is only kept on request, copied out so it does not hold on to the frame buffer
+    if (keepCovariance):
+        trackCovariance = newOutputArray(outputDict, 'trackCovariance', targetData['ec'].shape, dtype=np.float32)
+        trackCovariance[:] = targetData['ec']
+        outputDict['trackCovariance'] = trackCovariance
     outputDict['numDetectedTracks'], outputDict['trackData'] = numDetectedTargets, targets
 
 # Track heights
-def parseTrackHeightTLV(tlvData, tlvLength, outputDict):
-    targetStruct = 'I2f' #incoming data is an unsigned integer for TID, followed by 2 floats
-    targetSize = struct.calcsize(targetStruct)
-    numDetectedHeights = int(tlvLength/targetSize)
-    heights = np.empty((numDetectedHeights,3))
-    for i in range(numDetectedHeights):
-        try:
-            targetData = struct.unpack(targetStruct,tlvData[i * targetSize:(i + 1) * targetSize])
-        except:
-            log.error('Target TLV parsing failed')
-            outputDict['numDetectedHeights'], outputDict['heightData'] = 0, heights
-
-        heights[i,0] = targetData[0] # Target ID
-        heights[i,1] = targetData[1] # maxZ
-        heights[i,2] = targetData[2] # minZ
-
+def parseTrackHeightTLV(tlvData, tlvLength, outputDict, dtype=np.float64):
+    numDetectedHeights = countRecords(tlvData, tlvLength, TRACK_HEIGHT_DTYPE.itemsize, 'Target TLV parsing failed')
+    heightData = np.frombuffer(tlvData, TRACK_HEIGHT_DTYPE, count=numDetectedHeights)
+    heights = newOutputArray(outputDict, 'heightData', (numDetectedHeights,3), dtype=dtype)
+
+    heights[:,0] = heightData['tid']  # Target ID
+    heights[:,1] = heightData['maxZ'] # maxZ
+    heights[:,2] = heightData['minZ'] # minZ
     outputDict['numDetectedHeights'], outputDict['heightData'] = numDetectedHeights, heights
 
 def parseCamTLV(tlvData, tlvLength, outputDict):
@@ -372,19 +352,17 @@ def parseCamTLV(tlvData, tlvLength, outputDict):
 
 # Decode Target Index TLV
 def parseTargetIndexTLV(tlvData, tlvLength, outputDict):
-    indexStruct = 'B' # One byte per index
-    indexSize = struct.calcsize(indexStruct)
-    numIndexes = int(tlvLength/indexSize)
-    indexes = np.empty(numIndexes)
-    for i in range(numIndexes):
-        try:
-            index = struct.unpack(indexStruct, tlvData[:indexSize])
-        except:
-            log.error('Target Index TLV Parsing Failed')
-            outputDict['trackIndexes'] = indexes
-        indexes[i] = int(index[0])
-        tlvData = tlvData[indexSize:]
-    outputDict['trackIndexes'] = indexes
+    numIndexes = countRecords(tlvData, tlvLength, 1, 'Target Index TLV Parsing Failed')
+    indexes = np.frombuffer(tlvData, np.uint8, count=numIndexes)
+
+    # One byte per point, written straight into the track index column of the point cloud
+    if ('pointCloud' in outputDict):
+        pointCloud = outputDict['pointCloud']
+        numAssociated = min(numIndexes, len(pointCloud))
+        setPointColumn(pointCloud, 6, numAssociated, indexes[:numAssociated])
+    trackIndexes = newOutputArray(outputDict, 'trackIndexes', (numIndexes,), dtype=np.uint8)
+    trackIndexes[:] = indexes
+    outputDict['trackIndexes'] = trackIndexes
 
 # Vital Signs
 def parseVitalSignsTLV (tlvData, tlvLength, outputDict):
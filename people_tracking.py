@@ -27,6 +27,7 @@ from Demo_Classes.Helper_Classes.fall_detection import *
 from demo_defines import *
 from graph_utilities import get_trackColors, eulerRot
 from gl_text import GLTextItem
+from track_history import joinTracks
 
 from gui_threads import updateQTTargetThread3D
 from gui_common import TAG_HISTORY_LEN
@@ -121,27 +122,25 @@ class PeopleTracking(Plot3D, Plot1D):
                     if (len(outputDict['heightData']) != len(outputDict['trackData'])):
                         log.warning("WARNING: number of heights does not match number of tracks")
 
-                    # For each height heights for current tracks
-                    for height in outputDict['heightData']:
-                        # Find track with correct TID
-                        for track in outputDict['trackData']:
-                            # Found correct track
-                            if (int(track[0]) == int(height[0])):
-                                tid = int(height[0])
-                                height_str = 'tid : ' + str(height[0]) + ', height : ' + str(round(height[1], 2)) + ' m'
-                                # If this track was computed to have fallen, display it on the screen
-                                if(self.displayFallDet.checkState() == 2):
-                                    # Compute the fall detection results for each object
-                                    fallDetectionDisplayResults = self.fallDetection.step(outputDict['heightData'], outputDict['trackData'])
-                                    if (fallDetectionDisplayResults[tid] > 0): 
-                                        height_str = height_str + " FALL DETECTED"
-                                        log.info("Alert: Fall Detected for Patient")
-                                self.coordStr[tid].setText(height_str)
-                                self.coordStr[tid].setX(track[1])
-                                self.coordStr[tid].setY(track[2])
-                                self.coordStr[tid].setZ(track[3])
-                                self.coordStr[tid].setVisible(True)
-                                break
+                    # Compute the fall detection results for each object, once per frame
+                    if(self.displayFallDet.checkState() == 2):
+                        fallDetectionDisplayResults = self.fallDetection.step(outputDict['heightData'], outputDict['trackData'])
+
+                    # For each height, the first track with its TID
+                    heightIndex, trackIndex = joinTracks(outputDict['heightData'], outputDict['trackData'], firstMatch=True)
+                    for height, track in zip(outputDict['heightData'][heightIndex], outputDict['trackData'][trackIndex]):
+                        tid = int(height[0])
+                        height_str = 'tid : ' + str(height[0]) + ', height : ' + str(round(height[1], 2)) + ' m'
+                        # If this track was computed to have fallen, display it on the screen
+                        if(self.displayFallDet.checkState() == 2):
+                            if (fallDetectionDisplayResults[tid] > 0): 
+                                height_str = height_str + " FALL DETECTED"
+                                log.info("Alert: Fall Detected for Patient")
+                        self.coordStr[tid].setText(height_str)
+                        self.coordStr[tid].setX(track[1])
+                        self.coordStr[tid].setY(track[2])
+                        self.coordStr[tid].setZ(track[3])
+                        self.coordStr[tid].setVisible(True)
             else:
                 tracks = None
             if (self.plotComplete):
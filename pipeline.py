@@ -0,0 +1,428 @@
+import sys
+import struct
+import time
+import math
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+from gui_common import COMPACT_POINT_CLOUD_DTYPE
+
+import logging
+log = logging.getLogger(__name__)
+
+# Multi-process ingest pipeline
+#   reader process  --raw ring-->  parser process  --decoded ring-->  consumers (detector, recorder, ...)
+# The reader process only drains the data port into the raw ring and the parser process only runs parseStandardFrame,
+# so reading, parsing and whatever the consumers do each get a core of their own instead of sharing one under the GIL.
+# Both rings are multiprocessing.shared_memory blocks of fixed size slots. Decoded frames are written into a slot as
+# raw array bytes behind a small header (see packFrame) and come back out as numpy arrays, so nothing is pickled.
+#
+# Each ring has one writer and any number of readers, in any process, that attach to it by name. The writer never
+# waits: a reader that falls more than numSlots frames behind skips ahead and counts the frames it missed. Every
+# slot is stamped with the frame's sequence number before and after it is written, so a reader can tell if the slot
+# was overwritten while it was copying it out.
+# The stamps and frames are plain numpy and memoryview accesses, which x86 keeps in order but ARM (the Raspberry Pi)
+# is free to reorder, so the writer and readers put a memory fence (SharedFrameRing.fence) between the stamps and the
+# frame bytes and between the slot stamp and the write count.
+#
+# The ring's creator unlinks it (see release). Processes that attach to it keep it away from the resource tracker,
+# which would otherwise unlink it when the first of them exits, see openSharedMemory.
+
+DEFAULT_NUM_SLOTS = 64
+DEFAULT_RAW_SLOT_SIZE = 32768 # Bytes
+DEFAULT_DECODED_SLOT_SIZE = 65536 # Bytes, a float64 point cloud takes 56 bytes per point
+POLL_INTERVAL = 0.002 # Seconds between checks for a new frame
+
+# Ring header, one int64 each
+RING_NUM_SLOTS = 0
+RING_SLOT_SIZE = 1
+RING_WRITE_COUNT = 2 # Frames written so far, also the sequence number of the next one
+RING_CLOSED = 3
+RING_START_NS = 4 # Writer stats, see stageStats
+RING_LAST_NS = 5
+RING_CPU_NS = 6
+RING_NUM_OVERSIZE = 7 # Frames dropped because they did not fit in a slot
+RING_HEADER_WORDS = 8
+
+SLOT_SEQUENCE = 0 # -1 while the slot is being written
+SLOT_LENGTH = 1
+SLOT_TIMESTAMP_NS = 2 # time.monotonic_ns() when the frame was read from the port
+SLOT_HEADER_WORDS = 3
+
+SHARED_MEMORY_TRACK = sys.version_info >= (3, 13) # SharedMemory takes track=
+
+# Shared memory block of a ring, only tracked (and so unlinked if this process dies) by the process that creates it
+# Before Python 3.13 attaching always registers the block with the resource tracker, so it is unregistered again.
+def openSharedMemory(name, create, size = 0):
+    if (SHARED_MEMORY_TRACK):
+        return shared_memory.SharedMemory(name, create=create, size=size, track=create)
+    shm = shared_memory.SharedMemory(name, create=create, size=size)
+    if (not create):
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+# Frames per second and CPU use of a stage that has handled numFrames frames
+def stageStats(numFrames, cpuNs, elapsedNs):
+    elapsed = max(elapsedNs, 1) / 1e9
+    return {'frames': numFrames, 'fps': numFrames / elapsed, 'cpuPercent': 100.0 * cpuNs / max(elapsedNs, 1)}
+
+# Frame rate and CPU time of the calling process, for a stage that is not a ring writer
+# Also used to measure the single loop in main.py, so it can be compared with the pipeline
+class StageTimer:
+    def __init__(self):
+        self.numFrames = 0
+        self.startNs = time.monotonic_ns()
+        self.startCpuNs = time.process_time_ns()
+
+    def tick(self):
+        self.numFrames += 1
+
+    def stats(self):
+        return stageStats(self.numFrames, time.process_time_ns() - self.startCpuNs, time.monotonic_ns() - self.startNs)
+
+class SharedFrameRing:
+    # Create a new ring, or attach to an existing one when only name is given
+    def __init__(self, name = None, numSlots = DEFAULT_NUM_SLOTS, slotSize = DEFAULT_RAW_SLOT_SIZE, create = False):
+        slotSize = 8 * math.ceil(slotSize / 8)
+        if (create):
+            size = 8 * (RING_HEADER_WORDS + numSlots * SLOT_HEADER_WORDS) + numSlots * slotSize
+            self.shm = openSharedMemory(name, True, size)
+        else:
+            self.shm = openSharedMemory(name, False)
+        self.name = self.shm.name
+        self.owner = create
+
+        self.header = np.ndarray((RING_HEADER_WORDS,), np.int64, self.shm.buf)
+        if (create):
+            self.header[:] = 0
+            self.header[RING_NUM_SLOTS] = numSlots
+            self.header[RING_SLOT_SIZE] = slotSize
+        self.numSlots = int(self.header[RING_NUM_SLOTS])
+        self.slotSize = int(self.header[RING_SLOT_SIZE])
+        self.slotHeaders = np.ndarray((self.numSlots, SLOT_HEADER_WORDS), np.int64, self.shm.buf, 8 * RING_HEADER_WORDS)
+        if (create):
+            self.slotHeaders[:, SLOT_SEQUENCE] = -1
+        self.dataOffset = 8 * (RING_HEADER_WORDS + self.numSlots * SLOT_HEADER_WORDS)
+
+        # Writer stats
+        self.startCpuNs = time.process_time_ns()
+        # Held except inside fence()
+        self.fenceLock = threading.Lock()
+        self.fenceLock.acquire()
+
+    # Full memory fence: nothing before it is reordered with anything after it
+    # Python has no fence of its own, but releasing a lock is an atomic store-release and taking it an atomic
+    # load-acquire, and x86 and ARMv8 keep a store-release and a later load-acquire in order. A ring is only used by
+    # one thread, so the lock is never contended.
+    def fence(self):
+        self.fenceLock.release()
+        self.fenceLock.acquire()
+
+    # Writable view of the slot the next frame goes in. Finish with commit(length), nothing is visible until then.
+    def reserve(self):
+        slot = int(self.header[RING_WRITE_COUNT]) % self.numSlots
+        self.slotHeaders[slot, SLOT_SEQUENCE] = -1
+        self.fence() # Readers see the slot as being written before any of the new frame
+        offset = self.dataOffset + slot * self.slotSize
+        return self.shm.buf[offset:offset + self.slotSize]
+
+    def commit(self, length, timestampNs = None):
+        sequence = int(self.header[RING_WRITE_COUNT])
+        slot = sequence % self.numSlots
+        now = time.monotonic_ns()
+        self.slotHeaders[slot, SLOT_LENGTH] = length
+        self.slotHeaders[slot, SLOT_TIMESTAMP_NS] = now if timestampNs is None else timestampNs
+        self.fence() # The whole frame before its stamp
+        self.slotHeaders[slot, SLOT_SEQUENCE] = sequence
+        self.fence() # And the stamp before the count that tells readers it is there
+        self.header[RING_WRITE_COUNT] = sequence + 1
+
+        if (sequence == 0):
+            self.header[RING_START_NS] = now
+            self.startCpuNs = time.process_time_ns()
+        self.header[RING_LAST_NS] = now
+        self.header[RING_CPU_NS] = time.process_time_ns() - self.startCpuNs
+
+    # Copy one frame into the ring. Returns False if it is too big for a slot.
+    def write(self, frameData, timestampNs = None):
+        length = len(frameData)
+        if (length > self.slotSize):
+            self.header[RING_NUM_OVERSIZE] += 1
+            log.error('Frame of %d bytes does not fit in a %d byte ring slot, dropped' % (length, self.slotSize))
+            return False
+        slotView = self.reserve()
+        slotView[:length] = frameData
+        slotView.release()
+        self.commit(length, timestampNs)
+        return True
+
+    # Tell readers no more frames are coming
+    def close(self):
+        self.header[RING_CLOSED] = 1
+
+    def isClosed(self):
+        return bool(self.header[RING_CLOSED])
+
+    # Frame rate and CPU use of the writer since its first frame
+    def writerStats(self):
+        stats = stageStats(int(self.header[RING_WRITE_COUNT]), int(self.header[RING_CPU_NS]),
+                           int(self.header[RING_LAST_NS] - self.header[RING_START_NS]))
+        stats['oversize'] = int(self.header[RING_NUM_OVERSIZE])
+        return stats
+
+    def release(self):
+        # Views into the block have to go before it can be closed
+        self.header = None
+        self.slotHeaders = None
+        self.shm.close()
+        if (self.owner):
+            if (not SHARED_MEMORY_TRACK):
+                # A process this one started shares its resource tracker, so attaching there unregistered the block,
+                # and unlink() unregisters it again
+                resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
+
+# One reader's position in a SharedFrameRing
+class RingReader:
+    def __init__(self, ringName, fromStart = False):
+        self.ring = SharedFrameRing(ringName)
+        self.nextSequence = 0 if fromStart else int(self.ring.header[RING_WRITE_COUNT])
+        self.buffer = bytearray(self.ring.slotSize)
+        self.numFramesRead = 0
+        self.numFramesDropped = 0 # Overwritten before this reader got to them
+
+    # Copy out the next frame, waiting up to timeout seconds (forever if None)
+    # Returns a view of the frame in this reader's own buffer, valid until the next call, and its timestamp.
+    # Returns (None, None) on timeout or once the ring is closed and every frame has been read.
+    def read(self, timeout = None):
+        ring = self.ring
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while (1):
+            writeCount = int(ring.header[RING_WRITE_COUNT])
+            if (writeCount <= self.nextSequence):
+                if (ring.isClosed() or (deadline is not None and time.monotonic() >= deadline)):
+                    return None, None
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            # Lapped by the writer, so go to the oldest frame that is still safe to read
+            if (writeCount - self.nextSequence > ring.numSlots - 1):
+                skipTo = writeCount - ring.numSlots + 1
+                self.numFramesDropped += skipTo - self.nextSequence
+                self.nextSequence = skipTo
+
+            sequence = self.nextSequence
+            slot = sequence % ring.numSlots
+            ring.fence() # The slot stamp as new as the write count
+            if (ring.slotHeaders[slot, SLOT_SEQUENCE] == sequence):
+                ring.fence()
+                length = int(ring.slotHeaders[slot, SLOT_LENGTH])
+                timestampNs = int(ring.slotHeaders[slot, SLOT_TIMESTAMP_NS])
+                offset = ring.dataOffset + slot * ring.slotSize
+                self.buffer[:length] = ring.shm.buf[offset:offset + length]
+                ring.fence()
+                # Still the same frame after the copy, so the copy is whole
+                if (ring.slotHeaders[slot, SLOT_SEQUENCE] == sequence):
+                    self.nextSequence += 1
+                    self.numFramesRead += 1
+                    return memoryview(self.buffer)[:length], timestampNs
+            self.numFramesDropped += 1
+            self.nextSequence += 1
+
+    # Next decoded frame from a decoded ring, as a SharedFrame of arrays that this reader's caller owns
+    def readFrame(self, timeout = None):
+        frameView, timestampNs = self.read(timeout)
+        if (frameView is None):
+            return None
+        frame = unpackFrame(bytes(frameView))
+        frame.timestamp = timestampNs
+        return frame
+
+    # Decoded frames until the ring is closed
+    def frames(self):
+        while (1):
+            frame = self.readFrame()
+            if (frame is None):
+                return
+            yield frame
+
+    def stats(self):
+        return {'frames': self.numFramesRead, 'dropped': self.numFramesDropped}
+
+    def release(self):
+        self.ring.release()
+
+# Decoded frame as read back from a ring. Has the numDetectedObj from the frame header, like parseFrame.Frame.
+class SharedFrame(dict):
+    numDetectedObj = 0
+    timestamp = None # time.monotonic_ns() when the frame was read from the port
+
+# Structured dtypes are written by name, since dtype.str only gives their size
+structuredDtypes = {'compactPC': COMPACT_POINT_CLOUD_DTYPE}
+structuredDtypeNames = {dtype: name for name, dtype in structuredDtypes.items()}
+
+frameStruct = struct.Struct('<qqI4x') # numDetectedObj, reserved, number of entries
+entryStruct = struct.Struct('<32s12sI4I') # key, dtype, ndim, shape
+MAX_NDIM = 4
+
+# Write outputDict into view as a series of (key, dtype, shape, array bytes) entries
+# Numbers are written as 0-d arrays. Values that are neither (e.g. the vitals dict) are left out.
+# Returns the number of bytes written, or -1 if it does not fit
+def packFrame(outputDict, view, numDetectedObj = 0):
+    offset = frameStruct.size
+    numEntries = 0
+    for key, value in outputDict.items():
+        if (not isinstance(value, (np.ndarray, int, float, np.number))):
+            log.debug('Not writing %s to the decoded ring, it is not an array' % (key))
+            continue
+        # np.ascontiguousarray would make numbers 1-d, so keep the shape and only copy views that are not contiguous
+        array = np.require(np.asarray(value), requirements='C')
+        if (array.ndim > MAX_NDIM):
+            log.debug('Not writing %s to the decoded ring, it has more than %d dimensions' % (key, MAX_NDIM))
+            continue
+        end = offset + entryStruct.size + 8 * math.ceil(array.nbytes / 8)
+        if (end > len(view)):
+            return -1
+        dtypeName = structuredDtypeNames.get(array.dtype, array.dtype.str)
+        shape = tuple(array.shape) + (0,) * (MAX_NDIM - array.ndim)
+        entryStruct.pack_into(view, offset, key.encode(), dtypeName.encode(), array.ndim, *shape)
+        dataOffset = offset + entryStruct.size
+        view[dataOffset:dataOffset + array.nbytes] = array.reshape(-1).view(np.uint8)
+        offset = end
+        numEntries += 1
+    frameStruct.pack_into(view, 0, numDetectedObj, 0, numEntries)
+    return offset
+
+# Inverse of packFrame. The arrays are views of frameData.
+def unpackFrame(frameData):
+    frame = SharedFrame()
+    numDetectedObj, reserved, numEntries = frameStruct.unpack_from(frameData, 0)
+    frame.numDetectedObj = numDetectedObj
+    offset = frameStruct.size
+    for i in range(numEntries):
+        key, dtypeName, ndim, *shape = entryStruct.unpack_from(frameData, offset)
+        dtypeName = dtypeName.rstrip(b'\0').decode()
+        dtype = np.dtype(structuredDtypes.get(dtypeName, dtypeName))
+        shape = tuple(shape[:ndim])
+        count = math.prod(shape)
+        offset += entryStruct.size
+        array = np.frombuffer(frameData, dtype, count, offset).reshape(shape)
+        frame[key.rstrip(b'\0').decode()] = array.item() if (ndim == 0) else array
+        offset += 8 * math.ceil(count * dtype.itemsize / 8)
+    return frame
+
+# Reader process: drain the serial port into the raw ring
+def readerStage(portName, baudRate, rawRingName, stopEvent):
+    import serial
+    from uart_framer import UARTFramer
+    rawRing = SharedFrameRing(rawRingName)
+    try:
+        port = serial.Serial(portName, baudRate, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, timeout=0.6)
+        framer = UARTFramer(port)
+        while (not stopEvent.is_set()):
+            frameData = framer.readFrame(retryOnTimeout=False)
+            if (frameData is not None):
+                rawRing.write(frameData, time.monotonic_ns())
+        port.close()
+    except Exception as e:
+        log.error('Reader process stopped: %s' % (e))
+    finally:
+        rawRing.close()
+        rawRing.release()
+
+# Parser process: parse every frame in the raw ring into the decoded ring
+def parserStage(rawRingName, decodedRingName, stopEvent, subscribedTLVs = None, compact = False, keepTrackCovariance = False):
+    from parseFrame import parseStandardFrame, readFrameHeader
+    rawReader = RingReader(rawRingName, fromStart=True)
+    decodedRing = SharedFrameRing(decodedRingName)
+    try:
+        while (not stopEvent.is_set()):
+            frameData, timestampNs = rawReader.read(timeout=0.5)
+            if (frameData is None):
+                if (rawReader.ring.isClosed()):
+                    break
+                continue
+            outputDict = parseStandardFrame(frameData, keepTrackCovariance, subscribedTLVs, None, compact)
+            header = readFrameHeader(frameData)
+            numDetectedObj = 0 if header is None else header[1]
+            slotView = decodedRing.reserve()
+            length = packFrame(outputDict, slotView, numDetectedObj)
+            slotView.release()
+            if (length < 0):
+                decodedRing.header[RING_NUM_OVERSIZE] += 1
+                log.error('Decoded frame %s does not fit in a %d byte ring slot, dropped' % (outputDict.get('frameNum'), decodedRing.slotSize))
+                continue
+            decodedRing.commit(length, timestampNs)
+    except Exception as e:
+        log.error('Parser process stopped: %s' % (e))
+    finally:
+        decodedRing.close()
+        decodedRing.release()
+        rawReader.release()
+
+# Starts and stops the reader and parser processes and owns both rings
+# The data port must not be open anywhere else while the pipeline runs, so close UARTParser.dataCom first
+class FramePipeline:
+    def __init__(self, dataCom, baudRate = 921600, numSlots = DEFAULT_NUM_SLOTS, rawSlotSize = DEFAULT_RAW_SLOT_SIZE,
+                 decodedSlotSize = DEFAULT_DECODED_SLOT_SIZE, subscribedTLVs = None, compact = False, keepTrackCovariance = False):
+        self.dataCom = dataCom
+        self.baudRate = baudRate
+        self.numSlots = numSlots
+        self.rawSlotSize = rawSlotSize
+        self.decodedSlotSize = decodedSlotSize
+        self.subscribedTLVs = None if subscribedTLVs is None else frozenset(subscribedTLVs)
+        self.compact = compact
+        self.keepTrackCovariance = keepTrackCovariance
+        self.rawRing = None
+        self.decodedRing = None
+        self.processes = []
+
+    def start(self):
+        self.rawRing = SharedFrameRing(numSlots=self.numSlots, slotSize=self.rawSlotSize, create=True)
+        self.decodedRing = SharedFrameRing(numSlots=self.numSlots, slotSize=self.decodedSlotSize, create=True)
+        self.stopEvent = multiprocessing.Event()
+        self.processes = [
+            multiprocessing.Process(target=readerStage, name='UARTReader', daemon=True,
+                                    args=(self.dataCom, self.baudRate, self.rawRing.name, self.stopEvent)),
+            multiprocessing.Process(target=parserStage, name='FrameParser', daemon=True,
+                                    args=(self.rawRing.name, self.decodedRing.name, self.stopEvent,
+                                          self.subscribedTLVs, self.compact, self.keepTrackCovariance)),
+        ]
+        for process in self.processes:
+            process.start()
+        log.info('Started frame pipeline, rings %s and %s' % (self.rawRing.name, self.decodedRing.name))
+
+    # Reader of decoded frames, e.g. for the fall detector. Other processes can attach with RingReader(decodedRingName).
+    def consumer(self):
+        return RingReader(self.decodedRing.name)
+
+    # Reader of raw frames, e.g. for a raw capture recorder
+    def rawConsumer(self):
+        return RingReader(self.rawRing.name)
+
+    # Frame rate and CPU use of the reader and parser processes
+    def stats(self):
+        return {'reader': self.rawRing.writerStats(), 'parser': self.decodedRing.writerStats()}
+
+    def stop(self):
+        self.stopEvent.set()
+        for process in self.processes:
+            process.join(2)
+            if (process.is_alive()):
+                log.warning('%s did not stop, terminating it' % (process.name))
+                process.terminate()
+        self.processes = []
+        for ring in (self.rawRing, self.decodedRing):
+            if (ring is not None):
+                ring.release()
+        self.rawRing = self.decodedRing = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
+        return False
@@ -0,0 +1,164 @@
+import os
+import time
+import struct
+import atexit
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+# Raw UART capture files
+# The cheapest lossless record of a session: every frame exactly as the UART delivered it, so it can be parsed again
+# later with better parsers (replay.RawCaptureReader reads these files). A file is
+#   CAPTURE_MAGIC, int64 time.time_ns() at time.monotonic_ns() == 0 (to turn timestamps into wall clock time)
+#   then for every frame: int64 time.monotonic_ns() when it was received, the frame bytes (their length is in the
+#   frame header)
+# RawCaptureWriter appends to a front buffer, which a background thread swaps with its back buffer and writes out, so
+# the frame loop never waits on the disk. Files are named <prefix>_N.bin and a new one is started once a file reaches
+# maxFileSize bytes (give or take one buffer) or has been open for maxFileTime seconds. Closed files are reported to
+# retention (a retention.RetentionManager) if given.
+
+CAPTURE_MAGIC = b'RAWCAPv1'
+captureHeaderStruct = struct.Struct('<8sq')
+timestampStruct = struct.Struct('<q')
+
+DEFAULT_MAX_FILE_SIZE = 64 * 1024 * 1024 # Bytes
+DEFAULT_MAX_FILE_TIME = 3600 # Seconds
+DEFAULT_FLUSH_INTERVAL = 1.0 # Seconds between writes of the front buffer
+DEFAULT_BUFFER_SIZE = 256 * 1024 # Bytes in the front buffer before it is written early
+
+# Write a whole capture at once, records is a sequence of (frame bytes, time.monotonic_ns() when received)
+def writeCaptureFile(path, records):
+    with open(path, 'wb') as fp:
+        fp.write(captureHeaderStruct.pack(CAPTURE_MAGIC, time.time_ns() - time.monotonic_ns()))
+        for frameData, timestampNs in records:
+            fp.write(timestampStruct.pack(timestampNs))
+            fp.write(frameData)
+
+class RawCaptureWriter:
+    # fsyncInterval is the time in seconds between fsyncs, 0 to fsync every write or None to leave it to the OS
+    def __init__(self, directory, prefix = 'pHistBytes', maxFileSize = DEFAULT_MAX_FILE_SIZE, maxFileTime = DEFAULT_MAX_FILE_TIME,
+                 fsyncInterval = None, flushInterval = DEFAULT_FLUSH_INTERVAL, bufferSize = DEFAULT_BUFFER_SIZE, retention = None):
+        self.directory = directory
+        self.prefix = prefix
+        self.maxFileSize = maxFileSize
+        self.maxFileTime = maxFileTime
+        self.fsyncInterval = fsyncInterval
+        self.flushInterval = flushInterval
+        self.bufferSize = bufferSize
+        self.retention = retention
+
+        # Front buffer, filled by write() under the lock, and back buffer, only touched by the writer thread
+        self.frontBuffer = bytearray()
+        self.backBuffer = bytearray()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.pinReason = None # Set by pin(), for the file the front buffer goes to
+
+        # Writer thread state
+        self.file = None
+        self.fileNumber = 0
+        self.fileSize = 0
+        self.fileOpened = 0
+        self.lastFsync = 0
+
+        # Counters
+        self.numFrames = 0
+        self.numBytes = 0
+
+        self.thread = threading.Thread(target=self.run, name='RawCaptureWriter', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Append one frame, received at timestampNs (time.monotonic_ns(), now if None)
+    def write(self, frameData, timestampNs = None):
+        if (timestampNs is None):
+            timestampNs = time.monotonic_ns()
+        with self.condition:
+            if (self.closed):
+                return
+            self.frontBuffer += timestampStruct.pack(timestampNs)
+            self.frontBuffer += frameData
+            self.numFrames += 1
+            if (len(self.frontBuffer) >= self.bufferSize):
+                self.condition.notify()
+
+    # Pin the file holding the frames written so far, so retention never deletes it
+    def pin(self, reason = ''):
+        with self.condition:
+            self.pinReason = reason
+            self.condition.notify()
+
+    def currentPath(self):
+        return os.path.join(self.directory, '%s_%d.bin' % (self.prefix, self.fileNumber))
+
+    def run(self):
+        while (1):
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or self.pinReason is not None or
+                                        len(self.frontBuffer) >= self.bufferSize, self.flushInterval)
+                self.frontBuffer, self.backBuffer = self.backBuffer, self.frontBuffer
+                pinReason, self.pinReason = self.pinReason, None
+                closed = self.closed
+            try:
+                if (len(self.backBuffer) > 0):
+                    self.writeBuffer(self.backBuffer)
+                if (pinReason is not None and self.retention is not None):
+                    if (self.file is None):
+                        self.openNextFile()
+                    self.retention.pin(self.currentPath(), pinReason)
+            except OSError as e:
+                log.error('Failed to write raw capture %s: %s' % (self.currentPath(), e))
+            self.backBuffer.clear()
+            # write() stops taking frames once closed is set, so nothing is left in the front buffer
+            if (closed):
+                self.closeFile()
+                return
+
+    def writeBuffer(self, buffer):
+        now = time.monotonic()
+        if (self.file is None or self.fileSize >= self.maxFileSize or now - self.fileOpened >= self.maxFileTime):
+            self.openNextFile()
+        self.file.write(buffer)
+        self.fileSize += len(buffer)
+        self.numBytes += len(buffer)
+        if (self.fsyncInterval is not None and now - self.lastFsync >= self.fsyncInterval):
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.lastFsync = now
+
+    def openNextFile(self):
+        self.closeFile()
+        os.makedirs(self.directory, exist_ok=True)
+        self.fileNumber += 1
+        self.file = open(self.currentPath(), 'wb')
+        self.file.write(captureHeaderStruct.pack(CAPTURE_MAGIC, time.time_ns() - time.monotonic_ns()))
+        self.fileSize = captureHeaderStruct.size
+        self.fileOpened = time.monotonic()
+
+    def closeFile(self):
+        if (self.file is not None):
+            self.file.flush()
+            if (self.fsyncInterval is not None):
+                os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+            if (self.retention is not None):
+                self.retention.fileClosed(self.currentPath())
+
+    # Write out everything buffered and stop the writer thread
+    def close(self):
+        with self.condition:
+            if (self.closed):
+                return
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
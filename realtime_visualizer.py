@@ -3,6 +3,9 @@ import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.animation as animation
 from datastream import UARTParser
+from parseFrame import pointCloudTLVs, trackTLVs, heightTLVs
+from gui_common import pointCloudXYZ
+from track_history import joinTracks
 import time
 from serial.tools import list_ports
 import platform
@@ -33,10 +36,15 @@ class RealtimeRadarVisualizer:
         self.running = False
         
         # UART Parser setup
+        # Tracks and heights are always parsed, point clouds only while the window is open
+        # Compact float32 output keeps the point cloud history small
         self.parser = UARTParser(type="DoubleCOMPort")
+        self.parser.setSubscribedTLVs(trackTLVs | heightTLVs)
+        self.parser.setCompactOutput()
         
         # Setup the figure with subplots
         self.setup_plots()
+        self.fig.canvas.mpl_connect('close_event', self.on_close)
         
         # Animation object
         self.ani = None
@@ -181,8 +189,11 @@ class RealtimeRadarVisualizer:
         if latest_data is None:
             return
             
-        # Store data in history
-        self.point_cloud_history.append(latest_data.get('pointCloud', np.array([])))
+        # Store data in history, keeping only X, Y, Z of each point
+        if 'pointCloud' in latest_data:
+            self.point_cloud_history.append(pointCloudXYZ(latest_data['pointCloud']))
+        else:
+            self.point_cloud_history.append(np.empty((0, 3)))
         self.height_data_history.append(latest_data.get('heightData', np.array([])))
         self.track_data_history.append(latest_data.get('trackData', np.array([])))
         
@@ -342,21 +353,25 @@ class RealtimeRadarVisualizer:
             heights = data.get('heightData', [])
             tracks = data.get('trackData', [])
             
-            for height in heights:
-                for track in tracks:
-                    if int(track[0]) == int(height[0]):
-                        tid = int(height[0])
-                        height_val = height[1]
-                        info_text.append(f"Track {tid}: {height_val:.2f}m")
+            heightIndex, trackIndex = joinTracks(heights, tracks)
+            for height in np.asarray(heights)[heightIndex]:
+                tid = int(height[0])
+                height_val = height[1]
+                info_text.append(f"Track {tid}: {height_val:.2f}m")
                         
         # Join and display text
         full_text = '\n'.join(info_text)
         self.ax_info.text(0.05, 0.95, full_text, transform=self.ax_info.transAxes, 
                          fontsize=12, verticalalignment='top', fontfamily='monospace')
         
+    def on_close(self, event):
+        """Stop parsing point clouds once there is no window to draw them in"""
+        self.parser.unsubscribeTLVs(*pointCloudTLVs)
+        
     def start_visualization(self):
         """Start the real-time visualization"""
         self.running = True
+        self.parser.subscribeTLVs(*pointCloudTLVs)
         
         # Start data acquisition thread
         self.data_thread = threading.Thread(target=self.data_acquisition_thread)
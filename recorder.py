@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+# Append-only session recorder
+# Each record is written once, as one line of JSON (NDJSON), by a background thread, so recording costs the frame
+# loop no more than a queue put. Files are named <prefix>_N.ndjson, N counting from 1, and a new one is started
+# every framesPerFile records or once a file reaches maxFileSize bytes. The first line of every file is a header
+# record with the cfg, demo and device of the session, the rest are the records in the order they were given.
+# Closed files are reported to retention (a retention.RetentionManager) if given.
+
+DEFAULT_QUEUE_SIZE = 1000 # Records waiting to be written before new ones are dropped
+
+# json.dumps default for the numpy values found in frame dicts
+def toJSON(value):
+    if (isinstance(value, np.ndarray)):
+        return value.tolist()
+    if (isinstance(value, np.generic)):
+        return value.item()
+    raise TypeError('%s is not JSON serializable' % (type(value).__name__))
+
+class SessionRecorder:
+    def __init__(self, directory, framesPerFile = 100, maxFileSize = None, header = None, prefix = 'replay', queueSize = DEFAULT_QUEUE_SIZE,
+                 retention = None):
+        self.directory = directory
+        self.framesPerFile = framesPerFile
+        self.maxFileSize = maxFileSize
+        self.header = dict(header) if header else {}
+        self.prefix = prefix
+        self.retention = retention
+
+        # Writer state, only touched by the writer thread
+        self.file = None
+        self.fileNumber = 0
+        self.fileFrames = 0
+        self.fileSize = 0
+
+        # Counters
+        self.numRecords = 0
+        self.numDropped = 0
+
+        self.queue = queue.Queue(queueSize)
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='SessionRecorder', daemon=True)
+        self.thread.start()
+        # Records still queued when the program exits are written out first
+        atexit.register(self.close)
+
+    # Queue one record (a dict of JSON types and numpy values) to be written
+    # Arrays must not be changed afterwards, so pass copies of anything that is reused, e.g. PooledFrame.toDict()
+    def record(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.numDropped += 1
+            log.warning('Recorder queue is full, %d records dropped so far' % (self.numDropped))
+
+    # Pin the file holding the records queued so far, so retention never deletes it
+    def pin(self, reason = ''):
+        try:
+            self.queue.put(('pin', reason), timeout=1)
+        except queue.Full:
+            log.error('Recorder queue is full, could not pin %s' % (reason))
+
+    # Path of the file being written
+    def currentPath(self):
+        return os.path.join(self.directory, '%s_%d.ndjson' % (self.prefix, self.fileNumber))
+
+    def run(self):
+        while (1):
+            record = self.queue.get()
+            # Write everything already waiting before flushing
+            records = [record]
+            while (record is not None):
+                try:
+                    record = self.queue.get_nowait()
+                    records.append(record)
+                except queue.Empty:
+                    break
+            for record in records:
+                if (record is None):
+                    self.closeFile()
+                    return
+                if (isinstance(record, tuple)):
+                    # Pin, the file of the previous record may not be open yet if there was none
+                    if (self.retention is not None):
+                        if (self.file is None):
+                            self.openNextFile()
+                        self.retention.pin(self.currentPath(), record[1])
+                    continue
+                try:
+                    self.writeRecord(json.dumps(record, default=toJSON) + '\n')
+                except (TypeError, ValueError, OSError) as e:
+                    log.error('Failed to record frame: %s' % (e))
+            if (self.file is not None):
+                self.file.flush()
+
+    def writeRecord(self, line):
+        if (self.file is None or self.fileFrames >= self.framesPerFile or
+                (self.maxFileSize is not None and self.fileSize >= self.maxFileSize)):
+            self.openNextFile()
+        self.file.write(line)
+        self.fileFrames += 1
+        self.fileSize += len(line) # Plain ASCII, json.dumps escapes everything else
+        self.numRecords += 1
+
+    def openNextFile(self):
+        self.closeFile()
+        os.makedirs(self.directory, exist_ok=True)
+        self.fileNumber += 1
+        self.file = open(self.currentPath(), 'w')
+        header = dict(self.header, file=self.fileNumber, timestamp=time.time())
+        line = json.dumps(header, default=toJSON) + '\n'
+        self.file.write(line)
+        self.fileFrames = 0
+        self.fileSize = len(line)
+
+    def closeFile(self):
+        if (self.file is not None):
+            self.file.close()
+            self.file = None
+            if (self.retention is not None):
+                self.retention.fileClosed(self.currentPath())
+
+    # Write out everything queued and stop the writer thread
+    def close(self):
+        if (not self.closed):
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
@@ -0,0 +1,337 @@
+import os
+import re
+import mmap
+import json
+import time
+import glob
+import numpy as np
+
+from uart_framer import UART_MAGIC_WORD, FRAME_PREFIX_LEN, MAX_FRAME_LENGTH
+from raw_capture import CAPTURE_MAGIC, captureHeaderStruct, timestampStruct
+from session_store import ColumnarSessionReader
+from retention import stripCompression, openCompressed, COMPRESSION_SUFFIXES
+from black_box import EVENT_SUFFIX
+
+import logging
+log = logging.getLogger(__name__)
+
+# Replay of recorded sessions through UARTParser (see UARTParser.setReplay)
+# Two kinds of recording are understood:
+#   Raw captures (*.bin), UART frames exactly as the device sent them, either back to back or with the receive
+#   timestamps of raw_capture.RawCaptureWriter. These are memory mapped and indexed once by frame, the index is kept
+#   next to the capture in <capture>.idx.npz, so going to any frame is O(1).
+#   JSON sessions, replay_N.ndjson as written by recorder.SessionRecorder (UARTParser with saveBinary on, and main.py
+#   into TrackingData/) or the older replay_N.json files.
+#   Columnar sessions (*.rsess), see session_store.py.
+# Any of them except columnar sessions can also be gzip (.gz) or lzma (.xz) compressed, see retention.py.
+# A ReplaySource plays one file, or every recording in a directory in order, as fast as possible or paced by the
+# recorded timestamps.
+
+DEFAULT_FRAME_PERIOD = 0.055 # Seconds, used to pace recordings without timestamps
+
+# Frame offsets and lengths in a raw capture, found by walking the magic word and length of each frame
+def indexRawCapture(data):
+    offsets = []
+    lengths = []
+    offset = data.find(UART_MAGIC_WORD)
+    while (offset >= 0):
+        if (offset + FRAME_PREFIX_LEN > len(data)):
+            break
+        frameLength = int.from_bytes(data[offset + 12:offset + FRAME_PREFIX_LEN], byteorder='little')
+        if (frameLength < FRAME_PREFIX_LEN or frameLength > MAX_FRAME_LENGTH or offset + frameLength > len(data)):
+            # False magic word match or a frame cut off at the end of the capture
+            offset = data.find(UART_MAGIC_WORD, offset + 1)
+            continue
+        offsets.append(offset)
+        lengths.append(frameLength)
+        nextOffset = offset + frameLength
+        # Frames normally follow each other directly, so only search when they don't
+        if (data[nextOffset:nextOffset + len(UART_MAGIC_WORD)] == UART_MAGIC_WORD):
+            offset = nextOffset
+        else:
+            offset = data.find(UART_MAGIC_WORD, nextOffset)
+    return np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64)
+
+# Frame offsets, lengths and receive timestamps (time.monotonic_ns()) in a capture from raw_capture.RawCaptureWriter
+def indexTimestampedCapture(data):
+    offsets = []
+    lengths = []
+    timestamps = []
+    recordStart = captureHeaderStruct.size
+    prefixLength = timestampStruct.size + FRAME_PREFIX_LEN
+    while (recordStart + prefixLength <= len(data)):
+        frameStart = recordStart + timestampStruct.size
+        frameLength = int.from_bytes(data[frameStart + 12:frameStart + FRAME_PREFIX_LEN], byteorder='little')
+        if (data[frameStart:frameStart + len(UART_MAGIC_WORD)] != UART_MAGIC_WORD or frameLength < FRAME_PREFIX_LEN
+                or frameLength > MAX_FRAME_LENGTH):
+            # Damaged record, carry on from the next magic word
+            nextFrame = data.find(UART_MAGIC_WORD, frameStart + 1)
+            if (nextFrame < 0):
+                break
+            recordStart = nextFrame - timestampStruct.size
+            continue
+        if (frameStart + frameLength > len(data)):
+            break # Cut off at the end of the capture
+        offsets.append(frameStart)
+        lengths.append(frameLength)
+        timestamps.append(timestampStruct.unpack_from(data, recordStart)[0])
+        recordStart = frameStart + frameLength
+    return np.array(offsets, dtype=np.int64), np.array(lengths, dtype=np.int64), np.array(timestamps, dtype=np.int64)
+
+# (offsets, lengths, timestamps) saved next to the capture at path, None if there is none for a file of this size
+def loadSavedIndex(path, size):
+    try:
+        with np.load(path + '.idx.npz') as index:
+            if (int(index['size']) == size):
+                return index['offsets'], index['lengths'], index['timestamps']
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+# Memory mapped raw capture file
+class RawCaptureReader:
+    def __init__(self, path, saveIndex = True):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        # Compressed captures are read into memory whole
+        self.mapped = self.size > 0 and stripCompression(path) == path
+        if (self.mapped):
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        elif (self.size > 0):
+            with openCompressed(path) as fp:
+                self.data = fp.read()
+        else:
+            self.data = b''
+        self.timestamped = self.data[:len(CAPTURE_MAGIC)] == CAPTURE_MAGIC
+        self.wallClockOffsetNs = captureHeaderStruct.unpack_from(self.data, 0)[1] if (self.timestamped) else None
+        self.offsets, self.lengths, timestampsNs = self.loadIndex(saveIndex)
+        # Receive times in seconds, plain captures have none
+        self.timestamps = timestampsNs / 1e9 if (self.timestamped) else None
+
+    # Read the frame index saved with the capture, or build it (and save it) if there is none for this file size
+    def loadIndex(self, saveIndex):
+        index = loadSavedIndex(self.path, self.size)
+        if (index is not None):
+            return index
+        if (self.timestamped):
+            offsets, lengths, timestamps = indexTimestampedCapture(self.data)
+        else:
+            offsets, lengths = indexRawCapture(self.data)
+            timestamps = np.empty(0, dtype=np.int64)
+        if (saveIndex):
+            indexPath = self.path + '.idx.npz'
+            try:
+                np.savez(indexPath, offsets=offsets, lengths=lengths, timestamps=timestamps, size=self.size)
+            except OSError as e:
+                log.warning('Could not save frame index %s: %s' % (indexPath, e))
+        return offsets, lengths, timestamps
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # Bytes of frame n
+    def frame(self, n):
+        offset = int(self.offsets[n])
+        return self.data[offset:offset + int(self.lengths[n])]
+
+    def close(self):
+        if (self.mapped):
+            self.data.close()
+        self.file.close()
+
+# Frame dicts from a replay_N.json or replay_N.ndjson file, with every list turned back into a numpy array
+class JSONSessionReader:
+    def __init__(self, path):
+        self.path = path
+        with openCompressed(path, 'rt') as fp:
+            if (stripCompression(path).endswith('.ndjson')):
+                # Header record, then one record per line
+                lines = [line for line in fp if line.strip()]
+                session = json.loads(lines[0]) if lines else {}
+                session['data'] = [json.loads(line) for line in lines[1:]]
+            else:
+                session = json.load(fp)
+        self.cfg = session.get('cfg', '')
+        self.demo = session.get('demo', '')
+        self.device = session.get('device', '')
+        self.records = session.get('data', [])
+        self.timestamps = np.array([record.get('timestamp', np.nan) for record in self.records], dtype=np.float64)
+        if (np.isnan(self.timestamps).any()):
+            self.timestamps = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def frame(self, n):
+        record = self.records[n]
+        if ('frameData' in record):
+            frameData = record['frameData']
+        else:
+            # main.py TrackingData records only have a few fields
+            frameData = {'frameNum': record.get('frameNumber', record.get('framenumber', 0)),
+                         'heightData': record.get('HeightData', []),
+                         'numDetectedPoints': record.get('PointsDetected', 0)}
+        return {key: (np.array(value) if isinstance(value, list) else value) for key, value in frameData.items()}
+
+    def close(self):
+        pass
+
+# Number in a file name like replay_12.json or pHistBytes_3.bin, so files sort by number rather than as strings
+def fileNumber(path):
+    numbers = re.findall(r'\d+', os.path.basename(path))
+    return int(numbers[-1]) if numbers else -1
+
+def openRecording(path):
+    if (stripCompression(path).endswith('.json') or stripCompression(path).endswith('.ndjson')):
+        return JSONSessionReader(path)
+    if (path.endswith('.rsess')):
+        return ColumnarSessionReader(path)
+    return RawCaptureReader(path)
+
+# Number of frames in a recording, which is only open for as long as it takes to count them. NDJSON sessions are
+# counted by line without decoding them, raw captures from their saved index when it is up to date.
+def countFrames(path):
+    if (stripCompression(path).endswith('.ndjson')):
+        with openCompressed(path, 'rt') as fp:
+            return max(sum(1 for line in fp if line.strip()) - 1, 0) # Less the header record
+    if (not stripCompression(path).endswith('.json') and not path.endswith('.rsess')):
+        index = loadSavedIndex(path, os.path.getsize(path))
+        if (index is not None):
+            return len(index[0])
+    reader = openRecording(path)
+    try:
+        return len(reader)
+    finally:
+        reader.close()
+
+# Recordings in path, a single file or a directory of *.rsess, replay_N.ndjson, replay_N.json or *.bin files, each
+# of them compressed or not (black_box.py event clips are *.bin)
+def findRecordings(path):
+    if (os.path.isfile(path)):
+        return [path]
+    for suffix in ('.rsess', '.ndjson', '.json', '.bin'):
+        paths = []
+        for compressionSuffix in ('',) + tuple(COMPRESSION_SUFFIXES.values()):
+            paths += glob.glob(os.path.join(path, '*' + suffix + compressionSuffix))
+        # Event clip descriptions next to their captures
+        paths = [p for p in paths if not stripCompression(p).endswith(EVENT_SUFFIX)]
+        if (len(paths) > 0):
+            break
+    return sorted(paths, key=lambda p: (fileNumber(p), p))
+
+# Sequence of frames over one or more recordings
+# speed is 0 to play as fast as possible, 1 for the recorded timing, or any other factor of it
+# next() returns (frame, isRaw): raw frame bytes still to be parsed, or an already parsed JSON frame dict
+# Recordings are opened one at a time as playing reaches them, and closed before the next one is opened.
+class ReplaySource:
+    def __init__(self, path, speed = 0, loop = False, framePeriod = DEFAULT_FRAME_PERIOD):
+        self.paths = findRecordings(path)
+        if (len(self.paths) == 0):
+            raise FileNotFoundError('No recordings found in %s' % (path))
+        self.speed = speed
+        self.loop = loop
+        self.framePeriod = framePeriod
+        self.readers = [None] * len(self.paths) # Opened when first needed
+        self.counts = None
+        self.current = None # Recording being played
+        self.position = 0
+        self.cursor = None # (recording, frame in it) of position, None until next() locates it
+        self.startWallTime = None
+        self.startFrameTime = None
+        self.lastRecordedTime = None # Recorded time of the frame next() last returned, None if it has none
+
+    def reader(self, i):
+        if (self.readers[i] is None):
+            self.readers[i] = openRecording(self.paths[i])
+        return self.readers[i]
+
+    def releaseReader(self, i):
+        if (self.readers[i] is not None):
+            self.readers[i].close()
+            self.readers[i] = None
+
+    # Recording i, closing the one played before it so only one is open at a time
+    def openReader(self, i):
+        if (self.current is not None and self.current != i):
+            self.releaseReader(self.current)
+        self.current = i
+        return self.reader(i)
+
+    # First frame number of every recording, and the total count at the end. Only seeking and len() need these, so
+    # they are counted the first time either is used, see countFrames.
+    def frameCounts(self):
+        if (self.counts is None):
+            counts = [0]
+            for i, path in enumerate(self.paths):
+                reader = self.readers[i]
+                counts.append(len(reader) if (reader is not None) else countFrames(path))
+            self.counts = np.cumsum(counts)
+        return self.counts
+
+    def __len__(self):
+        return int(self.frameCounts()[-1])
+
+    # Recording and frame within it for overall frame number n
+    def locate(self, n):
+        counts = self.frameCounts()
+        i = int(np.searchsorted(counts, n, side='right')) - 1
+        return i, n - int(counts[i])
+
+    # Go to frame n. Pacing starts over from there.
+    def seek(self, n):
+        self.position = n
+        self.cursor = None
+        self.startWallTime = None
+
+    # Time in seconds recorded with a frame of recording i, None if the recording has no timestamps
+    def recordedTime(self, i, frameInFile):
+        timestamps = self.reader(i).timestamps
+        if (timestamps is None or np.isnan(timestamps[frameInFile])):
+            return None
+        return float(timestamps[frameInFile])
+
+    # Time of frame n, from the recording if it has timestamps, otherwise counted in frame periods
+    def frameTime(self, i, n, frameInFile):
+        recordedTime = self.recordedTime(i, frameInFile)
+        return n * self.framePeriod if (recordedTime is None) else recordedTime
+
+    def next(self):
+        if (self.cursor is None):
+            self.cursor = self.locate(self.position) if (self.position > 0) else (0, 0)
+        i, frameInFile = self.cursor
+        # On to the start of the next recording at the end of each one, and back to the first when looping
+        wrapped = False
+        while (1):
+            if (i >= len(self.paths)):
+                if (not self.loop or wrapped):
+                    return None, False
+                wrapped = True
+                self.seek(0)
+                i, frameInFile = 0, 0
+            if (frameInFile < len(self.openReader(i))):
+                break
+            i, frameInFile = i + 1, 0
+        n = self.position
+        reader = self.reader(i)
+        frame = reader.frame(frameInFile)
+        self.lastRecordedTime = self.recordedTime(i, frameInFile)
+        self.position += 1
+        self.cursor = (i, frameInFile + 1)
+
+        if (self.speed > 0):
+            frameTime = self.frameTime(i, n, frameInFile)
+            if (self.startWallTime is None):
+                self.startWallTime = time.monotonic()
+                self.startFrameTime = frameTime
+            delay = self.startWallTime + (frameTime - self.startFrameTime) / self.speed - time.monotonic()
+            if (delay > 0):
+                time.sleep(delay)
+        return frame, isinstance(reader, RawCaptureReader)
+
+    def close(self):
+        for reader in self.readers:
+            if (reader is not None):
+                reader.close()
+        self.readers = [None] * len(self.paths)
+        self.current = None
@@ -0,0 +1,255 @@
+import os
+import gzip
+import lzma
+import time
+import heapq
+import queue
+import shutil
+import atexit
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+# Disk quota for the recording directories (TrackingData/ and binData/ by default)
+# A RetentionManager keeps a running total of the bytes in its root directories. The directories are walked once at
+# startup, after that the writers (recorder.SessionRecorder, raw_capture.RawCaptureWriter) report every file they
+# close, so the total stays current without walking the directories again. Whenever the total goes over quotaBytes,
+# or the disk has less than minFreeBytes free, the oldest files are deleted first until it doesn't. Files being
+# written are only counted once they are closed.
+# Closed files can be compressed with gzip or lzma (xz), which replay.py reads directly.
+# Files can be pinned, e.g. the files holding a fall, and are then never deleted. A pin is an empty <file>.pin next
+# to the file, so it outlasts restarts and compression.
+# All the work is done by one background thread at the lowest CPU priority, so the frame loop never waits on it.
+
+PIN_SUFFIX = '.pin'
+TEMP_SUFFIX = '.tmp'
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'lzma': '.xz'}
+DEFAULT_COMPRESS_LEVELS = {'gzip': 6, 'lzma': 1} # lzma above 1 is slow on a Pi for little gain
+COMPRESSIBLE_SUFFIXES = ('.bin', '.ndjson', '.json')
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# path without a .gz or .xz suffix, which identifies a file before and after compression
+def stripCompression(path):
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if (path.endswith(suffix)):
+            return path[:-len(suffix)]
+    return path
+
+# Open a file that may have been compressed, for reading
+def openCompressed(path, mode = 'rb'):
+    if (path.endswith(COMPRESSION_SUFFIXES['gzip'])):
+        return gzip.open(path, mode)
+    if (path.endswith(COMPRESSION_SUFFIXES['lzma'])):
+        return lzma.open(path, mode)
+    return open(path, mode)
+
+# Drop the calling thread to the lowest CPU priority. Linux nice values are per thread, elsewhere this does nothing.
+def lowerThreadPriority():
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError) as e:
+        log.debug('Could not lower thread priority: %s' % (e))
+
+class RetentionManager:
+    # compression is None, 'gzip' or 'lzma'
+    def __init__(self, roots = ('TrackingData', 'binData'), quotaBytes = None, minFreeBytes = None, compression = None,
+                 compressLevel = None):
+        if (compression is not None and compression not in COMPRESSION_SUFFIXES):
+            raise ValueError('Unknown compression %s, expected one of %s' % (compression, list(COMPRESSION_SUFFIXES)))
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.quotaBytes = quotaBytes
+        self.minFreeBytes = minFreeBytes
+        self.compression = compression
+        self.compressLevel = DEFAULT_COMPRESS_LEVELS.get(compression) if compressLevel is None else compressLevel
+
+        # Only touched by the worker thread
+        self.files = {} # stripCompression(path): [path, size, mtime]
+        self.oldest = [] # Heap of (mtime, key), entries for files since deleted or pinned are skipped when popped
+        self.pinned = set() # Keys of pinned files
+        self.overQuotaLogged = False
+
+        # Counters
+        self.totalBytes = 0
+        self.numEvicted = 0
+        self.evictedBytes = 0
+        self.numCompressed = 0
+        self.compressedBytesSaved = 0
+
+        self.queue = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='RetentionManager', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # A writer has closed path, count it, compress it if enabled and enforce the quota
+    def fileClosed(self, path):
+        self.queue.put(('closed', os.path.abspath(path), None))
+
+    # Never delete path, which may be a file that is still being written
+    def pin(self, path, reason = ''):
+        self.queue.put(('pin', os.path.abspath(path), reason))
+
+    # Check the quota and free space now, e.g. after something else has written to the disk
+    def enforce(self):
+        self.queue.put(('enforce', None, None))
+
+    def stats(self):
+        return {'totalBytes': self.totalBytes, 'numFiles': len(self.files), 'numPinned': len(self.pinned),
+                'numEvicted': self.numEvicted, 'evictedBytes': self.evictedBytes,
+                'numCompressed': self.numCompressed, 'compressedBytesSaved': self.compressedBytesSaved}
+
+    def run(self):
+        lowerThreadPriority()
+        self.scan()
+        self.enforceQuota()
+        while (1):
+            action, path, reason = self.queue.get()
+            try:
+                if (action == 'stop'):
+                    return
+                elif (action == 'closed'):
+                    self.addFile(path)
+                    if (self.compression is not None and stripCompression(path).endswith(COMPRESSIBLE_SUFFIXES)
+                            and path == stripCompression(path)):
+                        self.compressFile(path)
+                    self.enforceQuota()
+                elif (action == 'pin'):
+                    self.pinFile(path, reason)
+                elif (action == 'enforce'):
+                    self.enforceQuota()
+            except OSError as e:
+                log.error('Retention %s of %s failed: %s' % (action, path, e))
+
+    # Count everything already in the roots. Leftovers of an interrupted compression are deleted.
+    def scan(self):
+        for root in self.roots:
+            for directory, dirNames, fileNames in os.walk(root):
+                for fileName in fileNames:
+                    path = os.path.join(directory, fileName)
+                    try:
+                        if (fileName.endswith(TEMP_SUFFIX)):
+                            os.remove(path)
+                        elif (fileName.endswith(PIN_SUFFIX)):
+                            self.pinned.add(path[:-len(PIN_SUFFIX)])
+                        else:
+                            self.addFile(path)
+                    except OSError as e:
+                        log.warning('Retention could not scan %s: %s' % (path, e))
+        log.info('Retention: %d files, %d bytes, %d pinned in %s' % (len(self.files), self.totalBytes, len(self.pinned), self.roots))
+
+    def addFile(self, path):
+        stat = os.stat(path)
+        key = stripCompression(path)
+        self.forgetFile(key)
+        self.files[key] = [path, stat.st_size, stat.st_mtime]
+        self.totalBytes += stat.st_size
+        heapq.heappush(self.oldest, (stat.st_mtime, key))
+
+    # Stop counting a file, its heap entry is dropped when it comes up
+    def forgetFile(self, key):
+        entry = self.files.pop(key, None)
+        if (entry is not None):
+            self.totalBytes -= entry[1]
+        return entry
+
+    def pinFile(self, path, reason):
+        key = stripCompression(path)
+        if (key in self.pinned):
+            return
+        os.makedirs(os.path.dirname(key), exist_ok=True)
+        with open(key + PIN_SUFFIX, 'w') as fp:
+            fp.write(reason)
+        self.pinned.add(key)
+        log.info('Pinned %s: %s' % (key, reason))
+
+    # Replace path by path.gz or path.xz, keeping its modification time so it keeps its place in the eviction order
+    def compressFile(self, path):
+        stat = os.stat(path)
+        compressedPath = path + COMPRESSION_SUFFIXES[self.compression]
+        tempPath = compressedPath + TEMP_SUFFIX
+        with open(path, 'rb') as src:
+            if (self.compression == 'gzip'):
+                dst = gzip.open(tempPath, 'wb', compresslevel=self.compressLevel)
+            else:
+                dst = lzma.open(tempPath, 'wb', preset=self.compressLevel)
+            with dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        os.utime(tempPath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tempPath, compressedPath)
+        os.remove(path)
+        # A frame index of the uncompressed file no longer matches, replay.py builds a new one when needed
+        self.removeFile(path + '.idx.npz')
+        self.addFile(compressedPath)
+        self.numCompressed += 1
+        self.compressedBytesSaved += stat.st_size - self.files[path][1]
+
+    # Delete a file, counted or not
+    def removeFile(self, path):
+        key = stripCompression(path)
+        entry = self.forgetFile(key)
+        if (entry is not None):
+            path = entry[0]
+        elif (not os.path.exists(path)):
+            return 0
+        size = entry[1] if entry is not None else os.path.getsize(path)
+        os.remove(path)
+        return size
+
+    def overBudget(self):
+        if (self.quotaBytes is not None and self.totalBytes > self.quotaBytes):
+            return True
+        if (self.minFreeBytes is not None):
+            for root in self.roots:
+                if (os.path.isdir(root) and shutil.disk_usage(root).free < self.minFreeBytes):
+                    return True
+        return False
+
+    # Delete the oldest unpinned files until under quota and above the minimum free space
+    def enforceQuota(self):
+        while (self.overBudget()):
+            if (len(self.oldest) == 0):
+                if (not self.overQuotaLogged):
+                    log.warning('Retention: over budget with only pinned or open files left (%d bytes, %d pinned)' %
+                                (self.totalBytes, len(self.pinned)))
+                    self.overQuotaLogged = True
+                return
+            mtime, key = heapq.heappop(self.oldest)
+            entry = self.files.get(key)
+            if (entry is None or entry[2] != mtime or key in self.pinned):
+                continue
+            try:
+                size = self.removeFile(key)
+                size += self.removeFile(key + '.idx.npz')
+            except OSError as e:
+                log.error('Retention could not delete %s: %s' % (entry[0], e))
+                continue
+            self.numEvicted += 1
+            self.evictedBytes += size
+            log.info('Retention: deleted %s (%d bytes)' % (entry[0], size))
+            self.removeEmptyDirectories(os.path.dirname(key))
+        self.overQuotaLogged = False
+
+    # Remove directory and its parents up to the roots once they are empty. The writers create theirs again if needed.
+    def removeEmptyDirectories(self, directory):
+        while (directory not in self.roots and any(directory.startswith(root + os.sep) for root in self.roots)):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    # Finish everything queued and stop the worker thread
+    def close(self):
+        if (not self.closed):
+            self.closed = True
+            self.queue.put(('stop', None, None))
+            self.thread.join()
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
@@ -0,0 +1,86 @@
+import logging
+log = logging.getLogger(__name__)
+
+# Sensor setup read from a .cfg file
+# Only the values the host side needs to size its buffers and interpret the output are kept, all converted to numbers:
+#   framePeriod       ms between frames, frameCfg <chirpStart> <chirpEnd> <numLoops> <numFrames> <framePeriodicity> ...
+#   maxNumTracks      most tracks the tracker reports (TIDs are 0 to maxNumTracks - 1), trackingCfg <enable>
+#                     <paramSet> <maxNumPoints> <maxNumTracks> ...
+#   boundaryBoxes     (xMin, xMax, yMin, yMax, zMin, zMax) in m of each boundaryBox, staticBoundaryBox,
+#                     presenceBoundaryBox and SceneryParam line by command, mpdBoundaryBox zones as mpdBoundaryBox<zone>
+#   sensorPosition    x, y, z (the mounting height) in m and azimuthTilt, elevationTilt in degrees. xWRx843 cfgs give
+#                     sensorPosition <height> <azimuthTilt> <elevationTilt>, xWRLx432 cfgs <x> <y> <z> <azimuthTilt>
+#                     <elevationTilt>
+# Anything not in the cfg keeps the defaults below: the 55 ms frames of the cfgs in this repo and the 30 tracks the fall
+# detectors were sized for.
+
+DEFAULT_FRAME_PERIOD = 55.0 # ms
+DEFAULT_MAX_NUM_TRACKS = 30
+BOUNDARY_BOX_COMMANDS = ('boundaryBox', 'staticBoundaryBox', 'presenceBoundaryBox', 'SceneryParam')
+
+class SensorConfig:
+    def __init__(self, cfg = None):
+        self.framePeriod = DEFAULT_FRAME_PERIOD
+        self.maxNumTracks = DEFAULT_MAX_NUM_TRACKS
+        self.boundaryBoxes = {}
+        self.sensorPosition = {'x': 0.0, 'y': 0.0, 'z': 0.0, 'azimuthTilt': 0.0, 'elevationTilt': 0.0}
+        if (cfg is not None):
+            self.parse(cfg)
+
+    # Frames per second
+    def frameRate(self):
+        return 1000.0 / self.framePeriod
+
+    # cfg is a list of lines, as sent to the device, or one string
+    def parse(self, cfg):
+        if (isinstance(cfg, str)):
+            cfg = cfg.splitlines()
+        for line in cfg:
+            args = line.split()
+            if (len(args) == 0 or args[0].startswith('%')):
+                continue
+            try:
+                self.parseLine(args)
+            except ValueError as e:
+                log.error('Could not parse cfg line "%s": %s' % (line.strip(), e))
+
+    def parseLine(self, args):
+        command = args[0]
+        if (command == 'frameCfg'):
+            if (len(args) < 6):
+                log.warning('frameCfg had fewer arguments than expected')
+            else:
+                self.framePeriod = float(args[5])
+        elif (command == 'trackingCfg'):
+            if (len(args) < 5):
+                log.warning('trackingCfg had fewer arguments than expected')
+            else:
+                self.maxNumTracks = int(args[4])
+        elif (command in BOUNDARY_BOX_COMMANDS):
+            if (len(args) < 7):
+                log.warning('%s had fewer arguments than expected' % (command))
+            else:
+                self.boundaryBoxes[command] = tuple(float(arg) for arg in args[1:7])
+        elif (command == 'mpdBoundaryBox'):
+            if (len(args) < 8):
+                log.warning('mpdBoundaryBox had fewer arguments than expected')
+            else:
+                self.boundaryBoxes['mpdBoundaryBox' + args[1]] = tuple(float(arg) for arg in args[2:8])
+        elif (command == 'sensorPosition'):
+            values = [float(arg) for arg in args[1:]]
+            if (len(values) >= 5):
+                names = ('x', 'y', 'z', 'azimuthTilt', 'elevationTilt')
+            elif (len(values) >= 3):
+                names = ('z', 'azimuthTilt', 'elevationTilt')
+            else:
+                log.warning('sensorPosition had fewer arguments than expected')
+                return
+            self.sensorPosition.update(zip(names, values))
+
+    def __repr__(self):
+        return 'SensorConfig(framePeriod=%s, maxNumTracks=%s, boundaryBoxes=%s, sensorPosition=%s)' % (
+            self.framePeriod, self.maxNumTracks, self.boundaryBoxes, self.sensorPosition)
+
+def loadSensorConfig(fname):
+    with open(fname, 'r') as cfgFile:
+        return SensorConfig(cfgFile.readlines())
@@ -0,0 +1,354 @@
+import json
+import struct
+import argparse
+from array import array
+import numpy as np
+
+from retention import stripCompression
+
+import logging
+log = logging.getLogger(__name__)
+
+# Columnar binary session files (.rsess)
+# A session is stored as chunks of frames. In each chunk every column (point cloud, tracks, heights) is one typed
+# array of all the rows of those frames back to back, so a frame is a row offset and a row count into it. A footer
+# written on close indexes every frame by number and timestamp with the file offset and row count of each column.
+# Readers memory map the file with np.memmap, so opening a day long session only reads the footer and every frame or
+# column returned is a view of the file, not a copy. If the footer is missing because the writer never got to close
+# the file, the index is rebuilt by walking the chunks, which carry their own small index.
+#
+# Layout, all little endian, blocks aligned to 64 bytes:
+#   FILE_MAGIC, u4 length, header JSON (cfg, demo, device and column names)
+#   chunks:  'CHNK', u4 meta length, u8 body length, meta JSON, body
+#            body = frameNum int64[n], timestamp float64[n], rows int64[n, columns], then one array per column
+#   footer:  'FOOT', u4 meta length, u8 body length, meta JSON, body
+#            body = frameNum int64[N], timestamp float64[N], chunk int32[N], offsets int64[N, columns], rows int64[N, columns]
+#   u8 footer offset, TRAILER_MAGIC
+
+FILE_MAGIC = b'RSESSv01'
+TRAILER_MAGIC = b'RSESSEND'
+CHUNK_MAGIC = b'CHNK'
+FOOTER_MAGIC = b'FOOT'
+ALIGNMENT = 64
+
+DEFAULT_COLUMNS = ('pointCloud', 'trackData', 'heightData')
+DEFAULT_CHUNK_FRAMES = 1024 # About a minute at 55 ms per frame
+
+blockStruct = struct.Struct('<4sIQ') # Magic, meta length, body length
+trailerStruct = struct.Struct('<Q8s') # Footer offset, magic
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+# dtype as JSON, structured dtypes as their field list
+def dtypeToJSON(dtype):
+    return dtype.descr if (dtype.names is not None) else dtype.str
+
+def dtypeFromJSON(value):
+    if (isinstance(value, list)):
+        return np.dtype([tuple(field) for field in value])
+    return np.dtype(value)
+
+# Lay out arrays one after another, each aligned, and return their offsets from the start and the total size
+def layoutArrays(arrays):
+    offsets = []
+    size = 0
+    for array in arrays:
+        size = align(size)
+        offsets.append(size)
+        size += array.nbytes
+    return offsets, size
+
+class ColumnarSessionWriter:
+    def __init__(self, path, header = None, columns = DEFAULT_COLUMNS, chunkFrames = DEFAULT_CHUNK_FRAMES):
+        self.path = path
+        self.columns = tuple(columns)
+        self.chunkFrames = chunkFrames
+        self.file = open(path, 'wb')
+        header = dict(header) if header else {}
+        header['columns'] = list(self.columns)
+        headerJSON = json.dumps(header).encode()
+        self.file.write(FILE_MAGIC + struct.pack('<I', len(headerJSON)) + headerJSON)
+        self.pad()
+
+        self.pending = [] # (frameNum, timestamp, arrays) of frames not yet written
+        self.chunkSpecs = [] # Column dtype and row shape of every chunk
+
+        # Frame index for the footer
+        self.frameNums = array('q')
+        self.timestamps = array('d')
+        self.chunkIds = array('i')
+        self.offsets = array('q')
+        self.rows = array('q')
+
+    def pad(self):
+        position = self.file.tell()
+        self.file.write(bytes(align(position) - position))
+
+    # Add one frame, an output dict from the parser (or a replayed one). Columns it doesn't have get no rows.
+    def write(self, outputDict, timestamp = None):
+        arrays = []
+        for column in self.columns:
+            value = outputDict.get(column)
+            arrays.append(np.empty((0,)) if value is None else np.asarray(value))
+        frameNum = int(outputDict.get('frameNum', len(self.frameNums) + len(self.pending)))
+        self.pending.append((frameNum, np.nan if timestamp is None else timestamp, arrays))
+        if (len(self.pending) >= self.chunkFrames):
+            self.writeChunk()
+
+    # Column dtype and row shape for a chunk, from the first frame with rows in that column
+    def chunkSpec(self, column):
+        for frameNum, timestamp, arrays in self.pending:
+            if (arrays[column].size > 0):
+                return arrays[column].dtype, arrays[column].shape[1:]
+        return np.dtype(np.float64), ()
+
+    def writeChunk(self):
+        if (len(self.pending) == 0):
+            return
+        numFrames = len(self.pending)
+        numColumns = len(self.columns)
+        frameNums = np.array([frame[0] for frame in self.pending], dtype=np.int64)
+        timestamps = np.array([frame[1] for frame in self.pending], dtype=np.float64)
+        rows = np.zeros((numFrames, numColumns), dtype=np.int64)
+        columnData = []
+        specs = []
+        for c in range(numColumns):
+            dtype, rowShape = self.chunkSpec(c)
+            parts = []
+            for i, (frameNum, timestamp, arrays) in enumerate(self.pending):
+                part = arrays[c]
+                if (part.size == 0):
+                    continue # Empty arrays from JSON sessions have lost their shape
+                if (part.shape[1:] != rowShape):
+                    log.error('Frame %d %s has rows of shape %s, expected %s, not stored' % (frameNum, self.columns[c], part.shape[1:], rowShape))
+                    continue
+                parts.append(part.astype(dtype, copy=False))
+                rows[i, c] = len(part)
+            columnData.append(np.concatenate(parts) if parts else np.empty((0,) + rowShape, dtype))
+            specs.append({'dtype': dtypeToJSON(dtype), 'shape': list(rowShape)})
+
+        bodyArrays = [frameNums, timestamps, rows] + columnData
+        offsets, bodyLength = layoutArrays(bodyArrays)
+        meta = json.dumps({'numFrames': numFrames, 'columns': specs, 'offsets': offsets}).encode()
+        # Every block starts aligned, which rebuildIndex relies on to find the next chunk
+        self.pad()
+        chunkStart = self.file.tell()
+        bodyStart = align(chunkStart + blockStruct.size + len(meta))
+        self.file.write(blockStruct.pack(CHUNK_MAGIC, len(meta), bodyLength) + meta)
+        self.pad()
+        self.writeArrays(bodyArrays, offsets, bodyStart)
+
+        # File offset of every frame's rows in each column
+        chunkId = len(self.chunkSpecs)
+        rowStarts = np.cumsum(rows, axis=0) - rows
+        for c in range(numColumns):
+            rowBytes = columnData[c].itemsize * int(np.prod(columnData[c].shape[1:], dtype=np.int64))
+            rowStarts[:, c] = bodyStart + offsets[3 + c] + rowStarts[:, c] * rowBytes
+        self.frameNums.frombytes(frameNums.tobytes())
+        self.timestamps.frombytes(timestamps.tobytes())
+        self.chunkIds.frombytes(np.full(numFrames, chunkId, dtype=np.int32).tobytes())
+        self.offsets.frombytes(rowStarts.tobytes())
+        self.rows.frombytes(rows.tobytes())
+        self.chunkSpecs.append(specs)
+        self.pending = []
+
+    def writeArrays(self, arrays, offsets, start):
+        for array, offset in zip(arrays, offsets):
+            position = self.file.tell()
+            self.file.write(bytes(start + offset - position))
+            self.file.write(np.ascontiguousarray(array).tobytes())
+
+    # Write what is left and the footer index
+    def close(self):
+        if (self.file is None):
+            return
+        self.writeChunk()
+        numColumns = len(self.columns)
+        bodyArrays = [np.frombuffer(self.frameNums, dtype=np.int64), np.frombuffer(self.timestamps, dtype=np.float64),
+                      np.frombuffer(self.chunkIds, dtype=np.int32),
+                      np.frombuffer(self.offsets, dtype=np.int64).reshape(-1, numColumns),
+                      np.frombuffer(self.rows, dtype=np.int64).reshape(-1, numColumns)]
+        offsets, bodyLength = layoutArrays(bodyArrays)
+        meta = json.dumps({'numFrames': len(self.frameNums), 'chunks': self.chunkSpecs, 'offsets': offsets}).encode()
+        self.pad()
+        footerStart = self.file.tell()
+        self.file.write(blockStruct.pack(FOOTER_MAGIC, len(meta), bodyLength) + meta)
+        self.pad()
+        self.writeArrays(bodyArrays, offsets, self.file.tell())
+        self.file.write(trailerStruct.pack(footerStart, TRAILER_MAGIC))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
+
+class ColumnarSessionReader:
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if (bytes(self.data[:len(FILE_MAGIC)]) != FILE_MAGIC):
+            raise ValueError('%s is not a columnar session file' % (path))
+        headerLength = struct.unpack_from('<I', self.data, len(FILE_MAGIC))[0]
+        headerStart = len(FILE_MAGIC) + 4
+        self.header = json.loads(bytes(self.data[headerStart:headerStart + headerLength]))
+        self.columns = tuple(self.header['columns'])
+        self.cfg = self.header.get('cfg', '')
+        self.demo = self.header.get('demo', '')
+        self.device = self.header.get('device', '')
+        self.firstChunk = align(headerStart + headerLength)
+
+        if (not self.readFooter()):
+            log.warning('%s has no footer, rebuilding its index from the chunks' % (path))
+            self.rebuildIndex()
+        self.chunkDtypes = [[(dtypeFromJSON(spec['dtype']), tuple(spec['shape'])) for spec in specs] for specs in self.chunkSpecs]
+        self.frameNumOrder = None
+
+    def readArray(self, offset, dtype, shape):
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape, dtype=np.int64))
+        return self.data[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+
+    def readBlock(self, offset, magic):
+        if (offset + blockStruct.size > len(self.data)):
+            return None
+        blockMagic, metaLength, bodyLength = blockStruct.unpack_from(self.data, offset)
+        metaStart = offset + blockStruct.size
+        bodyStart = align(metaStart + metaLength)
+        if (blockMagic != magic or bodyStart + bodyLength > len(self.data)):
+            return None
+        return json.loads(bytes(self.data[metaStart:metaStart + metaLength])), bodyStart, bodyLength
+
+    def readFooter(self):
+        if (len(self.data) < trailerStruct.size):
+            return False
+        footerStart, magic = trailerStruct.unpack_from(self.data, len(self.data) - trailerStruct.size)
+        block = self.readBlock(footerStart, FOOTER_MAGIC) if (magic == TRAILER_MAGIC) else None
+        if (block is None):
+            return False
+        meta, bodyStart, bodyLength = block
+        numFrames = meta['numFrames']
+        numColumns = len(self.columns)
+        offsets = [bodyStart + offset for offset in meta['offsets']]
+        self.frameNums = self.readArray(offsets[0], np.int64, (numFrames,))
+        self.timestamps = self.readArray(offsets[1], np.float64, (numFrames,))
+        self.chunkIds = self.readArray(offsets[2], np.int32, (numFrames,))
+        self.offsets = self.readArray(offsets[3], np.int64, (numFrames, numColumns))
+        self.rows = self.readArray(offsets[4], np.int64, (numFrames, numColumns))
+        self.chunkSpecs = meta['chunks']
+        return True
+
+    # Index every complete chunk, for files that were never closed
+    def rebuildIndex(self):
+        numColumns = len(self.columns)
+        frameNums, timestamps, chunkIds, offsets, rows = [], [], [], [], []
+        self.chunkSpecs = []
+        position = self.firstChunk
+        while (1):
+            block = self.readBlock(position, CHUNK_MAGIC)
+            if (block is None):
+                break
+            meta, bodyStart, bodyLength = block
+            numFrames = meta['numFrames']
+            chunkRows = self.readArray(bodyStart + meta['offsets'][2], np.int64, (numFrames, numColumns))
+            rowStarts = np.cumsum(chunkRows, axis=0) - chunkRows
+            for c, spec in enumerate(meta['columns']):
+                dtype = dtypeFromJSON(spec['dtype'])
+                rowBytes = dtype.itemsize * int(np.prod(spec['shape'], dtype=np.int64))
+                rowStarts[:, c] = bodyStart + meta['offsets'][3 + c] + rowStarts[:, c] * rowBytes
+            frameNums.append(self.readArray(bodyStart + meta['offsets'][0], np.int64, (numFrames,)))
+            timestamps.append(self.readArray(bodyStart + meta['offsets'][1], np.float64, (numFrames,)))
+            chunkIds.append(np.full(numFrames, len(self.chunkSpecs), dtype=np.int32))
+            offsets.append(rowStarts)
+            rows.append(chunkRows)
+            self.chunkSpecs.append(meta['columns'])
+            position = align(bodyStart + bodyLength)
+        self.frameNums = np.concatenate(frameNums) if frameNums else np.empty(0, np.int64)
+        self.timestamps = np.concatenate(timestamps) if timestamps else np.empty(0, np.float64)
+        self.chunkIds = np.concatenate(chunkIds) if chunkIds else np.empty(0, np.int32)
+        self.offsets = np.concatenate(offsets) if offsets else np.empty((0, numColumns), np.int64)
+        self.rows = np.concatenate(rows) if rows else np.empty((0, numColumns), np.int64)
+
+    def __len__(self):
+        return len(self.frameNums)
+
+    # Frame n as a dict like the parser's output, every array a view of the file
+    def frame(self, n):
+        frame = {'frameNum': int(self.frameNums[n]), 'timestamp': float(self.timestamps[n])}
+        dtypes = self.chunkDtypes[self.chunkIds[n]]
+        for c, column in enumerate(self.columns):
+            dtype, rowShape = dtypes[c]
+            frame[column] = self.readArray(int(self.offsets[n, c]), dtype, (int(self.rows[n, c]),) + rowShape)
+        return frame
+
+    # All rows of a column for frames start to stop, and each frame's first row in it (plus the total at the end)
+    # A view of the file when the frames are all in one chunk, otherwise the chunks are joined into a new array
+    def column(self, column, start = 0, stop = None):
+        c = self.columns.index(column)
+        stop = len(self) if stop is None else min(stop, len(self))
+        rows = self.rows[start:stop, c]
+        rowOffsets = np.concatenate(([0], np.cumsum(rows)))
+        parts = []
+        n = start
+        while (n < stop):
+            chunkId = self.chunkIds[n]
+            chunkEnd = min(stop, n + int(np.searchsorted(self.chunkIds[n:stop], chunkId, side='right')))
+            dtype, rowShape = self.chunkDtypes[chunkId][c]
+            numRows = int(self.rows[n:chunkEnd, c].sum())
+            parts.append(self.readArray(int(self.offsets[n, c]), dtype, (numRows,) + rowShape))
+            n = chunkEnd
+        if (len(parts) == 1):
+            return parts[0], rowOffsets
+        if (len(parts) == 0):
+            return np.empty((0,)), rowOffsets
+        return np.concatenate(parts), rowOffsets
+
+    # Index of the frame with this frame number (the first, if the device restarted and numbers repeat), or -1
+    def findFrameNum(self, frameNum):
+        if (self.frameNumOrder is None):
+            self.frameNumOrder = np.argsort(self.frameNums, kind='stable')
+        i = int(np.searchsorted(self.frameNums, frameNum, sorter=self.frameNumOrder))
+        if (i < len(self) and self.frameNums[self.frameNumOrder[i]] == frameNum):
+            return int(self.frameNumOrder[i])
+        return -1
+
+    # Index of the first frame at or after timestamp
+    def findTime(self, timestamp):
+        return int(np.searchsorted(self.timestamps, timestamp))
+
+    def close(self):
+        self.data = None
+
+# Convert a JSON session (replay_N.json / .ndjson files, see replay.py) to a columnar session file
+def convertJSONSession(source, destination, columns = DEFAULT_COLUMNS, chunkFrames = DEFAULT_CHUNK_FRAMES):
+    from replay import findRecordings, JSONSessionReader
+    paths = [path for path in findRecordings(source) if stripCompression(path).endswith(('.json', '.ndjson'))]
+    if (len(paths) == 0):
+        raise FileNotFoundError('No JSON sessions found in %s' % (source))
+    writer = None
+    numFrames = 0
+    for path in paths:
+        reader = JSONSessionReader(path)
+        if (writer is None):
+            header = {'cfg': reader.cfg, 'demo': reader.demo, 'device': reader.device}
+            writer = ColumnarSessionWriter(destination, header, columns, chunkFrames)
+        for n in range(len(reader)):
+            timestamp = None if reader.timestamps is None else float(reader.timestamps[n])
+            writer.write(reader.frame(n), timestamp)
+        numFrames += len(reader)
+        reader.close()
+    writer.close()
+    log.info('Converted %d frames from %d files to %s' % (numFrames, len(paths), destination))
+    return numFrames
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description='Convert JSON sessions to a columnar session file')
+    argParser.add_argument('source', help='replay_N.json / .ndjson file or a directory of them')
+    argParser.add_argument('destination', help='.rsess file to write')
+    args = argParser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    convertJSONSession(args.source, args.destination)
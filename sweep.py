@@ -0,0 +1,301 @@
+import csv
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from replay import ReplaySource
+from track_history import TrackHistory, TrackWindowExtrema, matchHeights, matchRounds
+from evaluate import findSessions, sessionConfig, sessionFrames, sessionLabels, scoreAlerts, DEFAULT_TOLERANCE
+import new_fall_detection
+
+import logging
+log = logging.getLogger(__name__)
+
+# Sensitivity sweep of the fall detector parameters over recorded sessions
+# Evaluates every combination of a parameter grid in one pass over each session, with the combinations on an extra
+# axis of the detector state instead of one detector per combination. The model is new_fall_detection.FallDetection,
+# whose parameters are SWEEP_PARAMETERS. fall_detection.FallDetection is the point with minHeightThreshold -inf,
+# maxFallSpeed inf, requiredConsistentFrames 1 and fallCooldownPeriod 0.
+# The heights history, speeds and track resets do not depend on the parameters, so each session is first reduced to a
+# stream of observations (one per track height per frame) by a single TrackHistory. The criteria of every combination
+# and observation are then compared at once, in blocks, and only the consistent frame counts and cooldowns are stepped
+# frame by frame, as (maxNumTracks, numCombinations) arrays.
+# Grid values are given per parameter as a list (0.4,0.5,0.6) or as start:stop:num, and all combinations are swept:
+#   python sweep.py TrackingData --grid fallingThresholdProportion=0.4:0.8:10 --grid maxFallSpeed=-1.2:-0.3:10
+#       --grid requiredConsistentFrames=1,2,3,4,5 --grid fallCooldownPeriod=5,10 --labels labels.json --csv sweep.csv
+
+SWEEP_PARAMETERS = ('fallingThresholdProportion', 'minHeightThreshold', 'maxFallSpeed', 'requiredConsistentFrames',
+                    'fallCooldownPeriod')
+OBSERVATION_BLOCK = 1 << 16 # Observations whose criteria are compared at once, bounds memory to about K * 64 kB
+
+# Parameter grid: every combination of values, as a dict of equal length arrays. Parameters not given keep the
+# new_fall_detection defaults.
+def parameterGrid(values):
+    defaults = new_fall_detection.FallDetection()
+    for name in values:
+        if (name not in SWEEP_PARAMETERS):
+            raise ValueError('Cannot sweep %s, parameters are %s' % (name, ', '.join(SWEEP_PARAMETERS)))
+    axes = [np.atleast_1d(values.get(name, getattr(defaults, name))) for name in SWEEP_PARAMETERS]
+    combinations = np.array(list(itertools.product(*axes)), dtype=np.float64).reshape(-1, len(SWEEP_PARAMETERS))
+    grid = {name: combinations[:, i] for i, name in enumerate(SWEEP_PARAMETERS)}
+    grid['requiredConsistentFrames'] = grid['requiredConsistentFrames'].astype(np.int64)
+    return grid
+
+# Values of one --grid argument, name=v1,v2,... or name=start:stop:num
+def parseGridArgument(argument):
+    name, _, spec = argument.partition('=')
+    if (':' in spec):
+        start, stop, num = spec.split(':')
+        return name, np.linspace(float(start), float(stop), int(num))
+    return name, np.array([float(value) for value in spec.split(',')])
+
+# Parameter independent part of the detector for one session, as flat arrays over its observations, in step order:
+#   frame, frameNum, time, tid, height, reference, speed per observation, reference as given by referenceMode
+#   roundStarts                                           first observation of every round (see matchRounds)
+#   resetStarts, resetTids                                tracks reset after the rounds of each round's frame,
+#                                                         resetTids[resetStarts[r]:resetStarts[r + 1]] for round r
+# Frames without heights only matter through the resets they cause, which are carried by the next round.
+def observeSession(source, config, secondsInFallBuffer = 1.5, referenceMode = 'oldest'):
+    heightHistoryLen = max(int(round(secondsInFallBuffer * 1000.0 / config.framePeriod)), 2)
+    heightBuffer = TrackHistory(config.maxNumTracks, heightHistoryLen, -5)
+    peakHeight = TrackWindowExtrema(config.maxNumTracks, heightHistoryLen, 'max', -5)
+    tracksInPreviousFrame = np.zeros(config.maxNumTracks, dtype=bool)
+    observations = {name: [] for name in ('frame', 'frameNum', 'time', 'tid', 'height', 'reference', 'speed')}
+    roundSizes = []
+    roundResets = []
+    pendingResets = []
+    numFrames = 0
+    for frameIndex, frameNum, frameTime, heights, tracks in sessionFrames(source, config):
+        numFrames = frameIndex + 1
+        tids, trackHeights = matchHeights(heights, tracks)
+        for roundTids, roundHeights in matchRounds(tids, trackHeights):
+            # Same order as new_fall_detection.FallDetection.step: push, then speed, then compare to the reference
+            heightBuffer.push(roundTids, roundHeights)
+            peakHeight.push(roundTids, roundHeights)
+            previous = heightBuffer.get(roundTids, 1).astype(roundHeights.dtype)
+            speed = (roundHeights - previous) / (1.0 / (1000.0 / config.framePeriod))
+            speed[(roundHeights == -5) | (previous == -5)] = 0
+            n = len(roundTids)
+            observations['frame'].append(np.full(n, frameIndex))
+            observations['frameNum'].append(np.full(n, frameNum))
+            observations['time'].append(np.full(n, frameTime))
+            observations['tid'].append(roundTids)
+            observations['height'].append(roundHeights)
+            if (referenceMode == 'peak'):
+                reference = peakHeight.get(roundTids)
+            else:
+                reference = heightBuffer.oldest(roundTids)
+            observations['reference'].append(reference.astype(roundHeights.dtype))
+            observations['speed'].append(speed)
+            roundSizes.append(n)
+            roundResets.append(pendingResets)
+            pendingResets = []
+
+        tracksInCurrFrame = np.zeros_like(tracksInPreviousFrame)
+        tracksInCurrFrame[tids] = True
+        tracksToReset = np.flatnonzero(tracksInPreviousFrame & ~tracksInCurrFrame)
+        heightBuffer.reset(tracksToReset)
+        peakHeight.reset(tracksToReset)
+        pendingResets = pendingResets + [tracksToReset]
+        tracksInPreviousFrame = tracksInCurrFrame
+
+    stream = {name: np.concatenate(parts) if (len(parts) > 0) else np.empty(0) for name, parts in observations.items()}
+    stream['tid'] = stream['tid'].astype(np.int64)
+    stream['roundStarts'] = np.concatenate(([0], np.cumsum(roundSizes, dtype=np.int64)))
+    resets = [np.concatenate(pending) if (len(pending) > 0) else np.empty(0, dtype=np.int64) for pending in roundResets]
+    stream['resetTids'] = np.concatenate(resets).astype(np.int64) if (len(resets) > 0) else np.empty(0, dtype=np.int64)
+    stream['resetStarts'] = np.concatenate(([0], np.cumsum([len(reset) for reset in resets], dtype=np.int64)))
+    stream['frames'] = numFrames
+    return stream
+
+# Fall criteria of every combination (rows) for observations [start, end), compared in the precision of the heights
+# as the detector does
+def fallCriteria(grid, stream, start, end):
+    height, reference, speed = (stream[name][start:end, np.newaxis] for name in ('height', 'reference', 'speed'))
+    dtype = height.dtype
+    proportion = grid['fallingThresholdProportion'].astype(dtype)
+    minHeight = grid['minHeightThreshold'].astype(dtype)
+    maxSpeed = grid['maxFallSpeed'].astype(dtype)
+    return (height < proportion * reference) & (reference > minHeight) & (speed < maxSpeed)
+
+# Alerts of every combination over a session stream, as (combination, observation) index arrays. A track that falls in
+# more than one round of a frame alerts once, as its display counter is only set once in the frame.
+# State is track major, (maxNumTracks, numCombinations), so the tracks of a round are contiguous rows.
+def sweepStream(grid, stream, maxNumTracks):
+    numCombinations = len(grid['fallingThresholdProportion'])
+    cooldown = grid['fallCooldownPeriod']
+    required = grid['requiredConsistentFrames']
+    consistentFallFrames = np.zeros((maxNumTracks, numCombinations), dtype=np.int64)
+    lastFallTime = np.full((maxNumTracks, numCombinations), -np.inf)
+    roundStarts, resetStarts, resetTids = stream['roundStarts'], stream['resetStarts'], stream['resetTids']
+    alertCombinations = []
+    alertObservations = []
+    blockStart = blockEnd = 0
+    for r in range(len(roundStarts) - 1):
+        consistentFallFrames[resetTids[resetStarts[r]:resetStarts[r + 1]]] = 0
+        start, end = roundStarts[r], roundStarts[r + 1]
+        if (end > blockEnd):
+            blockStart, blockEnd = start, max(start + OBSERVATION_BLOCK, end)
+            criteria = fallCriteria(grid, stream, blockStart, blockEnd)
+        tids = stream['tid'][start:end]
+        currentTime = stream['time'][start]
+
+        # Tracks in their cooldown keep their count, the others count up while all criteria are met
+        lastFall = lastFallTime[tids]
+        detecting = currentTime - lastFall >= cooldown
+        counts = consistentFallFrames[tids]
+        counts = np.where(detecting, (counts + 1) * criteria[start - blockStart:end - blockStart], counts)
+        fallen = detecting & (counts >= required)
+        if (fallen.any()):
+            counts[fallen] = 0
+            lastFall[fallen] = currentTime
+            lastFallTime[tids] = lastFall
+            observations, combinations = np.nonzero(fallen)
+            alertCombinations.append(combinations)
+            alertObservations.append(observations + start)
+        consistentFallFrames[tids] = counts
+    if (len(alertCombinations) == 0):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    alertCombinations, alertObservations = np.concatenate(alertCombinations), np.concatenate(alertObservations)
+    keys = alertCombinations * (stream['frames'] + 1) + stream['frame'][alertObservations]
+    keys = keys * maxNumTracks + stream['tid'][alertObservations]
+    _, first = np.unique(keys, return_index=True)
+    first.sort()
+    return alertCombinations[first], alertObservations[first]
+
+# Sweep one session. Runs in a worker process, so only returns plain values.
+def sweepSession(path, grid, cfgPath = None, referenceMode = 'oldest'):
+    numCombinations = len(grid['fallingThresholdProportion'])
+    result = {'session': path, 'frames': 0, 'seconds': 0.0, 'alertCombinations': np.empty(0, dtype=np.int64),
+              'alertFrameNums': np.empty(0, dtype=np.int64)}
+    try:
+        start = time.perf_counter()
+        source = ReplaySource(path)
+        config = sessionConfig(source, cfgPath)
+        stream = observeSession(source, config, referenceMode=referenceMode)
+        source.close()
+        combinations, observations = sweepStream(grid, stream, config.maxNumTracks)
+        result['frames'] = stream['frames']
+        result['framePeriod'] = config.framePeriod
+        result['alertCombinations'] = combinations
+        result['alertFrameNums'] = stream['frameNum'][observations].astype(np.int64)
+        result['seconds'] = time.perf_counter() - start
+        log.info('Swept %s, %d frames, %d combinations in %.1f s' % (path, stream['frames'], numCombinations,
+                                                                     result['seconds']))
+    except Exception as e:
+        log.error('Failed to sweep %s: %s' % (path, e))
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    return result
+
+# True positives, duplicates, false positives and missed falls of every combination, by evaluate.scoreAlerts on the
+# alerts of each, so both tools count one true positive per labelled fall
+def scoreCombinations(numCombinations, alertCombinations, alertFrameNums, labelFrames, toleranceFrames):
+    scores = np.zeros((4, numCombinations), dtype=np.int64)
+    scores[3] = len(labelFrames)
+    order = np.argsort(alertCombinations, kind='stable')
+    combinations, starts = np.unique(alertCombinations[order], return_index=True)
+    for combination, alertFrames in zip(combinations, np.split(alertFrameNums[order], starts[1:])):
+        scores[:, combination] = scoreAlerts(alertFrames, labelFrames, toleranceFrames)
+    return scores[0], scores[1], scores[2], scores[3]
+
+def sweep(paths, grid, labels = None, cfgPath = None, workers = None, toleranceSeconds = DEFAULT_TOLERANCE,
+          referenceMode = 'oldest'):
+    numCombinations = len(grid['fallingThresholdProportion'])
+    sessions = [session for path in paths for session in findSessions(path)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(sweepSession, sessions, [grid] * len(sessions), [cfgPath] * len(sessions),
+                                    [referenceMode] * len(sessions)))
+    elapsed = time.perf_counter() - start
+
+    table = {name: values for name, values in grid.items()}
+    for name in ('alerts', 'labelledAlerts', 'falls', 'truePositives', 'duplicates', 'falsePositives', 'missed'):
+        table[name] = np.zeros(numCombinations, dtype=np.int64)
+    labelled = False
+    for result in results:
+        alerts = np.bincount(result['alertCombinations'], minlength=numCombinations)
+        table['alerts'] += alerts
+        sessionFalls = sessionLabels(labels, result['session'])
+        if (sessionFalls is None or 'error' in result):
+            continue
+        labelled = True
+        toleranceFrames = int(round(toleranceSeconds * 1000.0 / result.get('framePeriod', 55.0)))
+        truePositives, duplicates, falsePositives, missed = scoreCombinations(numCombinations, result['alertCombinations'],
+                                                                              result['alertFrameNums'], sessionFalls,
+                                                                              toleranceFrames)
+        table['labelledAlerts'] += alerts
+        table['falls'] += len(sessionFalls)
+        table['truePositives'] += truePositives
+        table['duplicates'] += duplicates
+        table['falsePositives'] += falsePositives
+        table['missed'] += missed
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table['detected'] = table['falls'] - table['missed']
+        table['recall'] = table['detected'] / table['falls']
+        # As in evaluate.py, duplicates count against precision
+        table['precision'] = table['truePositives'] / table['labelledAlerts']
+    numFrames = sum(result['frames'] for result in results)
+    return {'sessions': results, 'table': table, 'labelled': labelled, 'combinations': numCombinations,
+            'frames': numFrames, 'seconds': elapsed}
+
+# Combinations best first: most falls detected, then fewest false alarms, then fewest duplicates. Without labels,
+# fewest alerts first.
+def rankCombinations(report):
+    table = report['table']
+    if (report['labelled']):
+        return np.lexsort((table['duplicates'], table['falsePositives'], -table['detected']))
+    return np.argsort(table['alerts'], kind='stable')
+
+def writeTable(report, fname):
+    table = report['table']
+    columns = list(SWEEP_PARAMETERS) + ['alerts', 'falls', 'detected', 'truePositives', 'duplicates', 'falsePositives',
+                                        'missed', 'precision', 'recall']
+    with open(fname, 'w', newline='') as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(columns)
+        for i in rankCombinations(report):
+            writer.writerow([table[name][i] for name in columns])
+
+def printReport(report, top = 20):
+    table = report['table']
+    for result in report['sessions']:
+        if ('error' in result):
+            print('%-40s %s' % (result['session'], result['error']))
+    print('%10s %10s %10s %10s %9s %7s %8s %10s %12s %7s' % ('threshold', 'minHeight', 'maxSpeed', 'consistent',
+          'cooldown', 'alerts', 'detected', 'duplicates', 'false alarms', 'missed'))
+    for i in rankCombinations(report)[:top]:
+        print('%10.3f %10.3f %10.3f %10d %9.1f %7d %8s %10s %12s %7s' % (table['fallingThresholdProportion'][i],
+              table['minHeightThreshold'][i], table['maxFallSpeed'][i], table['requiredConsistentFrames'][i],
+              table['fallCooldownPeriod'][i], table['alerts'][i],
+              table['detected'][i] if (report['labelled']) else '-',
+              table['duplicates'][i] if (report['labelled']) else '-',
+              table['falsePositives'][i] if (report['labelled']) else '-',
+              table['missed'][i] if (report['labelled']) else '-'))
+    print('%d combinations over %d frames in %.1f s' % (report['combinations'], report['frames'], report['seconds']))
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description='Sweep fall detector parameters over recorded sessions')
+    argParser.add_argument('paths', nargs='+', help='sessions, or directories of sessions (e.g. TrackingData)')
+    argParser.add_argument('--grid', action='append', default=[], help='name=v1,v2,... or name=start:stop:num, one of %s' % (', '.join(SWEEP_PARAMETERS)))
+    argParser.add_argument('--labels', help='JSON file of labelled fall frame numbers per session')
+    argParser.add_argument('--cfg', help='.cfg for sessions that do not store theirs')
+    argParser.add_argument('--workers', type=int, help='worker processes, default one per CPU')
+    argParser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='seconds between a labelled fall and its alert')
+    argParser.add_argument('--reference', default='oldest', choices=new_fall_detection.REFERENCE_MODES, help='height the current height is compared with')
+    argParser.add_argument('--top', type=int, default=20, help='combinations to print')
+    argParser.add_argument('--csv', help='also write every combination to this file')
+    args = argParser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    labels = None
+    if (args.labels is not None):
+        with open(args.labels, 'r') as fp:
+            labels = json.load(fp)
+    grid = parameterGrid(dict(parseGridArgument(argument) for argument in args.grid))
+    report = sweep(args.paths, grid, labels, args.cfg, args.workers, args.tolerance, args.reference)
+    printReport(report, args.top)
+    if (args.csv is not None):
+        writeTable(report, args.csv)
@@ -0,0 +1,100 @@
+import io
+import time
+import threading
+
+from acquisition import FrameRing, RING_BLOCK, RING_DROP_OLDEST, RING_LATEST
+from datastream import UARTParser
+from uart_framer import UART_MAGIC_WORD, FRAME_PREFIX_LEN
+
+def fill(ring, numFrames):
+    for n in range(numFrames):
+        assert ring.put(n)
+
+def drain(ring):
+    frames = []
+    while (1):
+        frame = ring.get(timeout=0)
+        if (frame is None):
+            return frames
+        frames.append(frame)
+
+def test_drop_oldest():
+    ring = FrameRing(4, RING_DROP_OLDEST)
+    fill(ring, 10)
+    assert ring.stats() == {'framesIn': 10, 'framesOut': 0, 'framesDropped': 6, 'framesQueued': 4}
+    assert drain(ring) == [6, 7, 8, 9]
+    assert ring.stats() == {'framesIn': 10, 'framesOut': 4, 'framesDropped': 6, 'framesQueued': 0}
+
+def test_latest():
+    ring = FrameRing(4, RING_LATEST)
+    fill(ring, 3)
+    # Only the newest frame comes out, the two before it are dropped when it is taken
+    assert ring.get(timeout=0) == 2
+    assert ring.stats() == {'framesIn': 3, 'framesOut': 1, 'framesDropped': 2, 'framesQueued': 0}
+    fill(ring, 10)
+    assert drain(ring) == [9]
+    assert ring.stats() == {'framesIn': 13, 'framesOut': 2, 'framesDropped': 11, 'framesQueued': 0}
+
+def test_block():
+    ring = FrameRing(4, RING_BLOCK)
+    writer = threading.Thread(target=fill, args=(ring, 10))
+    writer.start()
+    # The writer waits once the ring is full
+    deadline = time.monotonic() + 5
+    while (len(ring) < 4 and time.monotonic() < deadline):
+        time.sleep(0.001)
+    time.sleep(0.05)
+    assert ring.stats() == {'framesIn': 4, 'framesOut': 0, 'framesDropped': 0, 'framesQueued': 4}
+    frames = [ring.get(timeout=5) for n in range(10)]
+    writer.join(5)
+    assert frames == list(range(10))
+    assert ring.stats() == {'framesIn': 10, 'framesOut': 10, 'framesDropped': 0, 'framesQueued': 0}
+
+def test_closed_ring():
+    ring = FrameRing(2, RING_BLOCK)
+    fill(ring, 2)
+    # A writer blocked on a full ring gives up when it is closed, frames already in it can still be taken
+    writer = threading.Thread(target=lambda: results.append(ring.put(2)))
+    results = []
+    writer.start()
+    ring.close()
+    writer.join(5)
+    assert results == [False]
+    assert drain(ring) == [0, 1]
+    assert ring.get() is None
+
+# Serial port stand-in that times out once its bytes are used up
+class BytesPort:
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.data.getbuffer()) - self.data.tell()
+
+    def readinto(self, buffer):
+        numRead = self.data.readinto(buffer)
+        if (numRead == 0):
+            time.sleep(0.005)
+        return numRead
+
+def rawFrame(frameNum):
+    body = frameNum.to_bytes(4, byteorder='little')
+    length = FRAME_PREFIX_LEN + len(body)
+    return bytes(UART_MAGIC_WORD) + bytes(4) + length.to_bytes(4, byteorder='little') + body
+
+def test_acquisition_stats():
+    parser = UARTParser('DoubleCOMPort')
+    parser.dataCom = BytesPort(b''.join(rawFrame(n) for n in range(10)))
+    parser.startAcquisition(ringSize=4, policy=RING_DROP_OLDEST)
+    try:
+        deadline = time.monotonic() + 5
+        while (parser.acquisitionStats()['framesIn'] < 10 and time.monotonic() < deadline):
+            time.sleep(0.005)
+        assert parser.acquisitionStats() == {'framesIn': 10, 'framesOut': 0, 'framesDropped': 6, 'framesQueued': 4}
+        frames = [parser.acquisition.ring.get(timeout=0)[0] for n in range(4)]
+        assert frames == [rawFrame(n) for n in range(6, 10)]
+        assert parser.acquisitionStats()['framesOut'] == 4
+    finally:
+        parser.stopAcquisition()
+    assert parser.acquisitionStats() is None
@@ -0,0 +1,87 @@
+import os
+import json
+import numpy as np
+
+from black_box import BlackBoxRecorder, EVENT_SUFFIX
+from fall_detection import FallDetection
+from replay import RawCaptureReader
+from uart_framer import UART_MAGIC_WORD, FRAME_PREFIX_LEN
+
+FRAME_LENGTH = 100
+FRAME_PERIOD_NS = 100 * 1000 * 1000
+
+# A frame of FRAME_LENGTH bytes that carries its number
+def rawFrame(frameNum):
+    body = frameNum.to_bytes(4, byteorder='little') + bytes(FRAME_LENGTH - FRAME_PREFIX_LEN - 4)
+    return bytes(UART_MAGIC_WORD) + bytes(4) + FRAME_LENGTH.to_bytes(4, byteorder='little') + body
+
+def addFrames(blackBox, frameNums):
+    for frameNum in frameNums:
+        blackBox.add(rawFrame(frameNum), frameNum * FRAME_PERIOD_NS)
+
+# Frame numbers and trigger records of every clip in directory
+def readClips(directory):
+    clips = []
+    for name in sorted(os.listdir(directory)):
+        if (not name.endswith(EVENT_SUFFIX)):
+            continue
+        with open(os.path.join(directory, name)) as fp:
+            event = json.load(fp)
+        reader = RawCaptureReader(os.path.join(directory, event['capture']), saveIndex=False)
+        frameNums = [int.from_bytes(reader.frame(n)[FRAME_PREFIX_LEN:FRAME_PREFIX_LEN + 4], byteorder='little')
+                     for n in range(len(reader))]
+        reader.close()
+        clips.append((frameNums, event))
+    return clips
+
+def test_byte_budget_keeps_most_recent_frames(tmp_path):
+    # Room for 10 frames, well under the 100 s before the event
+    blackBox = BlackBoxRecorder(str(tmp_path), preSeconds=100, postSeconds=0.5, byteBudget=10 * FRAME_LENGTH)
+    addFrames(blackBox, range(50))
+    assert len(blackBox.ring) == 10 and blackBox.ringBytes == 10 * FRAME_LENGTH
+
+    fallDetection = FallDetection(maxNumTracks=4)
+    fallDetection.fallBufferDisplay[1] = fallDetection.numFramesToDisplayFall - 1 # An older fall
+    fallDetection.fallBufferDisplay[2] = fallDetection.numFramesToDisplayFall
+    assert blackBox.checkFalls(fallDetection) == [2]
+    # The clip ends postSeconds after the trigger, at frame 54
+    addFrames(blackBox, range(50, 60))
+    blackBox.close()
+
+    [(frameNums, event)] = readClips(str(tmp_path))
+    assert frameNums == list(range(40, 55))
+    assert event['numFrames'] == 15
+    [trigger] = event['triggers']
+    assert trigger['reason'] == 'Fall detected for tracks [2]'
+    assert trigger['timestampNs'] == 49 * FRAME_PERIOD_NS
+    assert trigger['detector']['fallBufferDisplay'] == [0, 99, 100, 0]
+
+def test_pre_seconds_limit(tmp_path):
+    blackBox = BlackBoxRecorder(str(tmp_path), preSeconds=1, postSeconds=0.2)
+    addFrames(blackBox, range(30))
+    blackBox.trigger('test')
+    addFrames(blackBox, range(30, 40))
+    blackBox.close()
+    [(frameNums, event)] = readClips(str(tmp_path))
+    assert frameNums == list(range(19, 32))
+
+def test_no_fall_no_clip(tmp_path):
+    blackBox = BlackBoxRecorder(str(tmp_path), preSeconds=1, postSeconds=0.2)
+    addFrames(blackBox, range(30))
+    fallDetection = FallDetection(maxNumTracks=4)
+    fallDetection.fallBufferDisplay[:] = np.arange(4) + 50
+    assert blackBox.checkFalls(fallDetection) == []
+    blackBox.close()
+    assert readClips(str(tmp_path)) == []
+
+def test_trigger_during_clip_extends_it(tmp_path):
+    blackBox = BlackBoxRecorder(str(tmp_path), preSeconds=0.5, postSeconds=0.5, byteBudget=100 * FRAME_LENGTH)
+    addFrames(blackBox, range(10))
+    blackBox.trigger('first')
+    addFrames(blackBox, range(10, 13))
+    blackBox.trigger('second')
+    addFrames(blackBox, range(13, 30))
+    blackBox.close()
+    [(frameNums, event)] = readClips(str(tmp_path))
+    assert frameNums == list(range(4, 18))
+    assert [trigger['reason'] for trigger in event['triggers']] == ['first', 'second']
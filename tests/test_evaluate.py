@@ -0,0 +1,46 @@
+import json
+import numpy as np
+
+from replay import ReplaySource
+from evaluate import scoreAlerts, sessionConfig, sessionFrames
+
+def test_one_true_positive_per_fall():
+    # One fall raised on every frame while it holds
+    assert scoreAlerts(list(range(100, 129)), [110], 36) == (1, 28, 0, 0)
+
+def test_false_positives_and_missed():
+    assert scoreAlerts([10, 500, 900], [505, 2000], 36) == (1, 0, 2, 1)
+
+def test_one_alert_matches_one_fall():
+    # Two falls close together and one alert near both: only one of them is detected
+    assert scoreAlerts([100], [90, 110], 36) == (1, 0, 0, 1)
+    assert scoreAlerts([95, 105], [90, 110], 36) == (2, 0, 0, 0)
+
+def test_no_alerts_or_labels():
+    assert scoreAlerts([], [5, 6], 36) == (0, 0, 0, 2)
+    assert scoreAlerts([5, 6], [], 36) == (0, 0, 2, 0)
+
+def writeSession(path, timestamps):
+    with open(path, 'w') as fp:
+        fp.write(json.dumps({'cfg': ''}) + '\n')
+        for n, timestamp in enumerate(timestamps):
+            record = {'frameData': {'frameNum': n, 'heightData': []}}
+            if (timestamp is not None):
+                record['timestamp'] = timestamp
+            fp.write(json.dumps(record) + '\n')
+
+def test_frame_times_follow_recorded_timestamps(tmp_path):
+    # A dropped frame between the second and third
+    path = str(tmp_path / 'replay_1.ndjson')
+    writeSession(path, [1000.0, 1000.055, 1000.165, 1000.22])
+    source = ReplaySource(path)
+    times = [frameTime for _, _, frameTime, _, _ in sessionFrames(source, sessionConfig(source))]
+    assert np.allclose(times, [0.0, 0.055, 0.165, 0.22])
+
+def test_frame_times_without_timestamps(tmp_path):
+    path = str(tmp_path / 'replay_1.ndjson')
+    writeSession(path, [None] * 3)
+    source = ReplaySource(path)
+    config = sessionConfig(source)
+    times = [frameTime for _, _, frameTime, _, _ in sessionFrames(source, config)]
+    assert np.allclose(times, np.arange(3) * config.framePeriod / 1000.0)
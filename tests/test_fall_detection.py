@@ -0,0 +1,151 @@
+from collections import deque
+import numpy as np
+
+import fall_detection
+import new_fall_detection
+
+# The deque per track detectors the numpy ones replaced, with their buffer length and clock as the detectors now
+# take them. mode is 'old' for fall_detection, 'new' for new_fall_detection.
+class DequeFallDetection:
+    def __init__(self, mode, maxNumTracks, frameTime, referenceMode = 'oldest'):
+        self.mode = mode
+        self.referenceMode = referenceMode
+        self.frameTime = frameTime
+        self.heightHistoryLen = max(int(round(1.5 * 1000.0 / frameTime)), 2)
+        self.heightBuffer = [deque([-5] * self.heightHistoryLen, maxlen=self.heightHistoryLen) for i in range(maxNumTracks)]
+        self.tracksIDsInPreviousFrame = []
+        self.fallBufferDisplay = [0] * maxNumTracks
+        self.lastFallTime = [-np.inf] * maxNumTracks
+        self.consistentFallFrames = [0] * maxNumTracks
+
+    def reference(self, tid):
+        return max(self.heightBuffer[tid]) if (self.referenceMode == 'peak') else self.heightBuffer[tid][-1]
+
+    def step(self, heights, tracks, currentTime):
+        self.fallBufferDisplay = [max(result - 1, 0) for result in self.fallBufferDisplay]
+        trackIDsInCurrFrame = []
+        for height in heights:
+            for track in tracks:
+                if (int(track[0]) != int(height[0])):
+                    continue
+                tid = int(height[0])
+                self.heightBuffer[tid].appendleft(height[1])
+                trackIDsInCurrFrame.append(tid)
+                fallen = self.heightBuffer[tid][0] < 0.6 * self.reference(tid)
+                if (self.mode == 'old'):
+                    if (fallen):
+                        self.fallBufferDisplay[tid] = 100
+                    continue
+                buffer = self.heightBuffer[tid]
+                speed = 0 if (buffer[0] == -5 or buffer[1] == -5) else (buffer[0] - buffer[1]) / (self.frameTime / 1000.0)
+                if (currentTime - self.lastFallTime[tid] < 10.0):
+                    continue
+                if (fallen and self.reference(tid) > 0.3 and speed < -0.6):
+                    self.consistentFallFrames[tid] += 1
+                    if (self.consistentFallFrames[tid] >= 3):
+                        self.fallBufferDisplay[tid] = 100
+                        self.lastFallTime[tid] = currentTime
+                        self.consistentFallFrames[tid] = 0
+                else:
+                    self.consistentFallFrames[tid] = 0
+        for tid in set(self.tracksIDsInPreviousFrame) - set(trackIDsInCurrFrame):
+            self.heightBuffer[tid].extendleft([-5] * self.heightHistoryLen)
+            self.consistentFallFrames[tid] = 0
+        self.tracksIDsInPreviousFrame = trackIDsInCurrFrame
+        return self.fallBufferDisplay
+
+def makeDetectors(maxNumTracks, frameTime, referenceMode = 'oldest'):
+    return [(fall_detection.FallDetection(maxNumTracks, frameTime, referenceMode=referenceMode), DequeFallDetection('old', maxNumTracks, frameTime, referenceMode)),
+            (new_fall_detection.FallDetection(maxNumTracks, frameTime, referenceMode=referenceMode), DequeFallDetection('new', maxNumTracks, frameTime, referenceMode))]
+
+def step(detector, heights, tracks, currentTime):
+    if (isinstance(detector, fall_detection.FallDetection)):
+        return detector.step(heights, tracks)
+    return detector.step(heights, tracks, currentTime)
+
+# Tracks that come and go, fall, reappear under the same TID, and sometimes get two heights or two tracks
+def randomFrames(rng, numFrames, maxNumTracks):
+    heights = rng.uniform(1.2, 1.8, maxNumTracks)
+    fallFrames = np.zeros(maxNumTracks, dtype=int) # Frames left of a fall, 0.25 m each
+    frames = []
+    for n in range(numFrames):
+        present = rng.random(maxNumTracks) < 0.95
+        fallFrames[(fallFrames == 0) & (rng.random(maxNumTracks) < 0.02)] = 5
+        standUp = (fallFrames == 0) & (heights < 1.0) & (rng.random(maxNumTracks) < 0.05)
+        heights = np.clip(heights + rng.normal(0, 0.02, maxNumTracks), 0.1, 2.0)
+        heights = np.where(fallFrames > 0, np.maximum(heights - 0.25, 0.1), np.where(standUp, 1.6, heights))
+        fallFrames = np.maximum(fallFrames - 1, 0)
+        tids = np.flatnonzero(present)
+        frameHeights = np.column_stack((tids, heights[tids], np.zeros(len(tids))))
+        trackTids = tids
+        if (len(tids) > 0 and rng.random() < 0.1):
+            frameHeights = np.vstack((frameHeights, [tids[0], heights[tids[0]] * 0.5, 0]))
+        if (len(tids) > 0 and rng.random() < 0.05):
+            trackTids = np.append(tids, tids[-1])
+        tracks = np.zeros((len(trackTids), 16))
+        tracks[:, 0] = trackTids
+        frames.append((frameHeights[rng.permutation(len(frameHeights))], tracks))
+    return frames
+
+def test_matches_deque_detectors():
+    maxNumTracks = 8
+    frameTime = 55
+    frames = randomFrames(np.random.default_rng(18), 3000, maxNumTracks)
+    for referenceMode in ('oldest', 'peak'):
+        for detector, reference in makeDetectors(maxNumTracks, frameTime, referenceMode):
+            numAlerts = 0
+            for n, (heights, tracks) in enumerate(frames):
+                currentTime = n * frameTime / 1000.0
+                results = step(detector, heights, tracks, currentTime)
+                expected = reference.step(heights, tracks, currentTime)
+                assert list(results) == expected, 'frame %d' % (n)
+                numAlerts += int((results == 100).sum())
+            assert numAlerts > 0
+
+def frame(*tidHeights):
+    heights = np.array([[tid, height, 0] for tid, height in tidHeights], dtype=np.float64).reshape(-1, 3)
+    tracks = np.zeros((len(set(tid for tid, height in tidHeights)), 16))
+    tracks[:, 0] = sorted(set(tid for tid, height in tidHeights))
+    return heights, tracks
+
+def test_drop_display_and_reset():
+    detector = fall_detection.FallDetection(maxNumTracks=4, frameTime=100)
+    for n in range(15):
+        detector.step(*frame((1, 1.7)))
+    assert detector.step(*frame((1, 1.7)))[1] == 0
+    # A drop below 0.6 of the oldest height shows for numFramesToDisplayFall frames, counting down every frame
+    assert detector.step(*frame((1, 0.5)))[1] == 100
+    assert detector.step(*frame())[1] == 99
+    assert detector.step(*frame())[1] == 98
+    # Track 1 left, so its history is gone and it does not fall again from where it was
+    for n in range(3):
+        detector.step(*frame((1, 0.5)))
+    assert detector.fallBufferDisplay[1] == 95
+    # Two heights for the same TID in a frame both go into its history, in order
+    detector.step(*frame((2, 1.7), (2, 0.9)))
+    assert list(detector.heightBuffer.get(np.array([2]), 0)) == [0.9]
+    assert list(detector.heightBuffer.get(np.array([2]), 1)) == [1.7]
+    assert detector.fallBufferDisplay[2] == 0
+
+def test_new_detector_needs_consistent_frames_and_cools_down():
+    detector = new_fall_detection.FallDetection(maxNumTracks=4, frameTime=100)
+    currentTime = 0.0
+    def stepAt(*tidHeights):
+        nonlocal currentTime
+        currentTime += 0.1
+        return detector.step(*frame(*tidHeights), currentTime=currentTime)[1]
+    for n in range(15):
+        stepAt((1, 1.7))
+    # Falling fast for requiredConsistentFrames frames before it counts
+    assert stepAt((1, 0.9)) == 0
+    assert stepAt((1, 0.8)) == 0
+    assert stepAt((1, 0.7)) == 100
+    # Within fallCooldownPeriod of that alert another fall is ignored
+    for n in range(15):
+        stepAt((1, 1.7))
+    for height in (0.9, 0.8, 0.7):
+        stepAt((1, height))
+    assert detector.fallBufferDisplay[1] == 100 - 18
+    # A track that leaves loses its consistent frame count
+    stepAt()
+    assert detector.consistentFallFrames[1] == 0
@@ -0,0 +1,133 @@
+import math
+import struct
+import numpy as np
+
+from parseFrame import newPointCloud
+from parseTLVs import (parsePointCloudTLV, parseSphericalPointCloudTLV, parseCompressedSphericalPointCloudTLV,
+                       parsePointCloudExtTLV, parseSideInfoTLV, parseTrackTLV, parseTrackTLV2D, parseTrackHeightTLV,
+                       parseTargetIndexTLV)
+
+# Values below are chosen to be exact in float32, so they come back unchanged
+
+def parse(parser, tlvData, numPoints, compact = False):
+    outputDict = {'pointCloud': newPointCloud(numPoints, compact=compact)}
+    parser(tlvData, len(tlvData), outputDict)
+    return outputDict
+
+def points(outputDict):
+    pointCloud = outputDict['pointCloud']
+    if (pointCloud.dtype.names is None):
+        return pointCloud
+    columns = [pointCloud[name].astype(np.float64) for name in pointCloud.dtype.names]
+    columns[4] *= 0.1
+    columns[5] *= 0.1
+    return np.column_stack(columns)
+
+def test_point_cloud():
+    tlvData = struct.pack('4f', 1.5, -2.25, 0.75, -0.5) + struct.pack('4f', 0.0, 3.0, 1.25, 2.0)
+    outputDict = parse(parsePointCloudTLV, tlvData, 2)
+    assert outputDict['numDetectedPoints'] == 2
+    np.testing.assert_array_equal(outputDict['pointCloud'], [[1.5, -2.25, 0.75, -0.5, 0, 0, 255],
+                                                             [0.0, 3.0, 1.25, 2.0, 0, 0, 255]])
+
+def test_spherical_point_cloud():
+    # Straight ahead, to the right, and up
+    tlvData = (struct.pack('4f', 2.0, 0.0, 0.0, 0.5) + struct.pack('4f', 4.0, math.pi / 2, 0.0, -1.0) +
+               struct.pack('4f', 1.0, 0.0, math.pi / 2, 0.25))
+    outputDict = parse(parseSphericalPointCloudTLV, tlvData, 3)
+    assert outputDict['numDetectedPoints'] == 3
+    np.testing.assert_allclose(outputDict['pointCloud'][:, 0:4], [[0, 2, 0, 0.5], [4, 0, 0, -1], [0, 0, 1, 0.25]], atol=1e-6)
+
+def test_compressed_spherical_point_cloud():
+    # Units of elevation, azimuth, Doppler, range, SNR, then int8 elevation and azimuth, int16 Doppler, uint16 range and SNR
+    tlvData = struct.pack('5f', 0.25, 0.5, 0.125, 0.5, 0.5)
+    tlvData += struct.pack('2bh2H', 0, 0, -8, 10, 30)      # 5 m straight ahead, -1 m/s, 15 dB
+    tlvData += struct.pack('2bh2H', 0, -2, 4, 4, 20)       # 2 m at -1 rad azimuth, 0.5 m/s, 10 dB
+    tlvData += struct.pack('2bh2H', -2, 0, 0, 6, 1)        # 3 m at -0.5 rad elevation
+    for compact in (False, True):
+        outputDict = parse(parseCompressedSphericalPointCloudTLV, tlvData, 3, compact)
+        assert outputDict['numDetectedPoints'] == 3
+        expected = [[0, 5, 0, -1, 15],
+                    [2 * math.sin(-1), 2 * math.cos(-1), 0, 0.5, 10],
+                    [0, 3 * math.cos(-0.5), 3 * math.sin(-0.5), 0, 0.5]]
+        np.testing.assert_allclose(points(outputDict)[:, 0:5], expected, atol=1e-6)
+
+def test_point_cloud_ext():
+    # Units of x/y/z, Doppler, SNR, noise, then int16 x y z Doppler and uint8 SNR and noise
+    tlvData = struct.pack('4f2h', 0.25, 0.5, 0.5, 0.25, 0, 0)
+    tlvData += struct.pack('4h2B', 4, -8, 12, -3, 40, 20)
+    tlvData += struct.pack('4h2B', -1, 0, 2, 6, 255, 0)
+    for compact in (False, True):
+        outputDict = parse(parsePointCloudExtTLV, tlvData, 2, compact)
+        assert outputDict['numDetectedPoints'] == 2
+        np.testing.assert_allclose(points(outputDict)[:, 0:6], [[1, -2, 3, -1.5, 20, 5], [-0.25, 0, 0.5, 3, 127.5, 0]], atol=1e-6)
+
+def test_side_info():
+    # SNR and noise in 0.1 dB steps
+    tlvData = struct.pack('2H', 153, 12) + struct.pack('2H', 0, 65535)
+    for compact in (False, True):
+        outputDict = parse(parseSideInfoTLV, tlvData, 2, compact)
+        np.testing.assert_allclose(points(outputDict)[:, 4:6], [[15.3, 1.2], [0, 6553.5]])
+
+def test_truncated_tlv():
+    # The length says three points but only two and a half arrived
+    tlvData = struct.pack('4f', 1, 2, 3, 4) * 2 + struct.pack('2f', 5, 6)
+    outputDict = {'pointCloud': newPointCloud(3)}
+    parsePointCloudTLV(tlvData, 48, outputDict)
+    assert outputDict['numDetectedPoints'] == 2
+    np.testing.assert_array_equal(outputDict['pointCloud'][:2, 0:4], [[1, 2, 3, 4], [1, 2, 3, 4]])
+
+# tid, position, velocity, acceleration, ec[16], g, confidence
+def packTrack(tid, base):
+    values = [base + 0.25 * n for n in range(9)]
+    ec = [base + 0.5 * n for n in range(16)]
+    return struct.pack('I9f16f2f', tid, *values, *ec, base * 2, 0.75), values, ec
+
+def test_tracks():
+    tlvData = b''
+    expected = []
+    covariances = []
+    for tid, base in ((3, 1.0), (250, -4.0)):
+        record, values, ec = packTrack(tid, base)
+        tlvData += record
+        expected.append([tid] + values + [base * 2, 0.75] + [0] * 4)
+        covariances.append(np.reshape(ec, (4, 4)))
+    outputDict = {}
+    parseTrackTLV(tlvData, len(tlvData), outputDict)
+    assert outputDict['numDetectedTracks'] == 2
+    assert outputDict['trackData'].shape == (2, 16) and outputDict['trackData'].dtype == np.float64
+    np.testing.assert_array_equal(outputDict['trackData'], expected)
+    assert 'trackCovariance' not in outputDict
+
+    outputDict = {}
+    parseTrackTLV(tlvData, len(tlvData), outputDict, keepCovariance=True, dtype=np.float32)
+    assert outputDict['trackData'].dtype == np.float32
+    np.testing.assert_array_equal(outputDict['trackData'], expected)
+    trackCovariance = outputDict['trackCovariance']
+    assert trackCovariance.shape == (2, 4, 4) and trackCovariance.dtype == np.float32
+    np.testing.assert_array_equal(trackCovariance, covariances)
+    # A copy, not a view of the frame
+    assert not np.shares_memory(trackCovariance, np.frombuffer(tlvData, np.uint8))
+
+def test_tracks_2d():
+    # tid, position, velocity, acceleration, ec[9], g, confidence
+    tlvData = struct.pack('I6f9f2f', 7, 1, 2, 3, 4, 5, 6, *range(9), 1.5, 0.5)
+    outputDict = {}
+    parseTrackTLV2D(tlvData, len(tlvData), outputDict, keepCovariance=True)
+    np.testing.assert_array_equal(outputDict['trackData'], [[7, 1, 2, 3, 4, 5, 6, 1.5, 0.5] + [0] * 7])
+    np.testing.assert_array_equal(outputDict['trackCovariance'], np.arange(9).reshape(1, 3, 3))
+
+def test_track_heights():
+    tlvData = struct.pack('I2f', 3, 1.75, 0.25) + struct.pack('I2f', 9, 0.5, 0.0)
+    outputDict = {}
+    parseTrackHeightTLV(tlvData, len(tlvData), outputDict)
+    assert outputDict['numDetectedHeights'] == 2
+    np.testing.assert_array_equal(outputDict['heightData'], [[3, 1.75, 0.25], [9, 0.5, 0.0]])
+
+def test_target_indexes():
+    tlvData = bytes([3, 255, 0, 253])
+    outputDict = {'pointCloud': newPointCloud(4)}
+    parseTargetIndexTLV(tlvData, len(tlvData), outputDict)
+    assert outputDict['trackIndexes'].dtype == np.uint8
+    np.testing.assert_array_equal(outputDict['trackIndexes'], [3, 255, 0, 253])
+    np.testing.assert_array_equal(outputDict['pointCloud'][:, 6], [3, 255, 0, 253])
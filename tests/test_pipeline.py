@@ -0,0 +1,73 @@
+import os
+import sys
+import subprocess
+import numpy as np
+
+from gui_common import COMPACT_POINT_CLOUD_DTYPE
+from pipeline import packFrame, unpackFrame, SharedFrameRing, RingReader
+
+def roundTrip(outputDict, numDetectedObj = 0):
+    view = bytearray(65536)
+    length = packFrame(outputDict, memoryview(view), numDetectedObj)
+    assert length > 0
+    return unpackFrame(bytes(view[:length]))
+
+def test_scalars_stay_scalars():
+    frame = roundTrip({'frameNum': 1234, 'error': 0, 'numDetectedPoints': np.int64(17), 'numDetectedTracks': 2.5}, 17)
+    assert frame.numDetectedObj == 17
+    assert frame['frameNum'] == 1234 and isinstance(frame['frameNum'], int)
+    assert frame['error'] == 0 and isinstance(frame['error'], int)
+    assert frame['numDetectedPoints'] == 17 and isinstance(frame['numDetectedPoints'], int)
+    assert frame['numDetectedTracks'] == 2.5 and isinstance(frame['numDetectedTracks'], float)
+    assert 'Fall detected in frame %d' % (frame['frameNum']) == 'Fall detected in frame 1234'
+
+def test_arrays_round_trip():
+    rng = np.random.default_rng(11)
+    compact = np.zeros(5, COMPACT_POINT_CLOUD_DTYPE)
+    compact['z'] = rng.normal(size=5)
+    compact['trackIndex'] = 3
+    outputDict = {'pointCloud': rng.normal(size=(9, 7)), 'trackData': rng.normal(size=(2, 16)).astype(np.float32),
+                  'heightData': rng.normal(size=(4, 3))[::2], # Not contiguous
+                  'trackIndexes': np.arange(6, dtype=np.uint8), 'empty': np.empty((0, 3)), 'compactPC': compact,
+                  'vitals': {'heartRate': 60}}
+    frame = roundTrip(outputDict)
+    assert 'vitals' not in frame
+    for key, value in outputDict.items():
+        if (key == 'vitals'):
+            continue
+        assert frame[key].dtype == value.dtype and frame[key].shape == value.shape
+        np.testing.assert_array_equal(frame[key], value)
+
+def test_frame_too_big():
+    assert packFrame({'pointCloud': np.zeros((100, 7))}, memoryview(bytearray(256))) == -1
+
+def test_ring_round_trip():
+    ring = SharedFrameRing(numSlots=4, slotSize=64, create=True)
+    try:
+        reader = RingReader(ring.name)
+        for n in range(3):
+            assert ring.write(bytes([n]) * (n + 1), timestampNs=n)
+        for n in range(3):
+            frameView, timestampNs = reader.read(timeout=0)
+            assert bytes(frameView) == bytes([n]) * (n + 1) and timestampNs == n
+        assert reader.read(timeout=0) == (None, None)
+        reader.release()
+    finally:
+        ring.release()
+
+def test_ring_outlives_attached_process():
+    # A process that attaches to the ring and exits must leave it to its creator
+    ring = SharedFrameRing(numSlots=4, slotSize=64, create=True)
+    try:
+        ring.write(b'frame')
+        # The child waits for its resource tracker, which cleans up after it, before it exits
+        attach = ('from pipeline import RingReader; from multiprocessing import resource_tracker; '
+                  'reader = RingReader(%r, fromStart=True); reader.read(0); reader.release(); '
+                  'resource_tracker._resource_tracker._stop()')
+        subprocess.run([sys.executable, '-c', attach % (ring.name)], check=True,
+                       cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        reader = RingReader(ring.name, fromStart=True)
+        assert bytes(reader.read(timeout=0)[0]) == b'frame'
+        reader.release()
+    finally:
+        ring.release()
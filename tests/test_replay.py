@@ -0,0 +1,91 @@
+import os
+import gzip
+import json
+
+import replay
+from replay import ReplaySource, countFrames
+from uart_framer import UART_MAGIC_WORD, FRAME_PREFIX_LEN
+
+def writeSession(path, frameNums, opener = open):
+    with opener(path, 'wt') as fp:
+        fp.write(json.dumps({'cfg': ''}) + '\n')
+        for frameNum in frameNums:
+            fp.write(json.dumps({'frameData': {'frameNum': frameNum}}) + '\n')
+
+def rawFrame(frameNum):
+    body = frameNum.to_bytes(4, byteorder='little')
+    length = FRAME_PREFIX_LEN + len(body)
+    return bytes(UART_MAGIC_WORD) + bytes(4) + length.to_bytes(4, byteorder='little') + body
+
+def makeSessions(directory):
+    writeSession(os.path.join(directory, 'replay_1.ndjson'), range(0, 5))
+    writeSession(os.path.join(directory, 'replay_2.ndjson'), [])
+    writeSession(os.path.join(directory, 'replay_3.ndjson.gz'), range(5, 12), gzip.open)
+    return list(range(12))
+
+# Counts every reader opened and the most open at once
+def watchReaders(monkeypatch):
+    stats = {'opened': 0, 'open': 0, 'mostOpen': 0}
+    openRecording = replay.openRecording
+    def watchedOpen(path):
+        reader = openRecording(path)
+        close = reader.close
+        def watchedClose():
+            stats['open'] -= 1
+            close()
+        reader.close = watchedClose
+        stats['opened'] += 1
+        stats['open'] += 1
+        stats['mostOpen'] = max(stats['mostOpen'], stats['open'])
+        return reader
+    monkeypatch.setattr(replay, 'openRecording', watchedOpen)
+    return stats
+
+def play(source):
+    frameNums = []
+    while (1):
+        frame, isRaw = source.next()
+        if (frame is None):
+            return frameNums
+        frameNums.append(frame['frameNum'])
+
+def test_plays_one_recording_at_a_time(tmp_path, monkeypatch):
+    expected = makeSessions(str(tmp_path))
+    stats = watchReaders(monkeypatch)
+    source = ReplaySource(str(tmp_path))
+    assert play(source) == expected
+    # Every recording opened once, for playing, and never two at once
+    assert stats['opened'] == 3
+    assert stats['mostOpen'] == 1
+
+def test_len_and_seek(tmp_path, monkeypatch):
+    expected = makeSessions(str(tmp_path))
+    stats = watchReaders(monkeypatch)
+    source = ReplaySource(str(tmp_path))
+    assert len(source) == len(expected)
+    # NDJSON sessions are counted without opening them
+    assert stats['opened'] == 0
+    source.seek(7)
+    assert play(source) == expected[7:]
+    source.seek(len(expected) + 3)
+    assert source.next() == (None, False)
+
+def test_loop(tmp_path):
+    expected = makeSessions(str(tmp_path))
+    source = ReplaySource(str(tmp_path), loop=True)
+    assert [source.next()[0]['frameNum'] for _ in range(30)] == (expected * 3)[:30]
+
+def test_loop_over_empty_recordings(tmp_path):
+    writeSession(str(tmp_path / 'replay_1.ndjson'), [])
+    source = ReplaySource(str(tmp_path), loop=True)
+    assert source.next() == (None, False)
+    assert len(source) == 0
+
+def test_count_raw_capture_from_index(tmp_path, monkeypatch):
+    path = str(tmp_path / 'pHistBytes_1.bin')
+    with open(path, 'wb') as fp:
+        fp.write(b''.join(rawFrame(n) for n in range(9)))
+    assert countFrames(path) == 9 # Indexes the capture
+    stats = watchReaders(monkeypatch)
+    assert countFrames(path) == 9
+    assert stats['opened'] == 0
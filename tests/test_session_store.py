@@ -0,0 +1,77 @@
+import gzip
+import lzma
+import json
+import numpy as np
+
+from session_store import ColumnarSessionWriter, ColumnarSessionReader, ALIGNMENT, trailerStruct, convertJSONSession
+
+def makeFrame(n, rng):
+    numPoints = int(rng.integers(0, 40))
+    return {'frameNum': n, 'pointCloud': rng.normal(size=(numPoints, 7)),
+            'trackData': rng.normal(size=(n % 3, 16)), 'heightData': np.array([[1, 1.5 + n * 0.01, 0.1]])}
+
+def writeSession(path, numFrames, chunkFrames):
+    rng = np.random.default_rng(numFrames)
+    frames = [makeFrame(n, rng) for n in range(numFrames)]
+    with ColumnarSessionWriter(str(path), {'cfg': ['sensorStart']}, chunkFrames=chunkFrames) as writer:
+        for n, frame in enumerate(frames):
+            writer.write(frame, timestamp=n * 0.055)
+    return frames
+
+def checkFrames(reader, frames):
+    for n, frame in enumerate(frames):
+        stored = reader.frame(n)
+        assert stored['frameNum'] == frame['frameNum']
+        for column in ('pointCloud', 'trackData', 'heightData'):
+            np.testing.assert_array_equal(stored[column].reshape(frame[column].shape), frame[column])
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'session.rsess'
+    frames = writeSession(path, 30, 7)
+    reader = ColumnarSessionReader(str(path))
+    assert len(reader) == 30
+    checkFrames(reader, frames)
+    reader.close()
+
+def test_chunks_are_aligned(tmp_path):
+    path = tmp_path / 'session.rsess'
+    writeSession(path, 30, 7)
+    data = path.read_bytes()
+    chunkStarts = [i for i in range(0, len(data), ALIGNMENT) if data[i:i + 4] == b'CHNK']
+    assert len(chunkStarts) == 5
+
+def test_rebuild_index_without_footer(tmp_path):
+    path = tmp_path / 'session.rsess'
+    frames = writeSession(path, 30, 7)
+    data = path.read_bytes()
+    footerStart = trailerStruct.unpack_from(data, len(data) - trailerStruct.size)[0]
+
+    # A writer that never closed the file: every chunk is there, the footer is not
+    truncated = tmp_path / 'truncated.rsess'
+    truncated.write_bytes(data[:footerStart])
+    reader = ColumnarSessionReader(str(truncated))
+    assert len(reader) == 30
+    checkFrames(reader, frames)
+    reader.close()
+
+    # Cut in the middle of the last chunk, which is dropped
+    lastChunk = data.rfind(b'CHNK', 0, footerStart)
+    truncated.write_bytes(data[:(lastChunk + footerStart) // 2])
+    reader = ColumnarSessionReader(str(truncated))
+    assert len(reader) == 28
+    checkFrames(reader, frames[:28])
+    reader.close()
+
+def test_convert_compressed_json_sessions(tmp_path):
+    records = [{'frameData': {'frameNum': n, 'heightData': [[1, 1.5, 0.1]]}, 'timestamp': 100 + n * 0.055} for n in range(6)]
+    with gzip.open(str(tmp_path / 'replay_1.ndjson.gz'), 'wt') as fp:
+        fp.write(json.dumps({'cfg': ['sensorStart']}) + '\n')
+        fp.writelines(json.dumps(record) + '\n' for record in records[:4])
+    with lzma.open(str(tmp_path / 'replay_2.ndjson.xz'), 'wt') as fp:
+        fp.write(json.dumps({'cfg': ['sensorStart']}) + '\n')
+        fp.writelines(json.dumps(record) + '\n' for record in records[4:])
+    destination = str(tmp_path / 'session.rsess')
+    assert convertJSONSession(str(tmp_path), destination) == 6
+    reader = ColumnarSessionReader(destination)
+    assert [reader.frame(n)['frameNum'] for n in range(len(reader))] == list(range(6))
+    assert reader.cfg == ['sensorStart']
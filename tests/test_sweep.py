@@ -0,0 +1,21 @@
+import numpy as np
+
+from evaluate import scoreAlerts
+from sweep import scoreCombinations
+
+def test_scores_match_evaluate():
+    rng = np.random.default_rng(23)
+    labels = [100, 400, 410, 900]
+    combinations = rng.integers(0, 6, 200)
+    frameNums = rng.integers(0, 1000, 200)
+    truePositives, duplicates, falsePositives, missed = scoreCombinations(8, combinations, frameNums, labels, 36)
+    for k in range(8):
+        expected = scoreAlerts(frameNums[combinations == k], labels, 36)
+        assert (truePositives[k], duplicates[k], falsePositives[k], missed[k]) == expected
+    # Combinations without alerts miss every fall
+    assert (truePositives[7], missed[7]) == (0, 4)
+
+def test_alert_spam_is_one_true_positive():
+    frameNums = np.arange(100, 130)
+    scores = scoreCombinations(1, np.zeros(30, dtype=np.int64), frameNums, [110], 36)
+    assert [int(score[0]) for score in scores] == [1, 29, 0, 0]
@@ -0,0 +1,89 @@
+import numpy as np
+
+from gui_common import COMPACT_POINT_CLOUD_DTYPE
+from track_features import trackFeatures, TrackFeatures, FEATURE_NAMES, TRACK_FEATURE_PERCENTILES
+
+# Features of every track one at a time, the plain way
+def naiveFeatures(pointCloud, tracks, trackIndexes):
+    features = np.full((len(tracks), len(FEATURE_NAMES)), np.nan)
+    for row, tid in enumerate(tracks[:, 0].astype(int)):
+        # A TID repeated in tracks gets its points in its first row only
+        points = pointCloud[trackIndexes == tid] if (tid not in tracks[:row, 0]) else pointCloud[:0]
+        features[row, 0] = len(points)
+        if (len(points) == 0):
+            continue
+        z = points[:, 2]
+        features[row, 1:4] = points[:, 0:3].mean(axis=0)
+        features[row, 4] = z.std()
+        features[row, 5:8] = [np.percentile(z, p) for p in TRACK_FEATURE_PERCENTILES]
+        features[row, 8] = points[:, 3].mean()
+        features[row, 9] = points[:, 4].mean()
+    return features
+
+def randomFrame(rng, numPoints, tids):
+    pointCloud = rng.normal(size=(numPoints, 7))
+    pointCloud[:, 4] = np.round(rng.uniform(0, 30, numPoints), 1)
+    trackIndexes = rng.choice(np.append(tids, [253, 254, 255]), numPoints).astype(np.uint8)
+    pointCloud[:, 6] = trackIndexes
+    tracks = np.zeros((len(tids), 16))
+    tracks[:, 0] = tids
+    return pointCloud, tracks, trackIndexes
+
+def test_matches_per_track_loop():
+    rng = np.random.default_rng(25)
+    for numPoints in (0, 1, 5, 200):
+        pointCloud, tracks, trackIndexes = randomFrame(rng, numPoints, np.array([3, 0, 7, 3, 12]))
+        expected = naiveFeatures(pointCloud, tracks, trackIndexes)
+        np.testing.assert_allclose(trackFeatures(pointCloud, tracks), expected)
+        np.testing.assert_allclose(trackFeatures(pointCloud, tracks, trackIndexes=trackIndexes), expected)
+
+def test_compact_point_cloud():
+    rng = np.random.default_rng(3)
+    pointCloud, tracks, trackIndexes = randomFrame(rng, 100, np.array([1, 2]))
+    compact = np.zeros(len(pointCloud), dtype=COMPACT_POINT_CLOUD_DTYPE)
+    for column, name in enumerate(COMPACT_POINT_CLOUD_DTYPE.names):
+        compact[name] = np.round(pointCloud[:, column] * 10) if (column == 4) else pointCloud[:, column]
+    # The points as the compact layout holds them, SNR in 0.1 dB steps
+    stored = np.column_stack([compact[name].astype(np.float64) for name in COMPACT_POINT_CLOUD_DTYPE.names])
+    stored[:, 4] *= 0.1
+    np.testing.assert_allclose(trackFeatures(compact, tracks), naiveFeatures(stored, tracks, trackIndexes), rtol=1e-9)
+
+def test_delayed_indexes_pair_with_previous_point_cloud():
+    rng = np.random.default_rng(6843)
+    tids = np.array([1, 4])
+    frames = []
+    previousIndexes = None
+    for frameNum in range(1, 5):
+        pointCloud, tracks, trackIndexes = randomFrame(rng, 20 + frameNum, tids)
+        frame = {'frameNum': frameNum, 'pointCloud': pointCloud, 'numDetectedPoints': len(pointCloud), 'trackData': tracks}
+        # The indexes sent with a frame are those of the previous one's points
+        if (previousIndexes is not None):
+            frame['trackIndexes'] = previousIndexes
+        frames.append((frame, trackIndexes))
+        previousIndexes = trackIndexes
+
+    featureTracker = TrackFeatures()
+    first = featureTracker.update(frames[0][0])
+    assert (first[:, 0] == 0).all() and np.isnan(first[:, 1:]).all()
+    previousFrame, previousIndexes = frames[0]
+    previousCloud = previousFrame['pointCloud'].copy()
+    for frame, trackIndexes in frames[1:]:
+        # A frame pool would reuse the previous frame's arrays
+        previousFrame['pointCloud'][:] = 0
+        np.testing.assert_allclose(featureTracker.update(frame), naiveFeatures(previousCloud, frame['trackData'], previousIndexes))
+        previousFrame, previousIndexes, previousCloud = frame, trackIndexes, frame['pointCloud'].copy()
+
+def test_no_pairing_across_a_gap():
+    rng = np.random.default_rng(1)
+    featureTracker = TrackFeatures()
+    pointCloud, tracks, trackIndexes = randomFrame(rng, 10, np.array([2]))
+    featureTracker.update({'frameNum': 1, 'pointCloud': pointCloud, 'trackData': tracks})
+    # Frame 2 was lost, so frame 3's indexes belong to points that were never seen
+    features = featureTracker.update({'frameNum': 3, 'pointCloud': pointCloud, 'trackData': tracks, 'trackIndexes': trackIndexes})
+    assert features[0, 0] == 0
+
+def test_not_delayed():
+    rng = np.random.default_rng(2)
+    pointCloud, tracks, trackIndexes = randomFrame(rng, 30, np.array([5, 6]))
+    frame = {'frameNum': 1, 'pointCloud': pointCloud, 'trackData': tracks, 'trackIndexes': trackIndexes}
+    np.testing.assert_allclose(TrackFeatures(delayed=False).update(frame), naiveFeatures(pointCloud, tracks, trackIndexes))
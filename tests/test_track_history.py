@@ -0,0 +1,54 @@
+import numpy as np
+
+from track_history import TrackWindowExtrema, MonotonicWindow
+
+# Pushes to a random subset of tracks each frame, with resets, checking every track against the values pushed since
+# its last reset
+def checkWindowExtrema(windowLen, mode, seed):
+    rng = np.random.default_rng(seed)
+    maxNumTracks = 6
+    extremum = np.max if (mode == 'max') else np.min
+    extrema = TrackWindowExtrema(maxNumTracks, windowLen, mode)
+    pushed = [[] for tid in range(maxNumTracks)]
+    numResetsCrossed = 0
+    for frame in range(400):
+        tids = np.flatnonzero(rng.random(maxNumTracks) < 0.7)
+        values = rng.integers(0, 20, len(tids)).astype(np.float64) # Repeats, so ties are covered
+        extrema.push(tids, values)
+        for tid, value in zip(tids, values):
+            pushed[tid].append(value)
+        resetTids = np.flatnonzero(rng.random(maxNumTracks) < 0.03)
+        extrema.reset(resetTids)
+        for tid in resetTids:
+            # The window after a reset would reach back into the values before it
+            numResetsCrossed += len(pushed[tid]) >= windowLen
+            pushed[tid] = []
+        expected = [extremum(values[-windowLen:]) if (len(values) > 0) else -5 for values in pushed]
+        assert extrema.get(np.arange(maxNumTracks)).tolist() == expected, 'frame %d' % (frame)
+    assert numResetsCrossed > 0
+
+def test_window_max():
+    for windowLen in (1, 2, 5, 16):
+        checkWindowExtrema(windowLen, 'max', windowLen)
+
+def test_window_min():
+    for windowLen in (1, 3, 8):
+        checkWindowExtrema(windowLen, 'min', windowLen + 100)
+
+def test_get_before_push():
+    extrema = TrackWindowExtrema(3, 4, fill=-5)
+    assert extrema.toList() == [-5, -5, -5]
+    extrema.push(np.array([1]), np.array([2.5]))
+    assert extrema.toList() == [-5, 2.5, -5]
+
+def test_monotonic_window():
+    rng = np.random.default_rng(24)
+    values = rng.integers(0, 10, 300).astype(np.float64)
+    for windowLen in (1, 4, 9):
+        for mode, extremum in (('max', np.max), ('min', np.min)):
+            window = MonotonicWindow(windowLen, mode)
+            for n, value in enumerate(values):
+                assert window.push(value) == extremum(values[max(n + 1 - windowLen, 0):n + 1])
+            window.reset()
+            assert window.get() is None
+            assert window.push(3.0) == 3.0
@@ -0,0 +1,136 @@
+import numpy as np
+from gui_common import pointCloudColumn, isCompactPointCloud
+
+import logging
+log = logging.getLogger(__name__)
+
+# Per-track features of the point cloud
+# The target index TLV gives the TID each point is associated with, with 253 and above for points without a track.
+# On x843 devices (the xWR6843 this package runs) the indexes sent with a frame are those of the previous frame's
+# point cloud, and their count is its point count (people_tracking.updateGraph shows points a frame late for this).
+# The parser still writes them into column 6 of the frame's own point cloud, so there they label the wrong points.
+# TrackFeatures keeps the previous point cloud and pairs each frame's trackIndexes with it, and trackFeatures takes
+# the indexes to use. Points are grouped by the row of their track in trackData with np.bincount, and
+# sorted by (track, z) for the height percentiles, so every feature of every track comes out of a few passes over
+# the points with no loop over points or tracks. The result has one row per row of trackData, so it lines up with it
+# (np.hstack((trackData, features)) joins them), and columns as FEATURE_NAMES:
+#   numPoints           points associated with the track
+#   x, y, z             centroid of the points in m
+#   zSpread             standard deviation of the points' z in m
+#   z10, z50, z90       percentiles of the points' z in m (TRACK_FEATURE_PERCENTILES)
+#   doppler             mean Doppler of the points in m/s
+#   snr                 mean SNR of the points in dB
+# Every feature but numPoints is NaN for tracks without points.
+
+TRACK_FEATURE_PERCENTILES = (10, 50, 90)
+FEATURE_NAMES = (('numPoints', 'x', 'y', 'z', 'zSpread') + tuple('z%d' % p for p in TRACK_FEATURE_PERCENTILES) +
+                 ('doppler', 'snr'))
+FEATURE_COLUMNS = {name: column for column, name in enumerate(FEATURE_NAMES)}
+MAX_TRACK_INDEX = 253 # Track indexes from here on mark points without a track
+
+# (len(tracks), len(FEATURE_NAMES)) features of tracks (trackData, TID in column 0) from a point cloud in either
+# layout (see gui_common), of which only the first numPoints points are used if given
+# trackIndexes holds the TID of every point, one per point of pointCloud. Without it column 6 of the point cloud is
+# used, which only matches the points on devices whose indexes are not delayed.
+def trackFeatures(pointCloud, tracks, numPoints = None, trackIndexes = None):
+    tracks = np.asarray(tracks)
+    numTracks = len(tracks)
+    features = np.full((numTracks, len(FEATURE_NAMES)), np.nan)
+    features[:, 0] = 0
+    if (numTracks == 0 or pointCloud is None or len(pointCloud) == 0):
+        return features
+    if (numPoints is not None):
+        pointCloud = pointCloud[:numPoints]
+    if (trackIndexes is None):
+        trackIndexes = pointCloudColumn(pointCloud, 6)
+    elif (len(trackIndexes) != len(pointCloud)):
+        log.error('%d track indexes for %d points, the point cloud is not the one they describe' % (len(trackIndexes), len(pointCloud)))
+        return features
+
+    # Row in tracks of every point's track, -1 for none. A TID repeated in tracks gets its first row.
+    trackTids = tracks[:, 0].astype(np.intp)
+    trackRows = np.arange(numTracks)
+    hasTid = (trackTids >= 0) & (trackTids < MAX_TRACK_INDEX)
+    rowOfTid = np.full(256, -1, dtype=np.intp)
+    rowOfTid[trackTids[hasTid][::-1]] = trackRows[hasTid][::-1]
+    pointRows = rowOfTid[np.asarray(trackIndexes).astype(np.intp) & 0xFF]
+    associated = pointRows >= 0
+    pointRows = pointRows[associated]
+    if (len(pointRows) == 0):
+        return features
+
+    columns = {}
+    for column, name in ((0, 'x'), (1, 'y'), (2, 'z'), (3, 'doppler'), (4, 'snr')):
+        columns[name] = pointCloudColumn(pointCloud, column)[associated].astype(np.float64)
+    if (isCompactPointCloud(pointCloud)):
+        columns['snr'] *= 0.1 # The compact layout keeps SNR in 0.1 dB steps
+
+    counts = np.bincount(pointRows, minlength=numTracks)
+    hasPoints = counts > 0
+    features[:, 0] = counts
+    for name, values in columns.items():
+        sums = np.bincount(pointRows, values, minlength=numTracks)
+        features[hasPoints, FEATURE_COLUMNS[name]] = sums[hasPoints] / counts[hasPoints]
+
+    # Spread around each track's own centroid, which stays accurate for points far from the origin
+    z = columns['z']
+    meanZ = features[:, FEATURE_COLUMNS['z']]
+    deviations = np.bincount(pointRows, (z - meanZ[pointRows]) ** 2, minlength=numTracks)
+    features[hasPoints, FEATURE_COLUMNS['zSpread']] = np.sqrt(deviations[hasPoints] / counts[hasPoints])
+
+    # Percentiles interpolated between the closest ranks of each track's sorted z, as np.percentile does by default
+    # Sorted by z, then stably by track, which is quicker than np.lexsort
+    byZ = np.argsort(z)
+    sortedZ = z[byZ[np.argsort(pointRows[byZ], kind='stable')]]
+    starts = (np.cumsum(counts) - counts)[hasPoints]
+    lasts = starts + counts[hasPoints] - 1
+    for percentile in TRACK_FEATURE_PERCENTILES:
+        position = starts + (counts[hasPoints] - 1) * (percentile / 100.0)
+        below = np.floor(position).astype(np.intp)
+        above = np.minimum(below + 1, lasts)
+        fraction = position - below
+        percentileZ = sortedZ[below] + (sortedZ[above] - sortedZ[below]) * fraction
+        features[hasPoints, FEATURE_COLUMNS['z%d' % percentile]] = percentileZ
+    return features
+
+# Features of the tracks of a parsed frame (a dict or a lazy parseFrame.Frame), lined up with its trackData, with
+# the frame's own point cloud and column 6. Only right for devices whose track indexes are not delayed, see
+# TrackFeatures for x843 devices.
+# The frame needs the point cloud and target index TLVs as well as the track TLVs.
+def frameTrackFeatures(frame):
+    tracks = frame.get('trackData')
+    if (tracks is None):
+        return np.empty((0, len(FEATURE_NAMES)))
+    return trackFeatures(frame.get('pointCloud'), tracks, frame.get('numDetectedPoints'))
+
+# Features of the tracks of successive frames, from the points their track indexes describe
+# delayed is True for x843 devices, where each frame's trackIndexes go with the previous frame's point cloud. That
+# point cloud is kept as a copy, since a frame pool reuses the arrays of earlier frames. The first frame, and any
+# frame after a gap in frameNum, has no point cloud to pair with and its tracks get no points.
+class TrackFeatures:
+    def __init__(self, delayed = True):
+        self.delayed = delayed
+        self.previousPointCloud = None
+        self.previousFrameNum = None
+
+    # Features of frame's tracks, lined up with its trackData. Call once per frame, in order.
+    def update(self, frame):
+        if (not self.delayed):
+            return frameTrackFeatures(frame)
+        frameNum = frame.get('frameNum')
+        follows = (frameNum is not None and self.previousFrameNum is not None and frameNum == self.previousFrameNum + 1)
+        pointCloud = self.previousPointCloud if (follows) else None
+        pointCloudNow = frame.get('pointCloud')
+        if (pointCloudNow is not None):
+            self.previousPointCloud = pointCloudNow[:frame.get('numDetectedPoints', len(pointCloudNow))].copy()
+        else:
+            self.previousPointCloud = None
+        self.previousFrameNum = frameNum
+
+        tracks = frame.get('trackData')
+        if (tracks is None):
+            return np.empty((0, len(FEATURE_NAMES)))
+        trackIndexes = frame.get('trackIndexes')
+        if (pointCloud is None or trackIndexes is None):
+            return trackFeatures(None, tracks)
+        return trackFeatures(pointCloud, tracks, trackIndexes=trackIndexes)
@@ -0,0 +1,200 @@
+import time
+from collections import deque
+import numpy as np
+
+# Per-track history of one value (height, speed, ...) for every track ID at once
+# A (maxNumTracks, historyLen) ring with one write cursor per track, so pushing the values of all tracks in a frame,
+# reading any age and resetting tracks are each a single numpy operation whatever the number of tracks.
+# Age 0 is the newest value and age historyLen - 1 the oldest, as in a deque(maxlen=historyLen) filled with
+# appendleft() and read with [age]. Ages beyond what was pushed since the track was last reset read as fill, so a
+# reset only zeroes the track's count of valid values instead of rewriting its row.
+class TrackHistory:
+    def __init__(self, maxNumTracks, historyLen, fill = -5, dtype = np.float64):
+        self.historyLen = historyLen
+        self.fill = fill
+        self.values = np.full((maxNumTracks, historyLen), fill, dtype=dtype)
+        self.cursor = np.zeros(maxNumTracks, dtype=np.intp) # Column of the newest value of every track
+        self.numValid = np.zeros(maxNumTracks, dtype=np.intp) # Values pushed since the last reset, up to historyLen
+
+    # Push one value for each of tids, which must not repeat
+    def push(self, tids, values):
+        cursor = (self.cursor[tids] + 1) % self.historyLen
+        self.cursor[tids] = cursor
+        self.values[tids, cursor] = values
+        self.numValid[tids] = np.minimum(self.numValid[tids] + 1, self.historyLen)
+
+    # Value pushed age pushes before the newest for each of tids, fill where there is none since the last reset
+    def get(self, tids, age = 0):
+        values = self.values[tids, (self.cursor[tids] - age) % self.historyLen]
+        return np.where(age < self.numValid[tids], values, self.fill)
+
+    def newest(self, tids):
+        return self.get(tids, 0)
+
+    def oldest(self, tids):
+        return self.get(tids, self.historyLen - 1)
+
+    # Forget the history of tids
+    def reset(self, tids):
+        self.numValid[tids] = 0
+
+    # History of every track as lists, newest first
+    def toList(self):
+        ages = np.arange(self.historyLen)
+        columns = (self.cursor[:, np.newaxis] - ages) % self.historyLen
+        values = np.take_along_axis(self.values, columns, axis=1)
+        return np.where(ages < self.numValid[:, np.newaxis], values, self.fill).tolist()
+
+# Extremum (max or min) of the last windowLen values of a single stream, in O(1) amortized per value
+# A monotonic deque of (index, value): a value is dropped once a newer one is at least as extreme, since it can never
+# be the extremum of a later window, and the front is dropped once it leaves the window, so the front is the extremum.
+class MonotonicWindow:
+    def __init__(self, windowLen, mode = 'max'):
+        self.windowLen = windowLen
+        self.mode = mode
+        self.window = deque()
+        self.count = 0
+
+    # Push a value, returns the extremum of the window it ends
+    def push(self, value):
+        if (self.mode == 'max'):
+            while (len(self.window) > 0 and self.window[-1][1] <= value):
+                self.window.pop()
+        else:
+            while (len(self.window) > 0 and self.window[-1][1] >= value):
+                self.window.pop()
+        self.window.append((self.count, value))
+        if (self.window[0][0] <= self.count - self.windowLen):
+            self.window.popleft()
+        self.count += 1
+        return self.window[0][1]
+
+    # Extremum of the window, None when empty
+    def get(self):
+        return self.window[0][1] if (len(self.window) > 0) else None
+
+    def reset(self):
+        self.window.clear()
+        self.count = 0
+
+# Extremum (max or min) of the last windowLen values pushed for every track ID at once, in O(1) amortized per value
+# The array-backed counterpart of MonotonicWindow: a deque does not vectorize over tracks, so every track's values are
+# cut into blocks of windowLen (van Herk / Gil-Werman). The window ending at the newest value is the end of the
+# previous block, whose suffix extrema are kept, followed by the values of the current block, whose running extremum
+# is kept. So a push and a read are a few numpy operations whatever the window length, and a block costs one
+# accumulate over windowLen values when it completes. Only values pushed since a track was last reset count, with fill
+# when there are none, and as in TrackHistory a reset only zeroes counters.
+class TrackWindowExtrema:
+    def __init__(self, maxNumTracks, windowLen, mode = 'max', fill = -5, dtype = np.float64):
+        self.windowLen = windowLen
+        self.fill = fill
+        self.extremum = np.maximum if (mode == 'max') else np.minimum
+        self.block = np.empty((maxNumTracks, windowLen), dtype=dtype) # Values of the current block
+        self.suffix = np.empty((maxNumTracks, windowLen + 1), dtype=dtype) # Extremum of the previous block from column on
+        self.suffix[:, windowLen] = -np.inf if (mode == 'max') else np.inf
+        self.running = np.empty(maxNumTracks, dtype=dtype) # Extremum of the current block so far
+        self.position = np.zeros(maxNumTracks, dtype=np.intp) # Values in the current block
+        self.numValid = np.zeros(maxNumTracks, dtype=np.intp) # Values pushed since the last reset, up to windowLen
+
+    # Push one value for each of tids, which must not repeat
+    def push(self, tids, values):
+        position = self.position[tids]
+        self.block[tids, position] = values
+        self.running[tids] = np.where(position == 0, values, self.extremum(self.running[tids], values))
+        position += 1
+        self.numValid[tids] = np.minimum(self.numValid[tids] + 1, self.windowLen)
+        completed = position == self.windowLen
+        if (completed.any()):
+            completedTids = tids[completed]
+            self.suffix[completedTids, :self.windowLen] = self.extremum.accumulate(self.block[completedTids, ::-1], axis=1)[:, ::-1]
+            position[completed] = 0
+        self.position[tids] = position
+
+    # Extremum of the window of each of tids, fill where nothing was pushed since the last reset
+    def get(self, tids):
+        # The previous block only holds values of the window once a whole block was pushed since the last reset
+        position = np.where(self.numValid[tids] == self.windowLen, self.position[tids], self.windowLen)
+        values = self.extremum(self.running[tids], self.suffix[tids, position])
+        return np.where(self.numValid[tids] > 0, values, self.fill)
+
+    # Forget the values of tids
+    def reset(self, tids):
+        self.position[tids] = 0
+        self.numValid[tids] = 0
+
+    # Extremum of the window of every track as a list
+    def toList(self):
+        return self.get(np.arange(len(self.numValid))).tolist()
+
+# Join the rows of heightData and trackData with the same TID (column 0) in one pass over sorted track TIDs
+# Returns aligned heightIndex and trackIndex arrays, one entry per matching pair, ordered as a nested loop over the
+# heights and then the tracks would find them. firstMatch keeps only the first matching track of each height.
+def joinTracks(heights, tracks, firstMatch = False):
+    if (len(heights) == 0 or len(tracks) == 0):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    heightTids = np.asarray(heights)[:, 0].astype(np.intp)
+    trackTids = np.asarray(tracks)[:, 0].astype(np.intp)
+    order = np.argsort(trackTids, kind='stable')
+    sortedTids = trackTids[order]
+    first = np.searchsorted(sortedTids, heightTids, 'left')
+    numMatches = np.searchsorted(sortedTids, heightTids, 'right') - first
+    if (firstMatch):
+        numMatches = np.minimum(numMatches, 1)
+    heightIndex = np.repeat(np.arange(len(heightTids)), numMatches)
+    # Position of every pair among the matches of its height
+    matchNumber = np.arange(len(heightIndex)) - np.repeat(np.cumsum(numMatches) - numMatches, numMatches)
+    return heightIndex, order[np.repeat(first, numMatches) + matchNumber]
+
+# Heights of the tracks in a frame, one (tid, height) for each pair of height and track with the same TID, in the
+# order the original nested loop of the fall detectors found them. Returns tids and heights arrays.
+def matchHeights(heights, tracks):
+    heights = np.asarray(heights)
+    heightIndex, trackIndex = joinTracks(heights, tracks)
+    if (len(heightIndex) == 0):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=heights.dtype)
+    matched = heights[heightIndex]
+    return matched[:, 0].astype(np.intp), matched[:, 1]
+
+# Split matches into rounds in which no TID repeats, keeping their order, so each round can be pushed at once
+# A frame normally has one height per track and so a single round.
+def matchRounds(tids, values):
+    sortedTids = np.sort(tids)
+    if (not (sortedTids[1:] == sortedTids[:-1]).any()):
+        return [(tids, values)]
+    uniqueTids, counts = np.unique(sortedTids, return_counts=True)
+    order = np.argsort(tids, kind='stable')
+    occurrence = np.empty(len(tids), dtype=np.intp)
+    occurrence[order] = np.arange(len(tids)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return [(tids[occurrence == n], values[occurrence == n]) for n in range(counts.max())]
+
+# Per frame cost of the window maximum of 30 tracks as the window grows, for TrackWindowExtrema, MonotonicWindow and
+# the maximum over the valid values of a TrackHistory ring
+if __name__ == "__main__":
+    maxNumTracks = 30
+    numFrames = 2000
+    heights = np.random.default_rng(0).uniform(0.2, 1.8, (numFrames, maxNumTracks))
+    tids = np.arange(maxNumTracks)
+    print('%10s %10s %18s %18s %14s' % ('window', 'seconds', 'TrackWindowExtrema', 'MonotonicWindow', 'TrackHistory'))
+    for windowLen in (27, 55, 109, 182, 364, 727):
+        extrema = TrackWindowExtrema(maxNumTracks, windowLen)
+        windows = [MonotonicWindow(windowLen) for tid in tids]
+        history = TrackHistory(maxNumTracks, windowLen)
+        columns = np.arange(windowLen)
+        timings = []
+        start = time.perf_counter()
+        for frame in heights:
+            extrema.push(tids, frame)
+            extrema.get(tids)
+        timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for frame in heights:
+            for tid in tids:
+                windows[tid].push(frame[tid])
+        timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for frame in heights:
+            history.push(tids, frame)
+            valid = (history.cursor[:, np.newaxis] - columns) % windowLen < history.numValid[:, np.newaxis]
+            np.where(valid, history.values, -np.inf).max(axis=1)
+        timings.append(time.perf_counter() - start)
+        print('%10d %10.1f %15.1f us %15.1f us %11.1f us' % ((windowLen, windowLen * 0.055) + tuple(t / numFrames * 1e6 for t in timings)))
@@ -0,0 +1,116 @@
+import logging
+log = logging.getLogger(__name__)
+
+UART_MAGIC_WORD = bytearray(b'\x02\x01\x04\x03\x06\x05\x08\x07')
+
+FRAME_PREFIX_LEN = 16 # Magic word, version and total packet length
+DEFAULT_BUFFER_SIZE = 65536
+MAX_FRAME_LENGTH = 1 << 20 # Anything longer is taken to be a false magic word match
+
+# Splits the byte stream from a serial port into whole frames
+# Instead of reading the port one byte at a time until the magic word turns up, the framer reads whatever the port
+# has waiting (or at least as much as the current frame still needs) into one reusable buffer and finds frame starts
+# with bytearray.find. Bytes belonging to the next frame stay in the buffer for the next call, so several frames
+# arriving in one read cost a single read.
+class UARTFramer:
+    def __init__(self, port, bufferSize = DEFAULT_BUFFER_SIZE, maxFrameLength = MAX_FRAME_LENGTH):
+        self.port = port
+        self.buffer = bytearray(bufferSize)
+        self.start = 0 # First byte not yet handed out
+        self.end = 0 # One past the last byte read
+        self.maxFrameLength = maxFrameLength
+        self.numDiscardedBytes = 0 # Bytes skipped while looking for a magic word
+
+    # Block until a whole frame has been read and return a copy of it
+    # With retryOnTimeout off, None is returned instead when a read times out, so a reader thread can check if it
+    # should stop. Bytes already read are kept for the next call.
+    def readFrame(self, retryOnTimeout = True):
+        frameStart, frameEnd = self.nextFrameSpan(retryOnTimeout)
+        if (frameStart is None):
+            return None
+        frameData = self.buffer[frameStart:frameEnd]
+        self.start = frameEnd
+        return frameData
+
+    # Same as readFrame, but the frame is copied into frame.rawBuffer() (see frame_pool.PooledFrame)
+    # Returns a view of the frame in that buffer
+    def readFrameInto(self, frame):
+        frameStart, frameEnd = self.nextFrameSpan()
+        frameLength = frameEnd - frameStart
+        rawView = memoryview(frame.rawBuffer(frameLength))[:frameLength]
+        with memoryview(self.buffer) as bufferView:
+            rawView[:] = bufferView[frameStart:frameEnd]
+        self.start = frameEnd
+        return rawView
+
+    # Endless stream of frames
+    def frames(self):
+        while (1):
+            yield self.readFrame()
+
+    # Read until the buffer holds a whole frame, returning where it starts and ends
+    def nextFrameSpan(self, retryOnTimeout = True):
+        while (1):
+            frameStart, numNeeded = self.findFrame()
+            if (numNeeded == 0):
+                return frameStart, frameStart + self.frameLength(frameStart)
+            if (self.fill(numNeeded) == 0 and not retryOnTimeout):
+                return None, None
+
+    # Look for the next frame in the buffered bytes
+    # Returns its start and 0 if it is complete, otherwise the number of bytes still missing
+    def findFrame(self):
+        while (1):
+            frameStart = self.buffer.find(UART_MAGIC_WORD, self.start, self.end)
+            if (frameStart < 0):
+                # Keep the tail in case it is the first part of a magic word
+                keep = min(self.end - self.start, len(UART_MAGIC_WORD) - 1)
+                self.numDiscardedBytes += self.end - self.start - keep
+                self.start = self.end - keep
+                return None, len(UART_MAGIC_WORD) - keep
+
+            self.numDiscardedBytes += frameStart - self.start
+            self.start = frameStart
+            numBuffered = self.end - frameStart
+            if (numBuffered < FRAME_PREFIX_LEN):
+                return frameStart, FRAME_PREFIX_LEN - numBuffered
+
+            frameLength = self.frameLength(frameStart)
+            if (frameLength < FRAME_PREFIX_LEN or frameLength > self.maxFrameLength):
+                log.warning('Invalid frame length %d after magic word, resynchronizing' % (frameLength))
+                self.start = frameStart + 1
+                continue
+            if (numBuffered < frameLength):
+                return frameStart, frameLength - numBuffered
+            return frameStart, 0
+
+    # totalPacketLen from the frame header, which is the length of the whole frame
+    def frameLength(self, frameStart):
+        return int.from_bytes(self.buffer[frameStart + 12:frameStart + FRAME_PREFIX_LEN], byteorder='little')
+
+    # Read at least numNeeded bytes, or everything the port already has waiting if that is more
+    # Returns the number of bytes read, 0 if the read timed out
+    def fill(self, numNeeded):
+        if (self.start == self.end):
+            self.start = self.end = 0
+        numToRead = max(self.port.in_waiting, numNeeded, 1)
+
+        # Make room, first by moving the unread bytes to the front and then by growing the buffer
+        if (self.end + numToRead > len(self.buffer) and self.start > 0):
+            numBuffered = self.end - self.start
+            self.buffer[:numBuffered] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, numBuffered
+        if (self.end + numToRead > len(self.buffer)):
+            buffer = bytearray(max(2 * len(self.buffer), self.end + numToRead))
+            buffer[:self.end] = self.buffer[:self.end]
+            self.buffer = buffer
+
+        with memoryview(self.buffer) as bufferView:
+            numRead = self.port.readinto(bufferView[self.end:self.end + numToRead])
+
+        # If the device doesn't transmit any data, the COMPort read function will eventually timeout
+        if (numRead == 0):
+            log.error("ERROR: No data detected on COM Port, read timed out")
+            log.error("\tBe sure that the device is in the proper mode, and that the cfg you are sending is valid")
+        self.end += numRead
+        return numRead